@@ -0,0 +1,182 @@
+import heapq, itertools, logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from telegram.error import BadRequest, RetryAfter, TelegramError, Unauthorized
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """Sends messages to many chats within Telegram's rate limits
+
+    Items sent under a topic are held for the topic's window and everything a
+    chat collected by then goes out as one message built by the topic's render.
+    Messages are paced to `rate` per second overall and one per `chat_interval`
+    seconds per chat. A 429 pauses all sending for the retry_after it asks for,
+    other failures are retried with exponential backoff up to `max_retries`.
+    """
+
+    def __init__(
+        self,
+        bot,
+        rate=25,
+        chat_interval=1.0,
+        max_retries=5,
+        backoff=1.0,
+        workers=4,
+        clock=time.monotonic,
+    ):
+        self.bot = bot
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.clock = clock
+
+        self.sent = 0
+        self.retries = 0
+        self.dropped = 0
+
+        self._topics = {}
+        self._pending = {}
+        self._queue = []
+        self._order = itertools.count()
+        self._last_sent = {}
+        self._next_slot = 0.0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._flushing = False
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="broadcast")
+        self._thread = None
+
+    def topic(self, name, render, window=0.0):
+        """Registers a topic merging items with render(items) after window seconds"""
+        self._topics[name] = (render, window)
+
+    def send(self, chat_ids, item, topic):
+        """Queues an item of a topic for each chat, merging it with any not yet sent"""
+        _, window = self._topics[topic]
+        with self._cond:
+            due = self.clock() + (0 if self._flushing else window)
+            for chat_id in chat_ids:
+                items = self._pending.get((chat_id, topic))
+                if items is not None:
+                    items.append(item)
+                    continue
+                self._pending[(chat_id, topic)] = [item]
+                heapq.heappush(self._queue, (due, next(self._order), chat_id, topic, 0))
+            self._cond.notify_all()
+
+    def backlog(self):
+        """Returns the number of messages waiting or being sent"""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def start(self):
+        """Starts the thread pacing the sends"""
+        self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=60.0):
+        """Sends what is queued without waiting out the windows, then stops
+
+        Messages still queued after timeout seconds are dropped.
+        """
+        with self._cond:
+            # Sending merged items now rather than at the end of their window,
+            # while retries keep their delays
+            self._flushing = True
+            now = self.clock()
+            self._queue = [
+                (min(due, now) if attempt == 0 else due, order, chat_id, topic, attempt)
+                for due, order, chat_id, topic, attempt in self._queue
+            ]
+            heapq.heapify(self._queue)
+            self._cond.notify()
+            if self._thread:
+                self._cond.wait_for(
+                    lambda: not self._pending and not self._in_flight, timeout
+                )
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        self._pool.shutdown()
+        if self._pending:
+            logger.warning("Dropped %d queued broadcast messages", len(self._pending))
+
+    def _run(self):
+        with self._cond:
+            while not self._stopping:
+                now = self.clock()
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+
+                due, _, chat_id, topic, attempt = self._queue[0]
+                wait = max(due, self._next_slot) - now
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+
+                # Keeping to one message per chat_interval for each chat
+                last_sent = self._last_sent.get(chat_id, float("-inf"))
+                if last_sent + self.chat_interval > now:
+                    retry_at = last_sent + self.chat_interval
+                    entry = (retry_at, next(self._order), chat_id, topic, attempt)
+                    heapq.heappush(self._queue, entry)
+                    continue
+
+                items = self._pending.pop((chat_id, topic), None)
+                if items is None:
+                    continue
+
+                self._last_sent[chat_id] = now
+                self._next_slot = max(self._next_slot, now) + 1 / self.rate
+                self._in_flight += 1
+                self._pool.submit(self._deliver, chat_id, topic, items, attempt)
+
+    def _deliver(self, chat_id, topic, items, attempt):
+        render, _ = self._topics[topic]
+        retry_in = None
+        flood = False
+        try:
+            self.bot.send_message(chat_id=chat_id, text=render(items))
+        except RetryAfter as e:
+            retry_in = e.retry_after
+            flood = True
+        except (Unauthorized, BadRequest) as e:
+            # Users who blocked the bot or deleted their chat
+            logger.info("Not broadcasting to chat %s: %s", chat_id, e)
+            with self._cond:
+                self._in_flight -= 1
+                self.dropped += 1
+                self._cond.notify_all()
+            return
+        except TelegramError as e:
+            retry_in = self.backoff * 2**attempt
+            logger.warning("Broadcast to chat %s failed: %s", chat_id, e)
+
+        with self._cond:
+            self._in_flight -= 1
+            if retry_in is None:
+                self.sent += 1
+            elif attempt >= self.max_retries:
+                self.dropped += 1
+                logger.warning("Gave up broadcasting to chat %s", chat_id)
+            else:
+                self.retries += 1
+                retry_at = self.clock() + retry_in
+
+                # A 429 means every send should hold off, not just this chat's
+                if flood:
+                    self._next_slot = max(self._next_slot, retry_at)
+
+                # Putting the items back ahead of any queued since
+                key = (chat_id, topic)
+                self._pending[key] = items + self._pending.get(key, [])
+                entry = (retry_at, next(self._order), chat_id, topic, attempt + 1)
+                heapq.heappush(self._queue, entry)
+            # Waking the pacing thread and any stop() waiting for the queue to drain
+            self._cond.notify_all()
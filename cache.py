@@ -0,0 +1,60 @@
+import threading
+
+
+class RenderCache:
+    """Caches rendered messages in groups that are invalidated together
+
+    A group is typically a school's subject, holding one entry per view of it. Counters
+    of hits and misses are kept for inspection.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._groups = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, group, key, render):
+        """Returns the cached entry, calling render() to build it on a miss"""
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries is not None and key in entries:
+                self.hits += 1
+                return entries[key]
+            self.misses += 1
+            generation = self._generations.get(group, 0)
+
+        value = render()
+
+        # Skipping the store if the group was invalidated while rendering
+        with self._lock:
+            if self._generations.get(group, 0) == generation:
+                self._groups.setdefault(group, {})[key] = value
+        return value
+
+    def invalidate(self, *groups):
+        """Drops every cached entry of the given groups"""
+        with self._lock:
+            for group in groups:
+                self._groups.pop(group, None)
+                self._generations[group] = self._generations.get(group, 0) + 1
+                self.invalidations += 1
+
+    def invalidate_where(self, match):
+        """Drops every cached entry of the groups for which match(group) is true"""
+        with self._lock:
+            groups = [group for group in self._groups if match(group)]
+        self.invalidate(*groups)
+
+    def stats(self):
+        """Returns the cache's counters and size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": sum(len(entries) for entries in self._groups.values()),
+            }
@@ -0,0 +1,240 @@
+import bisect, hashlib, http.client, json, logging, queue, socketserver, threading, time
+from http.server import HTTPServer
+
+from webhook import SECRET_HEADER, UpdateRequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes
+
+    Each node sits at `replicas` points of a ring of 64-bit hashes and a key
+    belongs to the first node after it. Adding or removing a node only moves
+    the keys next to its points, about 1/len(nodes) of them.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self._points = sorted(
+            (_hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in self._points]
+
+    def node(self, key):
+        """Returns the node a key belongs to"""
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._points)
+        return self._points[i][1]
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+class Cluster:
+    """This process's place among `workers` processes sharing one bot
+
+    Chats are spread over the workers by a HashRing, and the first worker is
+    the leader running the jobs that must run once. A single process is a
+    cluster of one.
+    """
+
+    def __init__(self, workers=1, index=0):
+        self.workers = workers
+        self.index = index
+        self.ring = HashRing(range(workers))
+
+    @property
+    def leader(self):
+        return self.index == 0
+
+    def owns(self, chat_id):
+        """Returns whether a chat's updates are handled by this worker"""
+        return self.workers == 1 or self.ring.node(chat_id) == self.index
+
+
+def update_chat(data):
+    """Returns the chat (or outside chats, the user) of an update's JSON
+
+    Matches dispatch.chat_key without building an Update.
+    """
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for holder in (value, value.get("message")):
+            if isinstance(holder, dict) and isinstance(holder.get("chat"), dict):
+                return holder["chat"]["id"]
+        if isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return 0
+
+
+class _Connection:
+    """One keep-alive connection to a worker, sending queued updates in order"""
+
+    def __init__(self, host, port, url_path, secret_token, name):
+        self.host = host
+        self.port = port
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.dropped = 0
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = None
+        while True:
+            body = self.queue.get()
+            if body is None:
+                break
+
+            # Retrying until the worker takes the update, so none is skipped
+            # unless the workers are being stopped too
+            delay = 0.1
+            while True:
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                    headers = {
+                        "Content-Type": "application/json",
+                        SECRET_HEADER: self.secret_token,
+                    }
+                    conn.request("POST", self.url_path, body, headers)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status == 200:
+                        self.sent += 1
+                        break
+                    logger.warning(
+                        "Worker %s:%d answered %d", self.host, self.port, response.status
+                    )
+                except (OSError, http.client.HTTPException) as e:
+                    if conn is not None:
+                        conn.close()
+                    conn = None
+                    # Workers close connections left idle, so a reused one
+                    # failing is retried at once on a new connection
+                    if reused:
+                        continue
+                    logger.warning(
+                        "Forwarding to %s:%d failed: %s", self.host, self.port, e
+                    )
+                if self._stopping:
+                    self.dropped += 1
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+        if conn is not None:
+            conn.close()
+
+    def stop(self):
+        self._stopping = True
+        self.queue.put(None)
+        self._thread.join()
+
+
+class _FrontHandler(UpdateRequestHandler):
+    """Hands each update to the front's forwarder"""
+
+    def accept(self, body):
+        self.server.forward(json.loads(body), body)
+
+
+class ClusterFront(socketserver.ThreadingMixIn, HTTPServer):
+    """Webhook listener forwarding each chat's updates to the worker owning it
+
+    Workers are WebhookServers on consecutive ports from worker_port. Every
+    worker is fed over `connections` keep-alive connections and a chat always
+    uses the same one. A connection sends its next update once the worker has
+    queued the last, so each chat's updates reach its worker in order. The
+    front only listens once started, and forwards polled updates without.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        listen,
+        port,
+        url_path,
+        secret_token,
+        workers,
+        worker_host,
+        worker_port,
+        worker_secret,
+        connections=4,
+    ):
+        # Binding in start(), as polling fronts don't listen
+        super().__init__((listen, port), _FrontHandler, bind_and_activate=False)
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.cluster = Cluster(workers)
+        self._connections = [
+            [
+                _Connection(
+                    worker_host,
+                    worker_port + worker,
+                    url_path,
+                    worker_secret,
+                    f"front-{worker}-{i}",
+                )
+                for i in range(connections)
+            ]
+            for worker in range(workers)
+        ]
+        self._thread = None
+
+    def forward(self, data, body=None):
+        """Queues an update's JSON for the worker owning its chat"""
+        chat = update_chat(data)
+        connections = self._connections[self.cluster.ring.node(chat)]
+        if body is None:
+            body = json.dumps(data, separators=(",", ":")).encode()
+        connections[hash(chat) % len(connections)].queue.put(body)
+
+    def backlog(self):
+        """Returns the number of updates waiting to be forwarded"""
+        return sum(c.queue.qsize() for worker in self._connections for c in worker)
+
+    def start(self):
+        """Listens and serves requests from a background thread"""
+        try:
+            self.server_bind()
+            self.server_activate()
+        except OSError:
+            self.server_close()
+            raise
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="front", daemon=True
+        )
+        self._thread.start()
+        logger.info("Listening for webhook updates on %s:%d", *self.server_address[:2])
+
+    def stop(self):
+        """Stops accepting updates, then forwards those already queued"""
+        if self._thread is not None:
+            self.shutdown()
+        self.server_close()
+        for worker in self._connections:
+            for connection in worker:
+                connection.stop()
+
+
+def poll_updates(bot, front, stopping, timeout=10):
+    """Long polls getUpdates, forwarding each update, until stopping is set"""
+    offset = None
+    while not stopping.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout)
+        except Exception:
+            logger.exception("Polling for updates failed")
+            time.sleep(1)
+            continue
+        for update in updates:
+            front.forward(update.to_dict())
+            offset = update.update_id + 1
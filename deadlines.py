@@ -0,0 +1,64 @@
+import threading, parsedatetime as pdt
+from collections import OrderedDict
+from datetime import date, datetime
+
+
+class DeadlineParser:
+    """Parses deadlines like "tomorrow" or "25 July" into dates in one timezone
+
+    Phrases are parsed against the current time in `tz` (None for the server's
+    local time) by one shared parsedatetime Calendar. Results are memoized in
+    an LRU of `maxsize` phrases that is emptied when the day changes in `tz`,
+    since relative phrases mean a different date every day.
+    """
+
+    def __init__(self, tz=None, maxsize=1024):
+        self.tz = tz
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        # Calendar.parse keeps state on the instance, so calls are serialised
+        self._calendar = pdt.Calendar()
+        self._cache = OrderedDict()
+        self._day = None
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Returns the current time in the parser's timezone"""
+        return datetime.now(self.tz)
+
+    def today(self):
+        """Returns the current date in the parser's timezone"""
+        return self.now().date()
+
+    def parse(self, text):
+        """Returns the date a phrase refers to, or None if it is not a date"""
+        return self.parse_many([text])[0]
+
+    def parse_many(self, texts):
+        """Parses a batch of phrases against one reading of the clock"""
+        now = self.now()
+        source_time = now.timetuple()
+        deadlines = []
+        with self._lock:
+            if now.date() != self._day:
+                self._cache.clear()
+                self._day = now.date()
+
+            for text in texts:
+                key = " ".join(text.lower().split())
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    deadlines.append(self._cache[key])
+                    continue
+
+                self.misses += 1
+                time_struct, status = self._calendar.parse(key, source_time)
+                deadline = date(*time_struct[:3]) if status else None
+                self._cache[key] = deadline
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+                deadlines.append(deadline)
+        return deadlines
@@ -0,0 +1,112 @@
+import logging, queue, threading
+from telegram import Update
+from telegram.ext import ConversationHandler, Dispatcher, JobQueue, Updater
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """Returns the chat an update belongs to, or its user's id outside chats"""
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+    return 0
+
+
+def iter_handlers(dispatcher):
+    """Yields every handler on a dispatcher, including those inside conversations"""
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield from handler.entry_points
+                for state in handler.states.values():
+                    yield from state
+                yield from handler.fallbacks
+            else:
+                yield handler
+
+
+class ChatDispatcher(Dispatcher):
+    """Dispatcher running the handlers of different chats concurrently
+
+    Updates are hashed by chat onto one of `lanes` worker threads, each handling
+    its updates one at a time. A slow handler only holds up the chats sharing
+    its lane, while each chat still sees its updates handled in order. In
+    private chats the user is the chat, so a user's user_data and conversation
+    state are only ever touched from one lane.
+    """
+
+    def __init__(self, bot, update_queue, lanes=8, **kwargs):
+        super().__init__(bot, update_queue, **kwargs)
+        self._lanes = [queue.Queue() for _ in range(lanes)]
+        self._lane_threads = []
+
+    def start(self, ready=None):
+        """Starts the lane threads, then hands updates out to them"""
+        if not self._lane_threads:
+            for i, lane in enumerate(self._lanes):
+                thread = threading.Thread(
+                    target=self._run_lane, args=(lane,), name=f"lane-{i}", daemon=True
+                )
+                thread.start()
+                self._lane_threads.append(thread)
+        super().start(ready)
+
+    def stop(self):
+        """Stops taking updates, then waits for the lanes to finish theirs"""
+        super().stop()
+        for lane in self._lanes:
+            lane.put(None)
+        for thread in self._lane_threads:
+            thread.join()
+        self._lane_threads = []
+
+    def process_update(self, update):
+        """Queues the update on its chat's lane"""
+        self._lanes[hash(chat_key(update)) % len(self._lanes)].put(update)
+
+    def _run_lane(self, lane):
+        while True:
+            update = lane.get()
+            if update is None:
+                break
+            try:
+                super().process_update(update)
+            except Exception:
+                logger.exception("Handling update %s failed", update)
+
+
+class ChatUpdater(Updater):
+    """Updater of a ChatDispatcher that also stops a WebhookServer feeding it
+
+    The server is stopped where PTB stops its own webhook listener, before
+    the dispatcher, so that no update arrives once the dispatcher stopped.
+    """
+
+    server = None
+
+    def _stop_httpd(self):
+        super()._stop_httpd()
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+
+def build_updater(bot, lanes=8, workers=4, persistence=None):
+    """Returns a ChatUpdater whose dispatcher is a ChatDispatcher with `lanes` lanes
+
+    The bot's connection pool should hold lanes + workers + 4 connections.
+    """
+    job_queue = JobQueue()
+    dispatcher = ChatDispatcher(
+        bot,
+        queue.Queue(),
+        lanes=lanes,
+        workers=workers,
+        job_queue=job_queue,
+        persistence=persistence,
+    )
+    job_queue.set_dispatcher(dispatcher)
+    return ChatUpdater(dispatcher=dispatcher, workers=None)
@@ -0,0 +1,204 @@
+import bisect, heapq
+import pandas as pd
+from datetime import date
+
+COLUMNS = ["subj", "task", "deadline"]
+
+
+class HomeworkTable:
+    """Homework records keyed by a stable homework id
+
+    Each subject also keeps its (deadline, id) pairs sorted by deadline, with the
+    deadlines already parsed, so listing a subject costs O(k) for its k tasks
+    and a page of them O(log k + page size). The subjects are kept sorted too.
+    A min-heap of the same pairs finds expired homework without a full scan;
+    removed homework leaves stale heap entries behind that are skipped lazily.
+    """
+
+    def __init__(self):
+        self._hw = {}
+        self._by_subject = {}
+        self._subjects = []
+        self._heap = []
+        self._next_id = 0
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds a table from a homework dataframe indexed by homework id"""
+        table = cls()
+        table.load_frame(df)
+        return table
+
+    def load_frame(self, df):
+        """Replaces the table's contents with a homework dataframe"""
+        # Older files may store deadlines as timestamps rather than dates
+        df = df.assign(
+            deadline=pd.to_datetime(df["deadline"], format="mixed").dt.strftime("%Y-%m-%d")
+        )
+
+        self._hw = {}
+        self._by_subject = {}
+        for row in df.itertuples():
+            hw_id = int(row.Index)
+            self._hw[hw_id] = {column: getattr(row, column) for column in COLUMNS}
+            self._by_subject.setdefault(row.subj, []).append(
+                (date.fromisoformat(row.deadline), hw_id)
+            )
+
+        for entries in self._by_subject.values():
+            entries.sort()
+        self._subjects = sorted(self._by_subject)
+        self._heap = [entry for entries in self._by_subject.values() for entry in entries]
+        heapq.heapify(self._heap)
+        self._next_id = max(self._hw, default=-1) + 1
+
+    def to_frame(self):
+        """Returns the table as a homework dataframe indexed by homework id"""
+        return pd.DataFrame.from_dict(dict(self._hw), orient="index", columns=COLUMNS)
+
+    def __len__(self):
+        return len(self._hw)
+
+    def items(self):
+        """Returns (homework id, record) pairs"""
+        return list(self._hw.items())
+
+    def get(self, hw_id):
+        """Returns the homework record or None"""
+        return self._hw.get(hw_id)
+
+    def add(self, subj, task, deadline):
+        """Adds a homework task due on deadline (YYYY-MM-DD) and returns its id"""
+        hw_id = self._next_id
+        self._next_id += 1
+        self._hw[hw_id] = {"subj": subj, "task": task, "deadline": deadline}
+        self._index(hw_id)
+        return hw_id
+
+    def add_many(self, subj, homework):
+        """Adds (task, deadline) pairs of one subject and returns their ids"""
+        if not homework:
+            return []
+
+        hw_ids = range(self._next_id, self._next_id + len(homework))
+        self._next_id += len(homework)
+
+        entries = self._by_subject.get(subj)
+        if entries is None:
+            entries = self._by_subject[subj] = []
+            bisect.insort(self._subjects, subj)
+        for hw_id, (task, deadline) in zip(hw_ids, homework):
+            self._hw[hw_id] = {"subj": subj, "task": task, "deadline": deadline}
+            entry = (date.fromisoformat(deadline), hw_id)
+            entries.append(entry)
+            heapq.heappush(self._heap, entry)
+
+        # Sorting once, which merges the new run in, rather than an insort each
+        entries.sort()
+        return list(hw_ids)
+
+    def remove(self, hw_id):
+        """Removes a homework task, returns its record or None"""
+        if hw_id in self._hw:
+            self._unindex(hw_id)
+        return self._hw.pop(hw_id, None)
+
+    def apply(self, op, hw_id, values):
+        """Replays a journalled change"""
+        if op == "delete":
+            self.remove(hw_id)
+            return
+
+        if hw_id in self._hw:
+            self._unindex(hw_id)
+        self._hw.setdefault(hw_id, {}).update(values)
+        self._index(hw_id)
+        self._next_id = max(self._next_id, hw_id + 1)
+
+    def page(self, subj, cursor=None, limit=10, before=False):
+        """Returns up to limit of a subject's homework after a (deadline, id) cursor
+
+        Going backwards returns those just before the cursor instead. Also returns
+        whether more homework lies beyond the page in that direction.
+        """
+        entries = self._by_subject.get(subj, [])
+        if before:
+            end = bisect.bisect_left(entries, cursor) if cursor else len(entries)
+            start = max(end - limit, 0)
+            more = start > 0
+        else:
+            start = bisect.bisect_right(entries, cursor) if cursor else 0
+            end = start + limit
+            more = end < len(entries)
+        homework = [
+            {"id": hw_id, "subj": subj, "task": self._hw[hw_id]["task"], "deadline": deadline}
+            for deadline, hw_id in entries[start:end]
+        ]
+        return homework, more
+
+    def subjects_page(self, cursor=None, limit=10, before=False):
+        """Returns up to limit subjects in order after a subject, or before it
+
+        Also returns whether more subjects lie beyond the page in that direction.
+        """
+        subjects = self._subjects
+        if before:
+            end = bisect.bisect_left(subjects, cursor) if cursor else len(subjects)
+            start = max(end - limit, 0)
+            return subjects[start:end], start > 0
+        start = bisect.bisect_right(subjects, cursor) if cursor else 0
+        return subjects[start : start + limit], start + limit < len(subjects)
+
+    def due_before(self, until):
+        """Returns homework due before a date, ordered by subject then deadline"""
+        due = []
+        for subj in sorted(self._by_subject):
+            entries = self._by_subject[subj]
+            for deadline, hw_id in entries[: bisect.bisect_left(entries, (until,))]:
+                hw = self._hw[hw_id]
+                due.append({"id": hw_id, "subj": subj, "task": hw["task"], "deadline": deadline})
+        return due
+
+    def next_deadline(self):
+        """Returns the earliest deadline of any homework or None"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def expired(self, now):
+        """Pops the ids of homework whose deadline day is over by now off the heap"""
+        today = now.date()
+        hw_ids = []
+        while self._drop_stale() and self._heap[0][0] < today:
+            hw_ids.append(heapq.heappop(self._heap)[1])
+        return hw_ids
+
+    def _drop_stale(self):
+        """Pops heap entries of removed or changed homework, returns whether any remain"""
+        heap = self._heap
+        while heap:
+            deadline, hw_id = heap[0]
+            hw = self._hw.get(hw_id)
+            if hw is not None and hw["deadline"] == deadline.isoformat():
+                return True
+            heapq.heappop(heap)
+        return False
+
+    def _entry(self, hw_id):
+        hw = self._hw[hw_id]
+        return hw["subj"], (date.fromisoformat(hw["deadline"]), hw_id)
+
+    def _index(self, hw_id):
+        subj, entry = self._entry(hw_id)
+        if subj not in self._by_subject:
+            self._by_subject[subj] = []
+            bisect.insort(self._subjects, subj)
+        bisect.insort(self._by_subject[subj], entry)
+        heapq.heappush(self._heap, entry)
+
+    def _unindex(self, hw_id):
+        subj, entry = self._entry(hw_id)
+        entries = self._by_subject[subj]
+        del entries[bisect.bisect_left(entries, entry)]
+        if not entries:
+            del self._by_subject[subj]
+            del self._subjects[bisect.bisect_left(self._subjects, subj)]
@@ -1,17 +1,81 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    TelegramError,
+)
 from telegram.ext import (
-    Updater,
     Filters,
     ConversationHandler,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
 )
-import logging, math, pytz, pandas as pd, parsedatetime as pdt
-from datetime import datetime, time, timedelta
+import io, itertools, logging, math, multiprocessing, re, secrets, signal, threading
+from apscheduler.jobstores.base import JobLookupError
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from zoneinfo import ZoneInfo
+from telegram.utils.request import Request
+from broadcast import Broadcaster
+from cache import RenderCache
+from cluster import Cluster, ClusterFront, poll_updates
+from deadlines import DeadlineParser
+from dispatch import build_updater
+from metrics import InstrumentedBot, MetricsServer, instrument_handlers
+from metrics import registry as metrics
+from reminders import ReminderQueue
+from search import HomeworkIndex
+from sessions import SessionPersistence, SessionStore
+from shards import IdleCache
+from storage import CsvStorage, SqliteStorage
+from timers import TimerWheel
+from uploads import read_homework_csv
+from users import DEFAULT_SCHOOL
+from webhook import WebhookServer, run_webhook
 
 TOKEN = "YOUR_TOKEN"
 
+# Run mode, either "polling" or "webhook". Webhook mode listens on
+# WEBHOOK_LISTEN:WEBHOOK_PORT behind a TLS terminating proxy serving WEBHOOK_URL,
+# and refuses to start without a random WEBHOOK_SECRET, which Telegram sends
+# along with every update.
+RUN_MODE = "polling"
+WEBHOOK_URL = "https://example.com/dionysus"
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/dionysus"
+WEBHOOK_SECRET = ""
+WEBHOOK_WORKERS = 4
+
+# Handlers of different chats run concurrently on this many threads, while
+# each chat's updates are still handled in order
+HANDLER_LANES = 8
+
+# With CLUSTER_WORKERS above 1, main() runs a front receiving the updates as
+# RUN_MODE says, which forwards them to CLUSTER_WORKERS worker processes
+# listening on localhost from CLUSTER_PORT up, over CLUSTER_CONNECTIONS
+# connections each. A chat always goes to the same worker, keeping its
+# updates in order and its conversation in that worker's memory. Workers
+# share the sqlite backend and pick up each other's homework every
+# CLUSTER_SYNC seconds. The first worker runs the expiry, reminder and
+# digest jobs. A worker that exits is restarted, unless it ran for less than
+# CLUSTER_MIN_UPTIME seconds, in which case the whole cluster shuts down.
+CLUSTER_WORKERS = 1
+CLUSTER_PORT = 8200
+CLUSTER_CONNECTIONS = 4
+CLUSTER_SYNC = 1
+CLUSTER_MIN_UPTIME = 30
+cluster = Cluster()
+
+# Prometheus metrics are served on METRICS_LISTEN:METRICS_PORT/metrics, and
+# by cluster workers on the ports after it. Set METRICS_PORT to None to turn
+# the endpoint off
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9100
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
@@ -28,7 +92,8 @@ END = ConversationHandler.END
     TEACHER_HW_DEADLINE,
     TEACHER_VIEWING,
     TEACHER_ADD_HW_RETURN,
-) = range(4, 9)
+    TEACHER_HW_UPLOAD,
+) = range(4, 10)
 
 (
     STUDENT_MENU,
@@ -38,28 +103,145 @@ END = ConversationHandler.END
     STUDENT_COMPLETED_TASKS,
     STUDENT_VIEW_SUBJECT,
     STUDENT_VIEWING,
-) = range(9, 16)
+) = range(10, 17)
 
-# Getting dataframes from CSV
-users_csv = "users.csv"
-users_df = pd.read_csv(users_csv, index_col=0)
+# Timezone that deadlines, homework expiry and the daily jobs follow, wherever
+# the bot is hosted. None uses the server's local time.
+TIMEZONE = ZoneInfo("Asia/Singapore")
+deadline_parser = DeadlineParser(TIMEZONE)
+
+# Subjects and homework listed per page of the menus
+SUBJECT_PAGE_SIZE = 8
+HOMEWORK_PAGE_SIZE = 10
+
+# Limits of the homework CSVs teachers upload, and how many bad rows to list
+HW_UPLOAD_MAX_BYTES = 1_000_000
+HW_UPLOAD_MAX_ROWS = 10_000
+HW_UPLOAD_MAX_ERRORS = 20
 
+# Storage backend, either "csv" or "sqlite"
+STORAGE_BACKEND = "csv"
+
+# The csv backend keeps the tables in memory. Changes are appended to the
+# journal and compacted into new snapshots by a background thread every
+# FLUSH_INTERVAL seconds or once FLUSH_MAX_CHANGES changes have piled up
+users_csv = "users.csv"
 hw_csv = "hw.csv"
-hw_df = pd.read_csv(hw_csv, index_col=0)
+pomodoro_csv = "pomodoros.csv"
+timers_csv = "timers.csv"
+journal_path = "journal.jsonl"
+FLUSH_INTERVAL = 300
+FLUSH_MAX_CHANGES = 10000
+
+# The sqlite backend queries an indexed database, see tools/migrate_csv.py
+sqlite_path = "dionysus.db"
+
+# Number of pomodoro sessions kept in each student's history
+POMODORO_HISTORY = 50
+
+# Every school sees only its own homework and students. Users register into a
+# school through a t.me/<bot>?start=school-<code> link, or into the default
+# school with a plain /start. The csv backend keeps each other school's
+# homework in a directory of SCHOOLS_DIR, loaded while the school is in use.
+# Schools unused for SCHOOL_IDLE seconds are unloaded, along with their
+# search index and rendered messages.
+SCHOOL_LINK = re.compile(r"school-([a-z0-9_-]{1,32})")
+SCHOOLS_DIR = "schools"
+SCHOOL_IDLE = 600
+
+if STORAGE_BACKEND == "sqlite":
+    storage = SqliteStorage(sqlite_path, POMODORO_HISTORY)
+else:
+    storage = CsvStorage(
+        users_csv,
+        hw_csv,
+        pomodoro_csv,
+        timers_csv,
+        journal_path,
+        FLUSH_INTERVAL,
+        FLUSH_MAX_CHANGES,
+        POMODORO_HISTORY,
+        SCHOOLS_DIR,
+        SCHOOL_IDLE,
+    )
+
+# Running pomodoros keyed by chat_id. main() points the callback at the job
+# queue so that sessions ending in the same tick are finished in one job.
+POMODORO_TICK = 1
+pomodoro_timers = TimerWheel(callback=None, tick=POMODORO_TICK)
+
+# Rendered homework lists grouped by (school, subject), and the subject
+# keyboard under (school, None). Inspect render_cache.stats() for hit and miss counts.
+render_cache = RenderCache()
+
+# Notifications to every student, paced to Telegram's limits of about 30
+# messages a second overall and one a second per chat. Homework added within
+# BROADCAST_WINDOW seconds of each other reaches a student as one message.
+# On shutdown, what is still queued is sent for up to BROADCAST_STOP_TIMEOUT
+# seconds before it is dropped.
+BROADCAST_RATE = 25
+BROADCAST_WINDOW = 30
+BROADCAST_STOP_TIMEOUT = 60
+broadcaster = Broadcaster(bot=None, rate=BROADCAST_RATE)
+
+# Students who send /digest get the homework due in the next DIGEST_DAYS
+# days every day at DIGEST_TIME in TIMEZONE
+DIGEST_TIME = time(8, 0)
+DIGEST_DAYS = 3
+
+# Homework is due at HOMEWORK_DUE_TIME on its deadline day, e.g. time(8, 0)
+# for the first lesson, and stays listed until that day is over. Students are
+# reminded of it REMINDER_OFFSETS before it is due. Reminders due within
+# REMINDER_WINDOW of each other go out as one message.
+HOMEWORK_DUE_TIME = time(23, 59)
+REMINDER_OFFSETS = (timedelta(hours=24), timedelta(hours=1))
+REMINDER_WINDOW = timedelta(minutes=5)
+reminders = ReminderQueue(REMINDER_OFFSETS, TIMEZONE, HOMEWORK_DUE_TIME)
+
+# Typing @bot followed by words in any chat searches the tasks and subjects of
+# the homework of the user's school. Telegram caches the results of a query for
+# INLINE_CACHE_TIME seconds and shows at most INLINE_RESULTS of them. Each
+# school's index is built on its first search.
+INLINE_CACHE_TIME = 30
+INLINE_RESULTS = 50
+homework_indexes = IdleCache(lambda school: _index_homework(school), SCHOOL_IDLE)
+
+# Conversation states and user_data survive restarts in SESSIONS_PATH. A
+# user's are read on their first update after a restart, changes are written
+# every SESSION_FLUSH_INTERVAL seconds or once SESSION_FLUSH_MAX_CHANGES have
+# piled up, and users idle for SESSION_IDLE seconds are dropped from memory.
+SESSIONS_PATH = "sessions.db"
+SESSION_FLUSH_INTERVAL = 5
+SESSION_FLUSH_MAX_CHANGES = 1000
+SESSION_IDLE = 3600
+sessions = SessionPersistence(
+    SessionStore(SESSIONS_PATH, SESSION_FLUSH_INTERVAL, SESSION_FLUSH_MAX_CHANGES),
+    SESSION_IDLE,
+)
+
+metrics.describe("active_pomodoros", "Pomodoros currently running")
+metrics.gauge("active_pomodoros", lambda: len(pomodoro_timers))
+metrics.describe("broadcast_backlog", "Broadcast messages waiting to be sent")
+metrics.gauge("broadcast_backlog", broadcaster.backlog)
+metrics.describe("loaded_sessions", "Users whose user_data is in memory")
+metrics.gauge("loaded_sessions", lambda: len(sessions.user_data or ()))
 
 # Helper Functions
 def _format_pomodoro(pomodoros):
-    """Receives a list of pomodoros and returns formatted text"""
+    """Receives a list of (start, duration, task) pomodoros and returns formatted text"""
     # Empty pomodoro list
     if not pomodoros:
         return "No tasks completed!"
 
     # Iterating through pomodoro list
     text = ""
-    for pomodoro in pomodoros:
+    for start, duration, task in pomodoros:
+        start_time = datetime.fromtimestamp(start)
+        end_time = start_time + timedelta(minutes=duration)
         text += (
-            f"{str(pomodoro['task'])}:\n"
-            f"{str(pomodoro['start_time'])} TO {str(pomodoro['end_time'])}\n\n"
+            f"{task}:\n"
+            f"{start_time.strftime('%d/%m %I:%M %p')} TO "
+            f"{end_time.strftime('%d/%m %I:%M %p')}\n\n"
         )
 
     return text
@@ -85,15 +267,215 @@ def _subject_buttons(subj_list):
     return buttons
 
 
+def _page(fetch, cursor, before):
+    """Fetches the page at a cursor, returns it and whether pages lie before and after
+
+    A page that has emptied out since its cursor was handed out, e.g. as its
+    homework expired, falls back to the first page.
+    """
+    items, more = fetch(cursor, before)
+    if not items and cursor is not None:
+        cursor, before = None, False
+        items, more = fetch(cursor, before)
+
+    if before:
+        return items, more, True
+    return items, cursor is not None, more
+
+
+def _page_buttons(prefix, prev_cursor, next_cursor):
+    """Returns the row of Previous and Next buttons, each carrying a cursor, or None"""
+    buttons = []
+    if prev_cursor is not None:
+        buttons.append(
+            InlineKeyboardButton("Previous", callback_data=f"{prefix}_prev:{prev_cursor}")
+        )
+    if next_cursor is not None:
+        buttons.append(
+            InlineKeyboardButton("Next", callback_data=f"{prefix}_next:{next_cursor}")
+        )
+    return buttons or None
+
+
+def _page_cursor(prefix, data):
+    """Returns the cursor and direction of a page button's callback data, if it is one"""
+    for direction, before in (("prev", True), ("next", False)):
+        if data.startswith(f"{prefix}_{direction}:"):
+            return data[len(prefix) + len(direction) + 2 :], before
+    return None, False
+
+
+def _subject_keyboard(school, page=0):
+    """Returns the cached keyboard of a page of a school's subjects that have homework
+
+    Pages are numbered from 0 in callback data, which a long subject name
+    would not fit in. A page that has emptied out since its button was sent
+    falls back to the first page.
+    """
+
+    def render():
+        # Fetching every subject up to the end of the page, a few dozen at most
+        subjects, more = storage.subjects_page(
+            None, (page + 1) * SUBJECT_PAGE_SIZE, school=school
+        )
+        shown = page if len(subjects) > page * SUBJECT_PAGE_SIZE else 0
+        if shown != page:
+            more = len(subjects) > SUBJECT_PAGE_SIZE
+        subjects = subjects[shown * SUBJECT_PAGE_SIZE :][:SUBJECT_PAGE_SIZE]
+
+        buttons = _subject_buttons(subjects)
+        navigation = _page_buttons(
+            "subjects", shown - 1 if shown else None, shown + 1 if more else None
+        )
+        if navigation:
+            buttons.insert(-1, navigation)
+        return InlineKeyboardMarkup(buttons)
+
+    return render_cache.get((school, None), ("subjects", page), render)
+
+
+def _homework_list(school, subj, back_text, back_callback, cursor=None, before=False):
+    """Returns the cached text and keyboard of a page of a subject's homework
+
+    Pages are keyed by a cursor of the (deadline, id) of the homework next to
+    them, written as YYYYMMDD.id in callback data.
+    """
+    if cursor is not None:
+        deadline, hw_id = cursor.split(".")
+        cursor = (datetime.strptime(deadline, "%Y%m%d").date(), int(hw_id))
+
+    def render():
+        homework, has_prev, has_next = _page(
+            lambda cursor, before: storage.homework_page(
+                subj, cursor, HOMEWORK_PAGE_SIZE, before, school
+            ),
+            cursor,
+            before,
+        )
+
+        text = f"Homework for {subj}\n\n"
+        for hw in homework:
+            deadline = hw["deadline"].strftime("%d %b %y")
+            text += f"- {hw['task']} by {deadline}\n"
+
+        # Default text for no homework
+        if not homework:
+            text = f"No homework yet for {subj}!"
+
+        def hw_cursor(hw):
+            return f"{hw['deadline'].strftime('%Y%m%d')}.{hw['id']}"
+
+        buttons = []
+        navigation = _page_buttons(
+            "hw",
+            hw_cursor(homework[0]) if homework and has_prev else None,
+            hw_cursor(homework[-1]) if homework and has_next else None,
+        )
+        if navigation:
+            buttons.append(navigation)
+        buttons.append([InlineKeyboardButton(back_text, callback_data=back_callback)])
+        return text, InlineKeyboardMarkup(buttons)
+
+    return render_cache.get((school, subj), (back_callback, cursor, before), render)
+
+
+def _new_homework_message(homework):
+    """Receives a list of (subj, task, deadline) homework and returns the notification"""
+    text = "New homework!\n\n"
+    for subj, task, deadline in homework:
+        text += f"- {subj}: {task} by {deadline.strftime('%d %b %y')}\n"
+    return text
+
+
+broadcaster.topic("homework", _new_homework_message, BROADCAST_WINDOW)
+
+
+def _upload_message(uploads):
+    """Receives (subj, count, first deadline) uploads and returns the notification"""
+    text = "New homework!\n\n"
+    for subj, count, deadline in uploads:
+        first_due = deadline.strftime("%d %b %y")
+        text += f"- {subj}: {count} tasks, the first due {first_due}\n"
+    return text
+
+
+broadcaster.topic("upload", _upload_message, BROADCAST_WINDOW)
+
+
+def _digest_message(homework):
+    """Receives homework ordered by subject and returns the daily digest"""
+    text = f"Homework due in the next {DIGEST_DAYS} days\n"
+    for subj, tasks in itertools.groupby(homework, key=lambda hw: hw["subj"]):
+        text += f"\n{subj}\n"
+        for hw in tasks:
+            text += f"- {hw['task']} by {hw['deadline'].strftime('%d %b %y')}\n"
+    return text
+
+
+broadcaster.topic("digest", "\n\n".join)
+
+
+def _reminder_message(due):
+    """Receives (offset, subj, task, deadline) reminders and returns the message"""
+    text = "Reminder!\n"
+    due = sorted(due, key=lambda reminder: (reminder[0], reminder[1]))
+    for offset, group in itertools.groupby(due, key=lambda reminder: reminder[0]):
+        hours = round(offset.total_seconds() / 3600)
+        text += f"\nDue in {hours} hour{'' if hours == 1 else 's'}\n"
+        for _, subj, task, deadline in group:
+            text += f"- {subj}: {task} by {deadline.strftime('%d %b %y')}\n"
+    return text
+
+
+broadcaster.topic("reminder", "\n\n".join)
+
+
+def _student_menu_keyboard():
+    """Returns the keyboard of the student's main menu"""
+    buttons = [
+        [
+            InlineKeyboardButton("Pomodoro", callback_data="pomodoro"),
+            InlineKeyboardButton("Homework", callback_data="homework"),
+        ],
+        [
+            InlineKeyboardButton("Completed Tasks", callback_data="completed_tasks"),
+            InlineKeyboardButton("Cancel", callback_data="cancel"),
+        ],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+
+def _pomodoro_keyboard(paused=False):
+    """Returns the pause or resume and cancel buttons of a running pomodoro"""
+    if paused:
+        toggle = InlineKeyboardButton("Resume", callback_data="pomodoro_resume")
+    else:
+        toggle = InlineKeyboardButton("Pause", callback_data="pomodoro_pause")
+
+    buttons = [[toggle, InlineKeyboardButton("Cancel", callback_data="pomodoro_cancel")]]
+    return InlineKeyboardMarkup(buttons)
+
+
+def _start_pomodoro_timer(user_data, chat_id, seconds):
+    """Starts or resumes a pomodoro timer, returning its formatted end time"""
+    end = datetime.now() + timedelta(seconds=seconds)
+    pomodoro_timers.schedule(chat_id, end.timestamp())
+
+    # Saving its end time to survive restarts
+    storage.set_timer(chat_id, int(end.timestamp()))
+
+    end_time = end.strftime("%d/%m %I:%M %p")
+    user_data["pomodoro_end_time"] = end_time
+    user_data.pop("pomodoro_remaining", None)
+    return end_time
+
+
 # Registration Conversation
 def start(update, context):
     """Entry point for all new users. Registers them as teacher or student user type."""
-    global users_df
-
     # Checking if user already has a type
     chat_id = update.effective_chat.id
-    index = users_df[users_df["chat_id"] == chat_id].index
-    user_type = users_df.loc[index, "user_type"].to_string(index=False)
+    user_type = storage.user_type(chat_id)
 
     # Filtering out users new and unregistered users
     if user_type == "student" or user_type == "teacher":
@@ -117,22 +499,31 @@ def start(update, context):
         text = "Are you a teacher or a student?"
 
     if update.message:
+        # Joining the school of a t.me/<bot>?start=school-<code> link
+        school = DEFAULT_SCHOOL
+        if context.args:
+            match = SCHOOL_LINK.fullmatch(context.args[0].lower())
+            if match is None:
+                update.message.reply_text(
+                    "That school link is not valid. Please ask your school for a new one."
+                )
+                return END
+            school = match.group(1)
+        context.user_data["school"] = school
+
         user_name = update.message.from_user.name
         chat_id = update.effective_chat.id
         update.message.reply_text(text, reply_markup=keyboard)
 
-        # Saving new users to the dataframe
-        if chat_id not in users_df["chat_id"].to_list():
-            row = pd.Series(
-                data={"chat_id": chat_id, "user_name": user_name}, name="row"
-            )
-            users_df = users_df.append(row, ignore_index=True)
-            users_df.to_csv(users_csv)
+        # Saving new users
+        storage.add_user(chat_id, user_name)
 
     # User chose not to confirm their submission
     elif update.callback_query.data:
         user_data = context.user_data
+        school = user_data.get("school", DEFAULT_SCHOOL)
         user_data.clear()
+        user_data["school"] = school
 
         query = update.callback_query
 
@@ -168,23 +559,13 @@ def reg_student_confirm(update, context):
 
 def reg_student_final(update, context):
     """Saving students's confirmation details"""
-    global users_df
-
-    # Creating an initial empty pomodoros list for students
-    user_data = context.user_data
-    if "pomodoros" not in user_data.keys():
-        user_data["pomodoros"] = []
-
     query = update.callback_query
     query.answer()
 
-    # Saving student's details to users dataframe
+    # Saving student's details
     chat_id = update.effective_chat.id
-    index = users_df[users_df["chat_id"] == chat_id].index
-
-    users_df.loc[index, "user_type"] = "student"
-    users_df.loc[index, "teacher_subject"] = "NaN"
-    users_df.to_csv(users_csv)
+    school = context.user_data.get("school", DEFAULT_SCHOOL)
+    storage.register_user(chat_id, "student", school=school)
 
     query.edit_message_text(
         "You have been successfully registered. Please input '/student' to proceed."
@@ -232,13 +613,11 @@ def reg_teacher_final(update, context):
     user_data = context.user_data
     subject = user_data["teacher_subject"]
 
-    # Saving teacher's details to users dataframe
+    # Saving teacher's details
     chat_id = update.effective_chat.id
-    index = users_df[users_df["chat_id"] == chat_id].index
-
-    users_df.loc[index, "user_type"] = "teacher"
-    users_df.loc[index, "teacher_subject"] = subject
-    users_df.to_csv(users_csv)
+    storage.register_user(
+        chat_id, "teacher", subject, user_data.get("school", DEFAULT_SCHOOL)
+    )
 
     query = update.callback_query
     query.answer()
@@ -251,15 +630,12 @@ def reg_teacher_final(update, context):
 # Teacher Conversation
 def teacher(update, context):
     """Teacher Main Menu"""
-    global users_df
-
     chat_id = update.effective_chat.id
     user_data = context.user_data
     user_data["chat_id"] = chat_id
 
     # Getting user's type
-    index = users_df[users_df["chat_id"] == chat_id].index
-    user_type = users_df.loc[index, "user_type"].to_string(index=False)
+    user_type = storage.user_type(chat_id)
 
     # Rejecting students
     if user_type == "student":
@@ -278,6 +654,7 @@ def teacher(update, context):
             InlineKeyboardButton("Add homework", callback_data="add_hw"),
             InlineKeyboardButton("View homework", callback_data="view_hw"),
         ],
+        [InlineKeyboardButton("Upload homework CSV", callback_data="upload_hw")],
         [InlineKeyboardButton("Cancel", callback_data="cancel")],
     ]
     keyboard = InlineKeyboardMarkup(buttons)
@@ -324,11 +701,10 @@ def teacher_add_hw_confirm(update, context):
     message = update.message
 
     # Getting date from string
-    cal = pdt.Calendar()
-    time_struct, parse_status = cal.parse(message.text)
+    deadline = deadline_parser.parse(message.text)
 
     # parsedatetime was not able to get a date from the input
-    if not parse_status:
+    if deadline is None:
         update.message.reply_text(
             "We didn't understand your input.\n\n"
             "What is the deadline of the homework?\n"
@@ -336,10 +712,8 @@ def teacher_add_hw_confirm(update, context):
         )
         return TEACHER_HW_DEADLINE
 
-    deadline = datetime.date(datetime(*time_struct[:6]))
-
     # Checking if teacher tried to set deadline in the past
-    if deadline < datetime.date(datetime.now()):
+    if deadline < deadline_parser.today():
         update.message.reply_text(
             "Your students can't travel to the past.\n"
             "Please set a deadline for the future!\n\n"
@@ -372,8 +746,7 @@ def teacher_add_hw_confirm(update, context):
 
 
 def teacher_add_hw_done(update, context):
-    """Saves the new homework in the dataframe then returns to main menu"""
-    global hw_df
+    """Saves the new homework then returns to main menu"""
     user_data = context.user_data
 
     # Homework details
@@ -382,57 +755,131 @@ def teacher_add_hw_done(update, context):
 
     # Getting subject taught by user
     chat_id = user_data["chat_id"]
-    index = users_df[users_df["chat_id"] == chat_id].index
-    subj = users_df.loc[index, "teacher_subject"].to_string(index=False)
+    subj = storage.teacher_subject(chat_id)
+    school = storage.school(chat_id)
 
-    # Adding to dataframe
-    row = pd.Series(data={"subj": subj, "task": task, "deadline": deadline}, name="row")
-    hw_df = hw_df.append(row, ignore_index=True)
-    hw_df.to_csv(hw_csv)
+    # Adding to homework table
+    hw_id = storage.add_homework(subj, task, deadline.isoformat(), school)
+    render_cache.invalidate((school, subj), (school, None))
+    _schedule_expiry(context.job_queue)
+
+    _remind(school, hw_id, subj, task, deadline, datetime.now(TIMEZONE))
+    _index_add(school, hw_id, subj, task, deadline)
+    _schedule_reminders(context.job_queue)
+
+    # Letting students know, merged with any other homework added shortly after
+    broadcaster.send(storage.students(school), (subj, task, deadline), "homework")
 
     user_data.clear()
 
     return teacher(update, context)
 
 
-def teacher_view_hw(update, context):
-    """For teacher to view their list of homework"""
+def teacher_upload_hw(update, context):
+    """Prompting for a CSV file of homework"""
     query = update.callback_query
     query.answer()
 
-    # Getting subject taught by user
-    user_data = context.user_data
-    chat_id = user_data["chat_id"]
-    index = users_df[users_df["chat_id"] == chat_id].index
-    subj = users_df.loc[index, "teacher_subject"].to_string(index=False)
-
     buttons = [
         [
             InlineKeyboardButton(
-                "Return to Teacher Main Menu",
-                callback_data="back_teacher_menu",
+                "Return to Teacher Main Menu", callback_data="back_teacher_menu"
             )
         ]
     ]
-    keyboard = InlineKeyboardMarkup(buttons)
+    query.edit_message_text(
+        "Send a CSV file with a task and its deadline on each line, e.g.\n\n"
+        "task,deadline\n"
+        "Worksheet 1,tomorrow\n"
+        "Essay,25 July",
+        reply_markup=InlineKeyboardMarkup(buttons),
+    )
 
-    # Taking part of the dataframe with only the related subjects
-    subj_indices = hw_df[hw_df["subj"] == subj].index
-    subj_df = hw_df.iloc[subj_indices]
+    return TEACHER_HW_UPLOAD
 
-    subj_df["deadline"] = pd.to_datetime(subj_df["deadline"])
 
-    # Formatting string for list of homework
-    text = f"Homework for {subj}\n\n"
-    for row in subj_df.itertuples():
-        task = getattr(row, "task")
-        deadline = getattr(row, "deadline")
-        deadline = deadline.strftime("%d %b %y")
-        text += f"- {task} by {deadline}\n"
+def teacher_upload_hw_done(update, context):
+    """Validating an uploaded CSV of homework and adding all of it at once"""
+    started = perf_counter()
+    document = update.message.document
 
-    # Default text for no homework
-    text = "No homework yet for {subj}!" if text == f"Homework for {subj}\n\n" else text
+    # Rejecting files too big to read within one update, and those of unknown
+    # size, as the whole file is downloaded into memory
+    if not document.file_size or document.file_size > HW_UPLOAD_MAX_BYTES:
+        update.message.reply_text(
+            f"That file is too big. Please send at most {HW_UPLOAD_MAX_ROWS} tasks "
+            f"in a file under {HW_UPLOAD_MAX_BYTES // 1000} kB."
+        )
+        return TEACHER_HW_UPLOAD
+
+    buffer = io.BytesIO()
+    document.get_file().download(out=buffer)
+    buffer.seek(0)
+    homework, errors = read_homework_csv(buffer, deadline_parser, HW_UPLOAD_MAX_ROWS)
+
+    # Adding nothing until every row is valid, so the fixed file can be resent
+    if errors or not homework:
+        text = "No homework was added.\n\n"
+        if not errors:
+            text += "The file has no tasks.\n"
+        for line, error in errors[:HW_UPLOAD_MAX_ERRORS]:
+            text += f"Line {line}: {error}\n"
+        if len(errors) > HW_UPLOAD_MAX_ERRORS:
+            text += f"and {len(errors) - HW_UPLOAD_MAX_ERRORS} more errors\n"
+        update.message.reply_text(text + "\nPlease fix the file and send it again.")
+        return TEACHER_HW_UPLOAD
 
+    # Getting subject taught by user
+    chat_id = update.effective_chat.id
+    subj = storage.teacher_subject(chat_id)
+    school = storage.school(chat_id)
+
+    hw_ids = storage.add_homework_many(subj, homework, school)
+    render_cache.invalidate((school, subj), (school, None))
+    _schedule_expiry(context.job_queue)
+
+    now = datetime.now(TIMEZONE)
+    for hw_id, (task, deadline) in zip(hw_ids, homework):
+        deadline = date.fromisoformat(deadline)
+        _remind(school, hw_id, subj, task, deadline, now)
+        _index_add(school, hw_id, subj, task, deadline)
+    _schedule_reminders(context.job_queue)
+
+    # One notification for the whole file
+    first_deadline = date.fromisoformat(min(deadline for _, deadline in homework))
+    upload = (subj, len(homework), first_deadline)
+    broadcaster.send(storage.students(school), upload, "upload")
+
+    logger.info(
+        "Added %d uploaded homework for %s in %.1f ms",
+        len(homework),
+        subj,
+        (perf_counter() - started) * 1000,
+    )
+    update.message.reply_text(f"Added {len(homework)} homework for {subj}.")
+    return teacher(update, context)
+
+
+def teacher_view_hw(update, context):
+    """For teacher to view their list of homework"""
+    query = update.callback_query
+    query.answer()
+
+    # Getting subject taught by user
+    user_data = context.user_data
+    chat_id = user_data["chat_id"]
+    subj = storage.teacher_subject(chat_id)
+
+    # Turning to another page when a Previous or Next button was pressed
+    cursor, before = _page_cursor("hw", query.data)
+    text, keyboard = _homework_list(
+        storage.school(chat_id),
+        subj,
+        "Return to Teacher Main Menu",
+        "back_teacher_menu",
+        cursor,
+        before,
+    )
     query.edit_message_text(text, reply_markup=keyboard)
 
     return TEACHER_VIEWING
@@ -441,12 +888,9 @@ def teacher_view_hw(update, context):
 # Student Conversation
 def student(update, context):
     """Student Main Menu"""
-    global users_df
-
     chat_id = update.effective_chat.id
 
-    index = users_df[users_df["chat_id"] == chat_id].index
-    user_type = users_df.loc[index, "user_type"].to_string(index=False)
+    user_type = storage.user_type(chat_id)
     # Rejecting teachers
     if user_type == "teacher":
         update.message.reply_text(
@@ -459,23 +903,7 @@ def student(update, context):
         update.message.reply_text("You have not registered yet! Send /start to begin.")
         return END
 
-    user_data = context.user_data
-
-    # Creating another pomodoro list in case it was cleared prior
-    if "pomodoros" not in user_data.keys():
-        user_data["pomodoros"] = []
-
-    buttons = [
-        [
-            InlineKeyboardButton("Pomodoro", callback_data="pomodoro"),
-            InlineKeyboardButton("Homework", callback_data="homework"),
-        ],
-        [
-            InlineKeyboardButton("Completed Tasks", callback_data="completed_tasks"),
-            InlineKeyboardButton("Cancel", callback_data="cancel"),
-        ],
-    ]
-    keyboard = InlineKeyboardMarkup(buttons)
+    keyboard = _student_menu_keyboard()
 
     if update.message:
         update.message.reply_text("Student's Menu", reply_markup=keyboard)
@@ -486,7 +914,7 @@ def student(update, context):
 
     # Student was sent here to clear history
     if query.data == "clear_history":
-        user_data["pomodoros"] = []
+        storage.clear_pomodoros(chat_id)
 
         query.edit_message_text(
             "History Cleared!\n\nStudent's Menu", reply_markup=keyboard
@@ -514,20 +942,8 @@ def student_pomodoro_duration(update, context):
     message = update.message
     user_data = context.user_data
 
-    task = message.text.capitalize()
-
-    # Adding in a pomodoro
-    if "pomodoros" not in user_data.keys():
-        user_data["pomodoros"] = []
-
-    user_data["pomodoros"].append(
-        {
-            "task": task,
-            "start_time": datetime.now().strftime("%d/%m %I:%M %p"),
-            "end_time": None,
-            "duration": None,
-        }
-    )
+    # Temporary storage for the pomodoro's name
+    user_data["pomodoro_task"] = message.text.capitalize()
 
     message.reply_text(
         "How long is your pomodoro session in minutes? (180 minutes maximum)"
@@ -556,49 +972,160 @@ def student_pomodoro_start(update, context):
         )
         return STUDENT_POMODORO_DURATION
 
-    # Storing pomodoro information in user_data
+    # Saving the pomodoro to the student's history, keeping its start so that
+    # resuming or cancelling it can update the entry
     user_data = context.user_data
-    user_data["pomodoros"][-1]["duration"] = duration
-    user_data["pomodoros"][-1]["end_time"] = (
-        datetime.now() + timedelta(minutes=duration)
-    ).strftime("%d/%m %I:%M %p")
-    task = user_data["pomodoros"][-1]["task"]
-    end_time = user_data["pomodoros"][-1]["end_time"]
+    task = user_data["pomodoro_task"]
+    chat_id = update.effective_chat.id
+    start = int(datetime.now().timestamp())
+    storage.add_pomodoro(chat_id, start, duration, task)
+    user_data["pomodoro_start"] = start
+
+    # Sending a scheduled message
+    end_time = _start_pomodoro_timer(user_data, chat_id, duration * 60)
     plural = "" if duration == 1 else "s"
     update.message.reply_text(
-        f"Pomodoro Session {task} for {duration} minute{plural} ending at {end_time}"
+        f"Pomodoro Session {task} for {duration} minute{plural} ending at {end_time}",
+        reply_markup=_pomodoro_keyboard(),
     )
 
-    # Sending a scheduled message
     user_data["message_id"] = message.message_id
-    context.job_queue.run_once(
-        student_end_pomodoro, duration * 60, context=update.message.chat_id
-    )
     return STUDENT_POMODORO_IN_SESSION
 
 
 def student_pomodoro_in_session(update, context):
     """Sends a user a response if any update received during pomodoro session"""
     user_data = context.user_data
-    end_time = user_data["pomodoros"][-1]["end_time"]
-    update.message.reply_text(f"Please focus on your pomodoro task until {end_time}")
+    if "pomodoro_remaining" in user_data:
+        update.message.reply_text(
+            "Your pomodoro is paused.", reply_markup=_pomodoro_keyboard(paused=True)
+        )
+        return STUDENT_POMODORO_IN_SESSION
+
+    end_time = user_data["pomodoro_end_time"]
+    update.message.reply_text(
+        f"Please focus on your pomodoro task until {end_time}",
+        reply_markup=_pomodoro_keyboard(),
+    )
     return STUDENT_POMODORO_IN_SESSION
 
 
+def student_pomodoro_pause(update, context):
+    """Pausing a running pomodoro, keeping the time it had left"""
+    query = update.callback_query
+    query.answer()
+
+    chat_id = update.effective_chat.id
+    remaining = pomodoro_timers.cancel(chat_id)
+
+    # The session ended just before the button was pressed
+    if remaining is None:
+        return STUDENT_POMODORO_IN_SESSION
+
+    storage.remove_timer(chat_id)
+    context.user_data["pomodoro_remaining"] = remaining
+
+    minutes = math.ceil(remaining / 60)
+    plural = "" if minutes == 1 else "s"
+    query.edit_message_text(
+        f"Pomodoro paused with {minutes} minute{plural} left.",
+        reply_markup=_pomodoro_keyboard(paused=True),
+    )
+    return STUDENT_POMODORO_IN_SESSION
+
+
+def student_pomodoro_resume(update, context):
+    """Resuming a paused pomodoro for the time it had left"""
+    query = update.callback_query
+    query.answer()
+
+    user_data = context.user_data
+    if "pomodoro_remaining" not in user_data:
+        return STUDENT_POMODORO_IN_SESSION
+
+    chat_id = update.effective_chat.id
+    remaining = user_data["pomodoro_remaining"]
+    end_time = _start_pomodoro_timer(user_data, chat_id, remaining)
+
+    # Stretching the session in the history to its new end
+    start = user_data.get("pomodoro_start")
+    if start is not None:
+        end = datetime.now().timestamp() + remaining
+        minutes = round((end - start) / 60)
+        storage.add_pomodoro(chat_id, start, minutes, user_data["pomodoro_task"])
+
+    query.edit_message_text(
+        f"Pomodoro resumed, ending at {end_time}", reply_markup=_pomodoro_keyboard()
+    )
+    return STUDENT_POMODORO_IN_SESSION
+
+
+def student_pomodoro_cancel(update, context):
+    """Cancelling a running or paused pomodoro and returning to the menu"""
+    query = update.callback_query
+    query.answer()
+
+    user_data = context.user_data
+    chat_id = update.effective_chat.id
+    pomodoro_timers.cancel(chat_id)
+    running = storage.remove_timer(chat_id)
+    paused = user_data.pop("pomodoro_remaining", None) is not None
+
+    # Dropping the session from the history, unless it had already finished
+    start = user_data.pop("pomodoro_start", None)
+    if (running or paused) and start is not None:
+        storage.remove_pomodoro(chat_id, start)
+
+    query.edit_message_text(
+        "Pomodoro cancelled.\n\nStudent's Menu", reply_markup=_student_menu_keyboard()
+    )
+    return STUDENT_MENU
+
+
+@metrics.timed("job")
 def student_end_pomodoro(context):
-    """Informing user that session is done"""
+    """Informing users in the job's list of chat_ids that their sessions are done"""
     buttons = [
         [InlineKeyboardButton("Back to Menu", callback_data="back_student_menu")]
     ]
     keyboard = InlineKeyboardMarkup(buttons)
-    context.bot.send_message(
-        chat_id=context.job.context,
-        text=f"Pomdoro Session done!",
-        reply_markup=keyboard,
-    )
+
+    for chat_id in context.job.context:
+        # Skipping sessions cancelled or paused since the timer fired
+        if not storage.remove_timer(chat_id):
+            continue
+        try:
+            context.bot.send_message(
+                chat_id=chat_id,
+                text=f"Pomdoro Session done!",
+                reply_markup=keyboard,
+            )
+        except TelegramError:
+            logger.warning("Could not end the pomodoro of chat %s", chat_id)
     return STUDENT_POMODORO_IN_SESSION
 
 
+def _rehydrate_pomodoros():
+    """Reschedules the pomodoros that were running when the bot last stopped"""
+    started = perf_counter()
+    now = datetime.now().timestamp()
+
+    # Pomodoros that finished while the bot was down all fire on the first tick,
+    # on the worker handling the student's chat
+    timers = [(chat_id, end) for chat_id, end in storage.timers() if cluster.owns(chat_id)]
+    overdue = 0
+    for chat_id, end in timers:
+        pomodoro_timers.schedule(chat_id, end)
+        overdue += end <= now
+
+    logger.info(
+        "Rehydrated %d pomodoros (%d overdue) in %.1f ms",
+        len(timers),
+        overdue,
+        (perf_counter() - started) * 1000,
+    )
+
+
 def student_completed_tasks(update, context):
     """Showing completed pomodoro tasks"""
     buttons = [
@@ -609,7 +1136,7 @@ def student_completed_tasks(update, context):
     ]
 
     keyboard = InlineKeyboardMarkup(buttons)
-    text = _format_pomodoro(context.user_data["pomodoros"])
+    text = _format_pomodoro(storage.pomodoros(update.effective_chat.id))
 
     if update.message:
         update.message.reply_text(text, reply_markup=keyboard)
@@ -627,11 +1154,11 @@ def student_view_subject(update, context):
     query = update.callback_query
     query.answer()
 
-    # Taking all the unique subjects in the homework dataframe
-    subj_list = hw_df["subj"].unique().tolist()
-    buttons = _subject_buttons(subj_list)
-
-    keyboard = InlineKeyboardMarkup(buttons)
+    # Keyboard of a page of the unique subjects in the homework table, the
+    # first for buttons sent before pages were numbered
+    cursor, _ = _page_cursor("subjects", query.data)
+    page = int(cursor) if cursor and cursor.isdigit() else 0
+    keyboard = _subject_keyboard(storage.school(update.effective_chat.id), page)
 
     query.edit_message_text("Which subject do you wish to view", reply_markup=keyboard)
     return STUDENT_VIEW_SUBJECT
@@ -642,23 +1169,18 @@ def student_view_homework(update, context):
     query = update.callback_query
     query.answer()
 
-    subj = query.data.capitalize()
-
-    subj_indices = hw_df[hw_df["subj"] == subj].index
-    subj_df = hw_df.iloc[subj_indices]
-
-    # Text formatting for homework list
-    subj_df["deadline"] = pd.to_datetime(subj_df["deadline"])
-    text = f"Homework for {subj}\n\n"
-    for row in subj_df.itertuples():
-        task = getattr(row, "task")
-        deadline = getattr(row, "deadline")
-        deadline = deadline.strftime("%d %b %y")
-        text += f"- {task} by {deadline}\n"
-
-    buttons = [[InlineKeyboardButton("Back", callback_data="back_subjects")]]
-    keyboard = InlineKeyboardMarkup(buttons)
-
+    # Page buttons are about the subject the student picked before
+    cursor, before = _page_cursor("hw", query.data)
+    if cursor is None:
+        context.user_data["subj"] = query.data.capitalize()
+    subj = context.user_data.get("subj")
+    if subj is None:
+        return student_view_subject(update, context)
+
+    school = storage.school(update.effective_chat.id)
+    text, keyboard = _homework_list(
+        school, subj, "Back", "back_subjects", cursor, before
+    )
     query.edit_message_text(text, reply_markup=keyboard)
 
     return STUDENT_VIEWING
@@ -679,13 +1201,258 @@ def cancel(update, context):
     return END
 
 
-# Daily Homework Cleaning
+# Job Scheduling
+schedule_lock = threading.Lock()
+
+
+def _schedule_job(job_queue, name, when, callback):
+    """Schedules the job of a name to run callback at when, or none if when is None"""
+    with schedule_lock:
+        # Keeping a job that is already due then, otherwise replacing it
+        for job in job_queue.get_jobs_by_name(name):
+            if job.context == when:
+                return
+            try:
+                job.schedule_removal()
+            except JobLookupError:
+                # The job is running and will reschedule itself
+                pass
+
+        if when is None:
+            return
+
+        delay = max((when - datetime.now(TIMEZONE)).total_seconds(), 0)
+        job_queue.run_once(callback, delay, context=when, name=name)
+
+
+# Homework Expiry
+def _schedule_expiry(job_queue):
+    """Schedules homework_clearing for the end of the earliest homework deadline day"""
+    if not cluster.leader:
+        return
+    deadline = storage.next_deadline()
+
+    # Homework stays listed through its deadline day
+    due = deadline and datetime.combine(
+        deadline + timedelta(days=1), time.min, tzinfo=TIMEZONE
+    )
+    _schedule_job(job_queue, "homework_clearing", due, homework_clearing)
+
+
+@metrics.timed("job")
 def homework_clearing(context):
-    '''Removing old homework daily'''
-    global hw_df
-    hw_df["deadline"] = pd.to_datetime(hw_df["deadline"])
-    hw_df = hw_df[hw_df["deadline"] > datetime.now()]
-    hw_df.to_csv(hw_csv)
+    '''Removing homework once its deadline day is over'''
+    expired = storage.expire_homework(datetime.now(TIMEZONE))
+    render_cache.invalidate(
+        *{(hw["school"], hw["subj"]) for hw in expired},
+        *{(hw["school"], None) for hw in expired},
+    )
+    for hw in expired:
+        reminders.remove((hw["school"], hw["id"]))
+        index = homework_indexes.peek(hw["school"])
+        if index is not None:
+            index.remove(hw["id"])
+
+    _schedule_expiry(context.job_queue)
+
+
+# Deadline Reminders
+def _schedule_reminders(job_queue):
+    """Schedules send_reminders for when the earliest reminder is due"""
+    if not cluster.leader:
+        return
+    _schedule_job(job_queue, "reminders", reminders.next_time(), send_reminders)
+
+
+@metrics.timed("job")
+def send_reminders(context):
+    """Reminding the students of each school of the homework whose reminders are due"""
+    due = reminders.due(datetime.now(TIMEZONE) + REMINDER_WINDOW)
+    due.sort(key=lambda reminder: reminder[0][0])
+    for school, group in itertools.groupby(due, key=lambda reminder: reminder[0][0]):
+        message = _reminder_message([reminder[1:] for reminder in group])
+        broadcaster.send(storage.students(school), message, "reminder")
+    if due:
+        logger.info("Queued %d homework reminders", len(due))
+
+    _schedule_reminders(context.job_queue)
+
+
+def _load_reminders():
+    """Queues the reminders of every school's homework that are still ahead"""
+    now = datetime.now(TIMEZONE)
+    for school in storage.schools():
+        for hw in storage.homework_due(date.max, school):
+            _remind(school, hw["id"], hw["subj"], hw["task"], hw["deadline"], now)
+
+
+def _remind(school, hw_id, subj, task, deadline, now):
+    """Queues a homework's reminders, which only the leading worker sends"""
+    if cluster.leader:
+        reminders.add((school, hw_id), subj, task, deadline, now)
+
+
+# Daily Digest
+def digest(update, context):
+    """Subscribing students to the daily digest, or unsubscribing with /digest off"""
+    chat_id = update.effective_chat.id
+    if storage.user_type(chat_id) != "student":
+        update.message.reply_text(
+            "The daily digest is for students. Send /start to register as one."
+        )
+        return
+
+    if context.args and context.args[0].lower() == "off":
+        storage.set_digest(chat_id, False)
+        update.message.reply_text("You will no longer get the daily digest.")
+        return
+
+    storage.set_digest(chat_id, True)
+    update.message.reply_text(
+        f"Every day at {DIGEST_TIME.strftime('%I:%M %p')} you will get the homework "
+        f"due in the next {DIGEST_DAYS} days. Send /digest off to stop."
+    )
+
+
+def _schedule_digest(job_queue, after=None):
+    """Schedules send_digest for the first DIGEST_TIME after a time, or after now"""
+    if not cluster.leader:
+        return
+    after = after or datetime.now(TIMEZONE)
+
+    # Working out the delay here, as PTB's run_daily only takes pytz timezones
+    day = after.date()
+    due = datetime.combine(day, DIGEST_TIME, tzinfo=TIMEZONE)
+    if due <= after:
+        due = datetime.combine(day + timedelta(days=1), DIGEST_TIME, tzinfo=TIMEZONE)
+    _schedule_job(job_queue, "digest", due, send_digest)
+
+
+@metrics.timed("job")
+def send_digest(context):
+    """Sending subscribed students the homework due in the next DIGEST_DAYS days"""
+    started = perf_counter()
+
+    until = datetime.now(TIMEZONE).date() + timedelta(days=DIGEST_DAYS)
+    homework_count = student_count = 0
+    for school in storage.schools(until):
+        homework = storage.homework_due(until, school)
+        students = storage.digest_subscribers(school)
+        if not homework or not students:
+            continue
+
+        # Every student follows every subject, so one message serves a school
+        broadcaster.send(students, _digest_message(homework), "digest")
+        homework_count += len(homework)
+        student_count += len(students)
+
+    logger.info(
+        "Queued the digest of %d homework for %d students in %.1f ms",
+        homework_count,
+        student_count,
+        (perf_counter() - started) * 1000,
+    )
+
+    _schedule_digest(context.job_queue, context.job.context)
+
+
+# Inline Search
+def _index_homework(school):
+    """Returns a new search index of a school's homework"""
+    index = HomeworkIndex()
+    for hw in storage.homework_due(date.max, school):
+        index.add(hw["id"], hw["subj"], hw["task"], hw["deadline"])
+    return index
+
+
+def _index_add(school, hw_id, subj, task, deadline):
+    """Adds new homework to its school's search index, if that has been built"""
+    index = homework_indexes.peek(school)
+    if index is not None:
+        index.add(hw_id, subj, task, deadline)
+
+
+def inline_search(update, context):
+    """Answering @bot queries with the homework whose task or subject match"""
+    query = update.inline_query
+
+    # Only registered users get results, others are pointed to /start
+    user_id = update.effective_user.id
+    if storage.user_type(user_id) is None:
+        query.answer(
+            [],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            switch_pm_text="Register to search homework",
+            switch_pm_parameter="search",
+        )
+        return
+
+    results = []
+    index = homework_indexes.get(storage.school(user_id))
+    for hw_id, subj, task, deadline in index.search(query.query, INLINE_RESULTS):
+        str_deadline = deadline.strftime("%d %b %y")
+        results.append(
+            InlineQueryResultArticle(
+                id=str(hw_id),
+                title=f"{subj}: {task}",
+                description=f"Due {str_deadline}",
+                input_message_content=InputTextMessageContent(
+                    f"{subj}: {task} by {str_deadline}"
+                ),
+            )
+        )
+    # Results differ between schools
+    query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+
+# Cluster
+homework_versions = {}
+
+
+@metrics.timed("job")
+def sync_homework(context):
+    """Picking up the homework that other workers added or expired"""
+    versions = storage.homework_versions()
+    changed = {
+        school
+        for school, version in versions.items()
+        if homework_versions.get(school) != version
+    }
+    homework_versions.update(versions)
+    if not changed:
+        return
+
+    render_cache.invalidate_where(lambda group: group[0] in changed)
+    for school in changed:
+        homework_indexes.discard(school)
+
+    if cluster.leader:
+        now = datetime.now(TIMEZONE)
+        for school in changed:
+            for hw in storage.homework_due(date.max, school):
+                _remind(school, hw["id"], hw["subj"], hw["task"], hw["deadline"], now)
+        _schedule_expiry(context.job_queue)
+        _schedule_reminders(context.job_queue)
+
+
+# Idle Schools
+@metrics.timed("job")
+def evict_idle_schools(context):
+    """Unloading the homework, search indexes and messages of schools not used lately"""
+    schools = set(storage.evict_idle_shards())
+    schools.update(homework_indexes.evict_idle())
+    if schools:
+        render_cache.invalidate_where(lambda group: group[0] in schools)
+        logger.info("Unloaded %d idle schools", len(schools))
+
+
+@metrics.timed("job")
+def evict_idle_sessions(context):
+    """Dropping the conversations and user_data of users idle for a while from memory"""
+    evicted = sessions.evict_idle()
+    if evicted:
+        logger.info("Unloaded the sessions of %d idle users", evicted)
 
 
 # Helper Commands
@@ -694,16 +1461,20 @@ def help(update, _):
     update.message.reply_text(
         "Here is the list of commands you can send:\n\n"
         "/start to register (for new users)\n"
+        "/digest to get homework due soon every morning\n"
+        "@ this bot followed by words in any chat to search homework\n"
         "/student if you're a student"
         "/start if you're a teacher"
         "/help for more information"
     )
 
 
-def main():
-    # Initialisation
-    updater = Updater(token=TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
+def add_handlers(dispatcher):
+    """Registers the conversations and commands on a dispatcher
+
+    The conversations are persistent when the dispatcher has a persistence.
+    """
+    persistent = dispatcher.persistence is not None
 
     # Registration Conversation
     reg_conv = ConversationHandler(
@@ -726,6 +1497,8 @@ def main():
             ],
         },
         fallbacks=[CallbackQueryHandler(cancel, pattern="^cancel$")],
+        name="registration",
+        persistent=persistent,
     )
 
     # Teacher Conversation
@@ -735,9 +1508,11 @@ def main():
             TEACHER_MENU: [
                 CallbackQueryHandler(teacher_add_hw_name, pattern="^add_hw$"),
                 CallbackQueryHandler(teacher_view_hw, pattern="^view_hw$"),
+                CallbackQueryHandler(teacher_upload_hw, pattern="^upload_hw$"),
             ],
             TEACHER_VIEWING: [
                 CallbackQueryHandler(teacher, pattern="^back_teacher_menu$"),
+                CallbackQueryHandler(teacher_view_hw, pattern="^hw_(prev|next):"),
             ],
             TEACHER_HW_NAME: [
                 MessageHandler(
@@ -749,6 +1524,10 @@ def main():
                     Filters.text & ~(Filters.command), teacher_add_hw_confirm
                 )
             ],
+            TEACHER_HW_UPLOAD: [
+                MessageHandler(Filters.document, teacher_upload_hw_done),
+                CallbackQueryHandler(teacher, pattern="^back_teacher_menu$"),
+            ],
             TEACHER_ADD_HW_RETURN: [
                 CallbackQueryHandler(teacher_add_hw_done, pattern="^confirm_add_hw$"),
                 CallbackQueryHandler(teacher, pattern="^back_teacher_menu$"),
@@ -758,6 +1537,8 @@ def main():
             CallbackQueryHandler(cancel, pattern="^cancel$"),
             CommandHandler("cancel", "cancel"),
         ],
+        name="teacher",
+        persistent=persistent,
     )
 
     # Student Conversation
@@ -785,6 +1566,13 @@ def main():
             ],
             STUDENT_POMODORO_IN_SESSION: [
                 MessageHandler(Filters.all, student_pomodoro_in_session),
+                CallbackQueryHandler(student_pomodoro_pause, pattern="^pomodoro_pause$"),
+                CallbackQueryHandler(
+                    student_pomodoro_resume, pattern="^pomodoro_resume$"
+                ),
+                CallbackQueryHandler(
+                    student_pomodoro_cancel, pattern="^pomodoro_cancel$"
+                ),
                 CallbackQueryHandler(student, pattern="^back_student_menu$"),
             ],
             STUDENT_COMPLETED_TASKS: [
@@ -794,37 +1582,213 @@ def main():
             ],
             STUDENT_VIEW_SUBJECT: [
                 CallbackQueryHandler(student, pattern="^back_student_menu$"),
+                CallbackQueryHandler(
+                    student_view_subject, pattern="^subjects_(prev|next):"
+                ),
                 CallbackQueryHandler(student_view_homework),
             ],
             STUDENT_VIEWING: [
                 CallbackQueryHandler(student_view_subject, pattern="back_subjects"),
+                CallbackQueryHandler(student_view_homework, pattern="^hw_(prev|next):"),
             ],
         },
         fallbacks=[
             CallbackQueryHandler(cancel, pattern="^cancel$"),
             CommandHandler("cancel", "cancel"),
         ],
+        name="student",
+        persistent=persistent,
     )
 
     dispatcher.add_handler(reg_conv)
     dispatcher.add_handler(teacher_conv)
     dispatcher.add_handler(student_conv)
 
-    # Job for daily homework reset at 8am
-    job_queue = updater.job_queue
-    job_queue.run_daily(
-        homework_clearing,
-        time=time(hour=8, tzinfo=pytz.timezone("Asia/Singapore")),
-        days=(0, 1, 2, 3, 4, 5, 6),
-    )
-
     # Commands
     dispatcher.add_handler(CommandHandler("help", help))
+    dispatcher.add_handler(CommandHandler("digest", digest))
+
+    # Inline Search
+    dispatcher.add_handler(InlineQueryHandler(inline_search))
+
+
+def run_worker(index=None, worker_secret=None):
+    """Runs the bot alone, or as worker index of a cluster fed by run_front()"""
+    global cluster
+    if index is None and RUN_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise SystemExit("Webhook mode needs a WEBHOOK_SECRET")
+    if index is not None:
+        cluster = Cluster(CLUSTER_WORKERS, index)
+        # Telegram's rate limit is per bot, so the workers split it
+        broadcaster.rate = BROADCAST_RATE / CLUSTER_WORKERS
+
+    # Initialisation
+    bot = InstrumentedBot(TOKEN, request=Request(con_pool_size=HANDLER_LANES + 8))
+    # Opening the sessions database, read per user on their first update
+    sessions.store.open()
+    updater = build_updater(bot, HANDLER_LANES, persistence=sessions)
+    add_handlers(updater.dispatcher)
+    instrument_handlers(updater.dispatcher)
+
+    if METRICS_PORT is not None:
+        metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT + cluster.index)
+        metrics_server.start()
+
+    # Loading or connecting to the users and homework tables
+    storage.open()
+    homework_versions.update(storage.homework_versions())
+
+    # Job removing homework as soon as the earliest deadline arrives
+    _schedule_expiry(updater.job_queue)
+
+    # Job sending the next due deadline reminders
+    _load_reminders()
+    _schedule_reminders(updater.job_queue)
+
+    # Job picking up the homework changes of the other workers
+    if cluster.workers > 1:
+        updater.job_queue.run_repeating(sync_homework, CLUSTER_SYNC, name="sync_homework")
+
+    # Job unloading the schools nobody has used for SCHOOL_IDLE seconds
+    updater.job_queue.run_repeating(
+        evict_idle_schools, SCHOOL_IDLE, first=SCHOOL_IDLE, name="evict_idle_schools"
+    )
 
-    # Polling
-    updater.start_polling()
+    # Job unloading the sessions of users idle for SESSION_IDLE seconds
+    updater.job_queue.run_repeating(
+        evict_idle_sessions, SESSION_IDLE, first=SESSION_IDLE, name="evict_idle_sessions"
+    )
+
+    # Finishing pomodoros in batches from the job queue, including those
+    # that were running before a restart
+    pomodoro_timers.callback = lambda chat_ids: updater.job_queue.run_once(
+        student_end_pomodoro, 0, context=chat_ids
+    )
+    _rehydrate_pomodoros()
+    pomodoro_timers.start()
+
+    broadcaster.bot = updater.bot
+    broadcaster.start()
+
+    # Daily digest in TIMEZONE, or the server's timezone
+    _schedule_digest(updater.job_queue)
+
+    if index is not None:
+        server = WebhookServer(
+            updater.bot,
+            updater.update_queue,
+            "127.0.0.1",
+            CLUSTER_PORT + index,
+            WEBHOOK_PATH,
+            worker_secret,
+            CLUSTER_CONNECTIONS,
+        )
+        run_webhook(updater, server, None, worker_secret, CLUSTER_CONNECTIONS)
+    elif RUN_MODE == "webhook":
+        server = WebhookServer(
+            updater.bot,
+            updater.update_queue,
+            WEBHOOK_LISTEN,
+            WEBHOOK_PORT,
+            WEBHOOK_PATH,
+            WEBHOOK_SECRET,
+            WEBHOOK_WORKERS,
+        )
+        run_webhook(updater, server, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_WORKERS)
+    else:
+        updater.start_polling()
     updater.idle()
 
+    # Saving any changes still pending after shutdown
+    pomodoro_timers.stop()
+    broadcaster.stop(BROADCAST_STOP_TIMEOUT)
+    storage.close()
+    sessions.store.close()
+    if METRICS_PORT is not None:
+        metrics_server.stop()
+
+
+def run_front():
+    """Starts CLUSTER_WORKERS worker processes and feeds them the bot's updates"""
+    if STORAGE_BACKEND != "sqlite":
+        raise SystemExit('Running several workers needs STORAGE_BACKEND = "sqlite"')
+    if RUN_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise SystemExit("Webhook mode needs a WEBHOOK_SECRET")
+
+    # Workers only take updates carrying a secret of this run
+    worker_secret = secrets.token_urlsafe(32)
+    context = multiprocessing.get_context("spawn")
+
+    def start_worker(index):
+        """Returns a started worker process and when it started"""
+        worker = context.Process(
+            target=run_worker, args=(index, worker_secret), name=f"worker-{index}"
+        )
+        worker.start()
+        return worker, perf_counter()
+
+    workers = [start_worker(i) for i in range(CLUSTER_WORKERS)]
+
+    front = ClusterFront(
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT,
+        WEBHOOK_PATH,
+        WEBHOOK_SECRET,
+        CLUSTER_WORKERS,
+        "127.0.0.1",
+        CLUSTER_PORT,
+        worker_secret,
+        CLUSTER_CONNECTIONS,
+    )
+    bot = InstrumentedBot(TOKEN)
+    stopping = threading.Event()
+    if RUN_MODE == "webhook":
+        front.start()
+        bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_WORKERS,
+        )
+    else:
+        bot.delete_webhook()
+        threading.Thread(
+            target=poll_updates, args=(bot, front, stopping), name="poller", daemon=True
+        ).start()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+
+    # Restarting workers that exit, as their chats and the leader's jobs
+    # would otherwise stall while the front keeps taking updates
+    crashed = False
+    while not stopping.wait(1):
+        for i, (worker, started) in enumerate(workers):
+            if worker.is_alive():
+                continue
+            logger.error("Worker %d exited with code %s", i, worker.exitcode)
+            if perf_counter() - started < CLUSTER_MIN_UPTIME:
+                logger.error("Worker %d keeps exiting, stopping the cluster", i)
+                crashed = True
+                stopping.set()
+                break
+            workers[i] = start_worker(i)
+
+    # Handing over the updates already received before stopping the workers
+    front.stop()
+    for worker, _ in workers:
+        worker.terminate()
+    for worker, _ in workers:
+        worker.join()
+    if crashed:
+        raise SystemExit(1)
+
+
+def main():
+    if CLUSTER_WORKERS > 1:
+        run_front()
+    else:
+        run_worker()
+
 
 if __name__ == "__main__":
     main()
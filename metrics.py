@@ -0,0 +1,205 @@
+import bisect, functools, logging, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram.error import TelegramError
+from telegram.ext import ExtBot
+
+from dispatch import iter_handlers
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histograms' buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    """Counters, latency histograms and gauges rendered in Prometheus text format
+
+    Series are keyed by name and a tuple of (label, value) pairs. Recording is a
+    dict lookup and a bisect under one lock, cheap enough to leave on.
+    """
+
+    def __init__(self, prefix="dionysus"):
+        self.prefix = prefix
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        """Sets the HELP text of a metric"""
+        self._help[name] = text
+
+    def inc(self, name, labels=(), amount=1):
+        """Adds to a counter"""
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=()):
+        """Records a duration in a histogram"""
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # A count per bucket and one past the last, then the sum and count
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def gauge(self, name, read):
+        """Registers a gauge whose value is read() at scrape time"""
+        self._gauges[name] = read
+
+    def timed(self, kind):
+        """Decorator recording the latency and errors of a callback as {kind}_..."""
+
+        def decorator(callback):
+            labels = ((kind, callback.__name__),)
+
+            @functools.wraps(callback)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return callback(*args, **kwargs)
+                except Exception:
+                    self.inc(f"{kind}_errors_total", labels)
+                    raise
+                finally:
+                    self.observe(
+                        f"{kind}_latency_seconds", time.perf_counter() - started, labels
+                    )
+
+            return wrapper
+
+        return decorator
+
+    def render(self):
+        """Returns every metric in Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(histogram)) for key, histogram in self._histograms.items()
+            )
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {self.prefix}_{name} {self._help[name]}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram):
+                cumulative += count
+                bucket_labels = _labels(labels + (("le", str(bound)),))
+                lines.append(f"{self.prefix}_{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {histogram[-2]}")
+            lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {histogram[-1]}")
+
+        for name, read in sorted(self._gauges.items()):
+            header(name, "gauge")
+            try:
+                lines.append(f"{self.prefix}_{name} {read()}")
+            except Exception:
+                logger.exception("Could not read gauge %s", name)
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    """Formats label pairs as {name="value",...}"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+# Metrics of this process, exposed by MetricsServer
+registry = Metrics()
+registry.describe("handler_latency_seconds", "Time spent in each update handler")
+registry.describe("handler_errors_total", "Exceptions raised by each update handler")
+registry.describe("job_latency_seconds", "Time spent in each job queue job")
+registry.describe("job_errors_total", "Exceptions raised by each job queue job")
+registry.describe("bot_api_latency_seconds", "Latency of each Bot API method")
+registry.describe("bot_api_errors_total", "Failed calls of each Bot API method")
+registry.describe("storage_flush_seconds", "Time taken to compact the journal")
+registry.describe("storage_flush_errors_total", "Failed journal compactions")
+registry.describe("session_flush_seconds", "Time taken to save a batch of sessions")
+registry.describe("session_flush_errors_total", "Failed session saves")
+
+
+def instrument_handlers(dispatcher, metrics=registry):
+    """Wraps the callback of every handler on a dispatcher to record handler_ metrics"""
+    for handler in iter_handlers(dispatcher):
+        if callable(handler.callback):
+            handler.callback = metrics.timed("handler")(handler.callback)
+
+
+class InstrumentedBot(ExtBot):
+    """Bot recording the latency and errors of each Bot API method it calls"""
+
+    metrics = registry
+
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        labels = (("method", endpoint),)
+        started = time.perf_counter()
+        try:
+            return super()._post(endpoint, data, timeout, api_kwargs)
+        except TelegramError:
+            self.metrics.inc("bot_api_errors_total", labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.observe("bot_api_latency_seconds", elapsed, labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Skipping the default per-request access log"""
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves /metrics for a Prometheus scraper, meant to listen on localhost"""
+
+    daemon_threads = True
+
+    def __init__(self, listen, port, metrics=registry):
+        super().__init__((listen, port), _MetricsHandler)
+        self.metrics = metrics
+        self._thread = None
+
+    def start(self):
+        """Serves requests from a background thread"""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="metrics", daemon=True
+        )
+        self._thread.start()
+        logger.info("Serving metrics on %s:%d/metrics", *self.server_address[:2])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,122 @@
+import pandas as pd
+
+COLUMNS = ["chat_id", "start", "duration", "task"]
+
+
+class PomodoroHistory:
+    """Each user's latest pomodoro sessions, oldest first
+
+    Sessions are (start, duration, task) tuples with start as a POSIX timestamp
+    and duration in minutes. A user's sessions are keyed by start, so replaying
+    a journalled session replaces it instead of adding it twice, and only the
+    last `limit` remain.
+    """
+
+    def __init__(self, limit=50):
+        self.limit = limit
+        self._sessions = {}
+
+    def load_frame(self, df):
+        """Replaces the history with a pomodoros dataframe"""
+        self._sessions = {}
+        for row in df.itertuples(index=False):
+            self.add(int(row.chat_id), int(row.start), int(row.duration), row.task)
+
+    def to_frame(self):
+        """Returns the history as a pomodoros dataframe"""
+        return pd.DataFrame(self.rows(), columns=COLUMNS)
+
+    def rows(self):
+        """Returns every session as a (chat_id, start, duration, task) tuple"""
+        return [
+            (chat_id, start, *session)
+            for chat_id, sessions in list(self._sessions.items())
+            for start, session in list(sessions.items())
+        ]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def add(self, chat_id, start, duration, task):
+        """Records a session, replacing the user's session with the same start
+
+        Past the limit the user's oldest session is dropped, or the new one if
+        it is older still.
+        """
+        sessions = self._sessions.get(chat_id)
+        if sessions is None:
+            sessions = self._sessions[chat_id] = {}
+
+        in_order = True
+        if start not in sessions and sessions:
+            if len(sessions) >= self.limit:
+                oldest = next(iter(sessions))
+                if start < oldest:
+                    return
+                del sessions[oldest]
+            in_order = not sessions or start > next(reversed(sessions))
+        sessions[start] = (duration, task)
+
+        # Keeping the sessions in start order, should one come in late
+        if not in_order:
+            self._sessions[chat_id] = dict(sorted(sessions.items()))
+
+    def get(self, chat_id):
+        """Returns a user's sessions"""
+        sessions = self._sessions.get(chat_id, {})
+        return [(start, *session) for start, session in list(sessions.items())]
+
+    def remove(self, chat_id, start):
+        """Forgets a user's session with a start"""
+        sessions = self._sessions.get(chat_id)
+        if sessions is not None:
+            sessions.pop(start, None)
+            if not sessions:
+                del self._sessions[chat_id]
+
+    def clear(self, chat_id):
+        """Forgets a user's sessions"""
+        self._sessions.pop(chat_id, None)
+
+    def apply(self, op, chat_id, values):
+        """Replays a journalled change, which may already be in the history"""
+        if op == "delete":
+            self.clear(chat_id)
+        elif op == "remove":
+            self.remove(chat_id, values)
+        else:
+            self.add(chat_id, *values)
+
+
+class PomodoroTimers:
+    """End time of each user's running pomodoro as a POSIX timestamp"""
+
+    def __init__(self):
+        self._ends = {}
+
+    def load_frame(self, df):
+        """Replaces the timers with a timers dataframe"""
+        self._ends = {int(row.chat_id): int(row.end_time) for row in df.itertuples(index=False)}
+
+    def to_frame(self):
+        """Returns the timers as a dataframe"""
+        return pd.DataFrame(self.items(), columns=["chat_id", "end_time"])
+
+    def items(self):
+        """Returns (chat_id, end) pairs"""
+        return list(self._ends.items())
+
+    def set(self, chat_id, end):
+        """Sets a user's running pomodoro to end at a timestamp"""
+        self._ends[chat_id] = end
+
+    def remove(self, chat_id):
+        """Removes a user's running pomodoro, returns whether there was one"""
+        return self._ends.pop(chat_id, None) is not None
+
+    def apply(self, op, chat_id, values):
+        """Replays a journalled change"""
+        if op == "delete":
+            self.remove(chat_id)
+        else:
+            self.set(chat_id, values)
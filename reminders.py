@@ -0,0 +1,79 @@
+import heapq, threading
+from datetime import datetime, time, timedelta
+
+
+class ReminderQueue:
+    """Reminders due some time before each homework's deadline, in one min-heap
+
+    Homework is due at `due_time` on its deadline day in `tz` (None for the
+    server's local time), and reminders count back from then. Only the earliest
+    reminder needs a timer: due() pops everything up to a moment so the
+    reminders of many homework are sent together. Removed homework leaves stale
+    heap entries behind that are skipped when they come up. Homework is keyed
+    by any orderable id, such as a (school, id) pair.
+    """
+
+    def __init__(
+        self,
+        offsets=(timedelta(hours=24), timedelta(hours=1)),
+        tz=None,
+        due_time=time(23, 59),
+    ):
+        self.offsets = offsets
+        self.tz = tz
+        self.due_time = due_time
+        self._homework = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._homework)
+
+    def add(self, hw_id, subj, task, deadline, now):
+        """Queues the reminders of a homework due on a date that are still ahead of now
+
+        Adding a homework again unchanged does nothing.
+        """
+        due = self._due(deadline)
+        with self._lock:
+            if self._homework.get(hw_id) == (subj, task, deadline):
+                return
+            self._homework[hw_id] = (subj, task, deadline)
+            for offset in self.offsets:
+                if due - offset > now:
+                    heapq.heappush(self._heap, (due - offset, hw_id, offset))
+
+    def remove(self, hw_id):
+        """Drops a homework's reminders"""
+        with self._lock:
+            self._homework.pop(hw_id, None)
+
+    def next_time(self):
+        """Returns when the earliest reminder is due or None"""
+        with self._lock:
+            return self._heap[0][0] if self._drop_stale() else None
+
+    def due(self, until):
+        """Pops the reminders due by until as (hw_id, offset, subj, task, deadline) tuples"""
+        reminders = []
+        with self._lock:
+            while self._drop_stale() and self._heap[0][0] <= until:
+                _, hw_id, offset = heapq.heappop(self._heap)
+                reminders.append((hw_id, offset, *self._homework[hw_id]))
+        return reminders
+
+    def _due(self, deadline):
+        """Returns when homework with a deadline is due"""
+        return datetime.combine(deadline, self.due_time, tzinfo=self.tz)
+
+    def _drop_stale(self):
+        """Pops heap entries of removed or replaced homework, returns whether any remain"""
+        heap = self._heap
+        while heap:
+            remind_at, hw_id, offset = heap[0]
+            hw = self._homework.get(hw_id)
+            due = hw and self._due(hw[2])
+            if due == remind_at + offset:
+                return True
+            heapq.heappop(heap)
+        return False
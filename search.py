@@ -0,0 +1,112 @@
+import bisect, heapq, re, threading
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Returns the lowercase words of a text"""
+    return TOKEN.findall(text.lower())
+
+
+class HomeworkIndex:
+    """Token and prefix index over homework tasks and subjects
+
+    Each word maps to the set of homework ids containing it, and the distinct
+    words are kept sorted so the words starting with a prefix are one bisect
+    away. A query is answered with set intersections, so only the ranking of
+    the matches costs per match: homework is also kept in deadline order, and
+    the soonest matches are picked either off that order or out of the
+    matches themselves, whichever is shorter.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._words = []
+        self._homework = {}
+        self._order = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._homework)
+
+    def add(self, hw_id, subj, task, deadline):
+        """Indexes a homework, replacing any earlier entry of the same id"""
+        with self._lock:
+            if hw_id in self._homework:
+                self._remove(hw_id)
+            words = frozenset(tokenize(subj) + tokenize(task))
+            self._homework[hw_id] = (subj, task, deadline, words)
+            bisect.insort(self._order, (deadline, hw_id))
+            for word in words:
+                ids = self._postings.get(word)
+                if ids is None:
+                    ids = self._postings[word] = set()
+                    bisect.insort(self._words, word)
+                ids.add(hw_id)
+
+    def remove(self, hw_id):
+        """Drops a homework from the index"""
+        with self._lock:
+            if hw_id in self._homework:
+                self._remove(hw_id)
+
+    def search(self, query, limit=50):
+        """Returns up to limit (hw_id, subj, task, deadline) matches, best first
+
+        Every query word has to start a word of the task or subject. Homework
+        matching all of them as whole words ranks first, then homework due
+        sooner comes first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            # Longer words tend to match less, so the sets shrink sooner
+            matched = exact = None
+            for term in sorted(terms, key=len, reverse=True):
+                ids = self._matching(term)
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    return []
+                ids = self._postings.get(term, set())
+                exact = ids if exact is None else exact & ids
+
+            results = self._soonest(exact, limit)
+            if len(results) < limit:
+                results += self._soonest(matched - exact, limit - len(results))
+            return [(hw_id, *self._homework[hw_id][:3]) for _, hw_id in results]
+
+    def _matching(self, prefix):
+        """Returns the ids of homework with a word starting with a prefix"""
+        start = bisect.bisect_left(self._words, prefix)
+        end = bisect.bisect_left(self._words, prefix + "\U0010ffff", start)
+        if end - start == 1:
+            return self._postings[self._words[start]]
+        return set().union(*(self._postings[word] for word in self._words[start:end]))
+
+    def _soonest(self, ids, limit):
+        """Returns the (deadline, id) pairs of up to limit of ids due soonest"""
+        if not ids:
+            return []
+
+        # Among many matches the first limit turn up early in deadline order
+        if len(ids) ** 2 > limit * len(self._order):
+            soonest = []
+            for entry in self._order:
+                if entry[1] in ids:
+                    soonest.append(entry)
+                    if len(soonest) == limit:
+                        break
+            return soonest
+        return heapq.nsmallest(limit, ((self._homework[i][2], i) for i in ids))
+
+    def _remove(self, hw_id):
+        _, _, deadline, words = self._homework.pop(hw_id)
+        del self._order[bisect.bisect_left(self._order, (deadline, hw_id))]
+        for word in words:
+            ids = self._postings[word]
+            ids.discard(hw_id)
+            if not ids:
+                del self._postings[word]
+                del self._words[bisect.bisect_left(self._words, word)]
@@ -0,0 +1,407 @@
+import json, logging, sqlite3, threading, time
+from collections import defaultdict
+from datetime import date, datetime
+from time import perf_counter
+from telegram.ext import BasePersistence
+
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} values can't be saved in a session")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return date.fromisoformat(obj["$date"])
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def dumps(value):
+    """Returns the JSON of a session value, dates and datetimes included"""
+    return json.dumps(value, default=_encode, separators=(",", ":"))
+
+
+def loads(text):
+    """Returns the session value of JSON made by dumps()"""
+    return json.loads(text, object_hook=_decode)
+
+
+class SessionStore:
+    """Conversation states and user_data in SQLite, written in batches
+
+    Changes wait in memory, the latest per conversation or user, until a
+    background thread encodes and writes them in one transaction every
+    `interval` seconds or once `max_changes` have piled up. Reads look at the
+    waiting changes first. Users without data and ended conversations have no
+    rows, so the database only grows with the sessions in progress.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, interval=5.0, max_changes=1000):
+        self.path = path
+        self.interval = interval
+        self.max_changes = max_changes
+
+        # Waiting changes keyed by ("conversation", name, key) or ("user", id),
+        # and those being written by the current flush
+        self._pending = {}
+        self._writing = {}
+        # Hashes of the user_data last written, to skip rewriting unchanged rows
+        self._written = {}
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def conn(self):
+        """Returns the calling thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def open(self):
+        """Creates the tables if needed and starts the background writer"""
+        with self.conn as conn:
+            conn.executescript(self.SCHEMA)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="sessions", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the background writer and writes the changes still waiting"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def conversation(self, name, key):
+        """Returns the saved state of a conversation, or None"""
+        found, state = self._waiting(("conversation", name, key))
+        if found:
+            return state
+        row = self.conn.execute(
+            "SELECT state FROM conversations WHERE name = ? AND key = ?",
+            (name, dumps(key)),
+        ).fetchone()
+        return loads(row[0]) if row else None
+
+    def user_data(self, user_id):
+        """Returns the saved user_data of a user, or None"""
+        found, data = self._waiting(("user", user_id))
+        if found:
+            return data
+        row = self.conn.execute(
+            "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._written[user_id] = hash(row[0])
+        return loads(row[0])
+
+    def save_conversation(self, name, key, state):
+        """Queues the new state of a conversation, None once it ended"""
+        self._queue(("conversation", name, key), state)
+
+    def save_user_data(self, user_id, data):
+        """Queues a user's user_data, encoded as it is when it gets written"""
+        self._queue(("user", user_id), data)
+
+    def forget(self, user_ids):
+        """Drops what is kept in memory about users that are no longer loaded"""
+        for user_id in user_ids:
+            self._written.pop(user_id, None)
+
+    def flush(self):
+        """Writes the waiting changes in one transaction"""
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                self._writing, self._pending = self._pending, {}
+                changes = self._writing
+
+            started = perf_counter()
+            conversations, ended, users, emptied, written, busy = [], [], [], [], {}, {}
+            for change, value in changes.items():
+                if change[0] == "conversation":
+                    _, name, key = change
+                    if value is None:
+                        ended.append((name, dumps(key)))
+                    else:
+                        conversations.append((name, dumps(key), dumps(value)))
+                    continue
+
+                user_id = change[1]
+                if not value:
+                    if self._written.get(user_id) is not None:
+                        emptied.append((user_id,))
+                        written[user_id] = None
+                    continue
+                try:
+                    text = dumps(value)
+                except RuntimeError:
+                    # Changed by a handler while encoding, so left to the next flush
+                    busy[change] = value
+                    continue
+                except (TypeError, ValueError):
+                    logger.exception("Can't save the user_data of user %s", user_id)
+                    continue
+                if self._written.get(user_id) != hash(text):
+                    users.append((user_id, text))
+                    written[user_id] = hash(text)
+
+            try:
+                with self.conn as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO conversations (name, key, state) "
+                        "VALUES (?, ?, ?)",
+                        conversations,
+                    )
+                    conn.executemany(
+                        "DELETE FROM conversations WHERE name = ? AND key = ?", ended
+                    )
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                        users,
+                    )
+                    conn.executemany("DELETE FROM user_data WHERE user_id = ?", emptied)
+            except Exception:
+                logger.exception("Failed to save sessions")
+                metrics.inc("session_flush_errors_total")
+                busy = changes
+            else:
+                self._written.update(written)
+                metrics.observe("session_flush_seconds", perf_counter() - started)
+                logger.debug(
+                    "Saved %d conversations and %d users",
+                    len(conversations) + len(ended),
+                    len(users) + len(emptied),
+                )
+
+            # Putting back what was not written, unless changed again meanwhile
+            with self._cond:
+                for change, value in busy.items():
+                    self._pending.setdefault(change, value)
+                self._writing = {}
+
+    def _waiting(self, change):
+        """Returns whether a change is waiting to be written, and its value"""
+        with self._cond:
+            for changes in (self._pending, self._writing):
+                if change in changes:
+                    return True, changes[change]
+        return False, None
+
+    def _queue(self, change, value):
+        with self._cond:
+            self._pending[change] = value
+            if len(self._pending) >= self.max_changes:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._pending) >= self.max_changes,
+                    timeout=self.interval,
+                )
+                if self._stopping:
+                    return
+            self.flush()
+
+
+class LazyUserData(defaultdict):
+    """The dispatcher's user_data, loading each user's on first access"""
+
+    def __init__(self, load, touch):
+        super().__init__(dict)
+        self._load = load
+        self._touch = touch
+
+    def __missing__(self, user_id):
+        self._touch(user_id)
+        data = self[user_id] = self._load(user_id) or {}
+        return data
+
+
+class LazyConversations(dict):
+    """A ConversationHandler's states, loading each conversation's on first lookup
+
+    Conversations found not to be saved are remembered, so the handlers
+    looking at every update don't query the store again for them.
+    """
+
+    def __init__(self, load, touch):
+        super().__init__()
+        self._load = load
+        self._touch = touch
+        self._absent = set()
+
+    def _fetch(self, key):
+        self._touch(key[-1])
+        if key in self._absent or super().__contains__(key):
+            return
+        state = self._load(key)
+        if state is None:
+            self._absent.add(key)
+        else:
+            super().__setitem__(key, state)
+
+    def get(self, key, default=None):
+        self._fetch(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._fetch(key)
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self._fetch(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, state):
+        self._absent.discard(key)
+        super().__setitem__(key, state)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._absent.add(key)
+
+    def forget(self, user_ids):
+        """Drops the conversations of users, as if never loaded"""
+        # Copying the keys first, as other users' conversations may change meanwhile
+        for key in [key for key in list(self) if key[-1] in user_ids]:
+            self.pop(key, None)
+        self._absent = {key for key in list(self._absent) if key[-1] not in user_ids}
+
+
+class SessionPersistence(BasePersistence):
+    """Persists conversation states and user_data in a SessionStore
+
+    Nothing is read at startup: a user's user_data and conversations are
+    loaded on their first update, and dropped from memory again by
+    evict_idle() once no update has used them for `idle` seconds. Chat and
+    bot data are not persisted. The values are stored as is, without PTB's
+    copying and bot replacement, so user_data must hold JSON values, dates
+    and datetimes.
+
+    Only the user_data of the user whose update was just handled is saved.
+    PTB also asks to save every loaded user after each job, and those calls
+    are skipped, as jobs leave user_data alone.
+    """
+
+    def __init__(self, store, idle=3600.0, clock=time.monotonic):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.store = store
+        self.idle = idle
+        self.clock = clock
+        self.user_data = None
+        self.conversations = {}
+        self._last_used = {}
+        # The user whose update each dispatcher thread is handling
+        self._updating = threading.local()
+
+    def _touch(self, user_id):
+        self._last_used[user_id] = self.clock()
+
+    def insert_bot(self, obj):
+        return obj
+
+    @classmethod
+    def replace_bot(cls, obj):
+        return obj
+
+    def get_user_data(self):
+        if self.user_data is None:
+            self.user_data = LazyUserData(self.store.user_data, self._touch)
+        return self.user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        if name not in self.conversations:
+            self.conversations[name] = LazyConversations(
+                lambda key: self.store.conversation(name, key), self._touch
+            )
+        return self.conversations[name]
+
+    def update_conversation(self, name, key, new_state):
+        self.store.save_conversation(name, key, new_state)
+
+    def refresh_user_data(self, user_id, user_data):
+        """Called by the dispatcher before handing an update's user_data to handlers"""
+        self._touch(user_id)
+        self._updating.user_id = user_id
+
+    def update_user_data(self, user_id, data):
+        # Saving after the thread's own update, not for every loaded user after jobs
+        if getattr(self._updating, "user_id", None) != user_id:
+            return
+        self._updating.user_id = None
+        self.store.save_user_data(user_id, data)
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def flush(self):
+        self.store.flush()
+
+    def evict_idle(self):
+        """Drops the sessions unused for `idle` seconds from memory, returns how many"""
+        cutoff = self.clock() - self.idle
+        user_ids = {
+            user_id for user_id, used in list(self._last_used.items()) if used <= cutoff
+        }
+        if not user_ids:
+            return 0
+
+        for user_id in user_ids:
+            self._last_used.pop(user_id, None)
+            if self.user_data is not None:
+                self.user_data.pop(user_id, None)
+        for conversations in self.conversations.values():
+            conversations.forget(user_ids)
+        self.store.forget(user_ids)
+        return len(user_ids)
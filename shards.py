@@ -0,0 +1,75 @@
+import threading, time
+
+
+class IdleCache:
+    """Values built per key on first use and dropped once unused for `idle` seconds
+
+    Used for the per-school shards of data that only need to be in memory while
+    a school is active. evict_idle() has to be called now and then, passing
+    each dropped value to on_evict(key, value).
+    """
+
+    def __init__(self, load, idle=600.0, on_evict=None, clock=time.monotonic):
+        self.load = load
+        self.idle = idle
+        self.on_evict = on_evict
+        self.clock = clock
+        self.loads = 0
+        self.evictions = 0
+
+        self._values = {}
+        self._last_used = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key):
+        """Returns the value of a key, calling load(key) to build it if needed"""
+        with self._lock:
+            self._last_used[key] = self.clock()
+            if key not in self._values:
+                self._values[key] = self.load(key)
+                self.loads += 1
+            return self._values[key]
+
+    def peek(self, key):
+        """Returns the value of a key if it is loaded, without loading or touching it"""
+        with self._lock:
+            return self._values.get(key)
+
+    def items(self):
+        """Returns the loaded (key, value) pairs"""
+        with self._lock:
+            return list(self._values.items())
+
+    def evict_idle(self):
+        """Drops the values unused for `idle` seconds and returns their keys"""
+        with self._lock:
+            cutoff = self.clock() - self.idle
+            keys = [key for key, used in self._last_used.items() if used <= cutoff]
+            for key in keys:
+                self._evict(key)
+            return keys
+
+    def discard(self, key):
+        """Drops the value of a key, so the next get() builds it again"""
+        with self._lock:
+            self._evict(key)
+
+    def clear(self):
+        """Drops every value"""
+        with self._lock:
+            for key in list(self._values):
+                self._evict(key)
+
+    def _evict(self, key):
+        value = self._values.pop(key, None)
+        self._last_used.pop(key, None)
+        if value is not None:
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(key, value)
@@ -0,0 +1,1072 @@
+import json, logging, os, sqlite3, threading
+import pandas as pd
+from datetime import date
+from time import perf_counter
+
+from homework import HomeworkTable
+from metrics import registry as metrics
+from pomodoro import PomodoroHistory, PomodoroTimers
+from shards import IdleCache
+from users import DEFAULT_SCHOOL, UserRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(df, path):
+    """Writes a dataframe to CSV via write-then-rename so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        df.to_csv(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Journal:
+    """Append-only log of table changes, one JSON record per line"""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.rotated_path = f"{path}.old"
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._file = None
+
+    def append(self, table, op, key, values=None):
+        """Appends a single insert, update or delete record"""
+        line = json.dumps(
+            {"table": table, "op": op, "key": key, "values": values},
+            separators=(",", ":"),
+        )
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def append_many(self, table, op, records):
+        """Appends (key, values) records of one table in a single write"""
+        lines = "".join(
+            json.dumps(
+                {"table": table, "op": op, "key": key, "values": values},
+                separators=(",", ":"),
+            )
+            + "\n"
+            for key, values in records
+        )
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(lines)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _open(self):
+        """Opens the journal for appending, terminating any torn last line"""
+        f = open(self.path, "a+b")
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.close()
+        return open(self.path, "a", encoding="utf-8")
+
+    def rotate(self):
+        """Moves the current records aside so a snapshot can be taken"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            if not os.path.exists(self.path):
+                open(self.path, "w").close()
+
+            # A previous compaction failed, keeping its records ahead of ours
+            if os.path.exists(self.rotated_path):
+                with open(self.path, encoding="utf-8") as src, open(
+                    self.rotated_path, "a", encoding="utf-8"
+                ) as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+
+            self._file = None
+
+    def discard_rotated(self):
+        """Drops the rotated records once a snapshot covering them is on disk"""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def replay(self):
+        """Yields every record, oldest first, skipping a torn last line"""
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+
+            with open(path, encoding="utf-8") as f:
+                for count, line in enumerate(f):
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warning("Skipping unreadable record %d of %s", count, path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Flusher:
+    """Journals table changes and compacts them into CSV snapshots from a background thread
+
+    Tables must provide load_frame(df), to_frame() and apply(op, key, values).
+    Each table is copied holding `lock`, the lock its writers hold.
+    """
+
+    def __init__(self, journal, interval=300.0, max_changes=10_000, lock=None):
+        self.journal = journal
+        self.interval = interval
+        self.max_changes = max_changes
+        self.lock = lock or threading.RLock()
+
+        self._tables = {}
+        self._changes = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def register(self, name, table, path):
+        """Registers a table to be snapshotted to path"""
+        self._tables[name] = (table, path)
+
+    def load(self):
+        """Loads every table's snapshot, replays the journal on top and compacts"""
+        for table, path in self._tables.values():
+            if os.path.exists(path):
+                table.load_frame(pd.read_csv(path, index_col=0))
+
+        replayed = 0
+        for record in self.journal.replay():
+            table, _ = self._tables[record["table"]]
+            table.apply(record["op"], record["key"], record["values"])
+            replayed += 1
+
+        logger.info("Replayed %d journal records", replayed)
+        if replayed:
+            self._changes = replayed
+            self.flush()
+
+    def record(self, name, op, key, values=None):
+        """Journals a change to a table that has already been applied in memory"""
+        self.journal.append(name, op, key, values)
+
+        with self._cond:
+            self._changes += 1
+            if self._changes >= self.max_changes:
+                self._cond.notify()
+
+    def record_many(self, name, op, records):
+        """Journals (key, values) changes to a table in one write"""
+        records = list(records)
+        self.journal.append_many(name, op, records)
+
+        with self._cond:
+            self._changes += len(records)
+            if self._changes >= self.max_changes:
+                self._cond.notify()
+
+    def flush(self):
+        """Compacts the journal into fresh snapshots of every table"""
+        with self._cond:
+            if not self._changes:
+                return
+            changes, self._changes = self._changes, 0
+
+        # Changes recorded after the rotation are replayed on top of the
+        # snapshots, which is harmless since every record is idempotent
+        started = perf_counter()
+        self.journal.rotate()
+        try:
+            for name, (table, path) in self._tables.items():
+                # Writing the copy out after letting go of the writers
+                with self.lock:
+                    frame = table.to_frame()
+                write_atomic(frame, path)
+        except Exception:
+            logger.exception("Failed to compact the journal")
+            metrics.inc("storage_flush_errors_total")
+            with self._cond:
+                self._changes += changes
+            return
+
+        self.journal.discard_rotated()
+        metrics.observe("storage_flush_seconds", perf_counter() - started)
+        logger.debug("Compacted %d changes", changes)
+
+    def start(self):
+        """Starts the background compaction thread"""
+        self._thread = threading.Thread(target=self._run, name="flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and forces a final compaction"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        self.journal.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or self._changes >= self.max_changes,
+                    timeout=self.interval,
+                )
+                if self._stopping:
+                    return
+            self.flush()
+
+
+class Storage:
+    """Interface for the queries the bot's handlers and jobs issue
+
+    Users belong to a school and homework is kept per school, the school
+    arguments defaulting to DEFAULT_SCHOOL.
+    """
+
+    def open(self):
+        """Loads or connects to the underlying store"""
+
+    def close(self):
+        """Saves anything pending and releases the store"""
+
+    def user_type(self, chat_id):
+        """Returns 'teacher', 'student' or None if the user has not registered"""
+        raise NotImplementedError
+
+    def teacher_subject(self, chat_id):
+        """Returns the subject taught by a teacher or None"""
+        raise NotImplementedError
+
+    def add_user(self, chat_id, user_name):
+        """Adds a new unregistered user, returns False if they already exist"""
+        raise NotImplementedError
+
+    def register_user(self, chat_id, user_type, teacher_subject=None, school=DEFAULT_SCHOOL):
+        """Sets the user type (and subject for teachers) and school of a user"""
+        raise NotImplementedError
+
+    def school(self, chat_id):
+        """Returns the school of a user or None for unknown users"""
+        raise NotImplementedError
+
+    def students(self, school=DEFAULT_SCHOOL):
+        """Returns the chat_ids of every registered student of a school"""
+        raise NotImplementedError
+
+    def set_digest(self, chat_id, enabled):
+        """Subscribes or unsubscribes a registered user from the daily digest"""
+        raise NotImplementedError
+
+    def digest_subscribers(self, school=DEFAULT_SCHOOL):
+        """Returns the chat_ids of a school's users who asked for the daily digest"""
+        raise NotImplementedError
+
+    def add_homework(self, subj, task, deadline, school=DEFAULT_SCHOOL):
+        """Adds a homework task due on deadline (YYYY-MM-DD) and returns its id
+
+        Ids are only unique within a school.
+        """
+        raise NotImplementedError
+
+    def add_homework_many(self, subj, homework, school=DEFAULT_SCHOOL):
+        """Adds (task, deadline) pairs of one subject at once and returns their ids"""
+        raise NotImplementedError
+
+    def schools(self, until=None):
+        """Returns the schools with homework, or with homework due before a date"""
+        raise NotImplementedError
+
+    def homework_page(self, subj, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL):
+        """Returns up to limit of a subject's homework after a (deadline, id) cursor
+
+        Going backwards returns those just before the cursor instead, still in
+        deadline order. Also returns whether more lie beyond the page.
+        """
+        raise NotImplementedError
+
+    def subjects_page(self, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL):
+        """Returns up to limit subjects with homework after a subject, or before it
+
+        Also returns whether more subjects lie beyond the page.
+        """
+        raise NotImplementedError
+
+    def homework_due(self, until, school=DEFAULT_SCHOOL):
+        """Returns homework due before a date, ordered by subject then deadline"""
+        raise NotImplementedError
+
+    def next_deadline(self):
+        """Returns the earliest homework deadline of any school as a date or None"""
+        raise NotImplementedError
+
+    def expire_homework(self, now):
+        """Removes homework whose deadline day is over by now and returns their records
+
+        The records include the homework's school.
+        """
+        raise NotImplementedError
+
+    def evict_idle_shards(self):
+        """Unloads the schools unused for a while and returns their names"""
+        return []
+
+    def homework_versions(self):
+        """Returns {school: version}, the version changing with the school's homework
+
+        Only stores shared between processes need to keep versions.
+        """
+        return {}
+
+    def add_pomodoro(self, chat_id, start, duration, task):
+        """Records a pomodoro session starting at a POSIX timestamp, lasting minutes
+
+        A session with the same start as one of the user's replaces it.
+        """
+        raise NotImplementedError
+
+    def pomodoros(self, chat_id):
+        """Returns a user's latest (start, duration, task) sessions, by start"""
+        raise NotImplementedError
+
+    def remove_pomodoro(self, chat_id, start):
+        """Forgets a user's pomodoro session starting at a POSIX timestamp"""
+        raise NotImplementedError
+
+    def clear_pomodoros(self, chat_id):
+        """Forgets a user's pomodoro sessions"""
+        raise NotImplementedError
+
+    def set_timer(self, chat_id, end):
+        """Saves when a user's running pomodoro ends, as a POSIX timestamp"""
+        raise NotImplementedError
+
+    def remove_timer(self, chat_id):
+        """Forgets a user's running pomodoro, returns whether there was one"""
+        raise NotImplementedError
+
+    def timers(self):
+        """Returns (chat_id, end) pairs of every running pomodoro"""
+        raise NotImplementedError
+
+
+class HomeworkShard:
+    """One school's homework table, snapshotted and journalled in its own directory
+
+    Shards have no compaction thread; their owner flushes them.
+    """
+
+    def __init__(self, directory, max_changes=10_000):
+        os.makedirs(directory, exist_ok=True)
+        self.homework = HomeworkTable()
+        self.flusher = Flusher(
+            Journal(os.path.join(directory, "journal.jsonl")), max_changes=max_changes
+        )
+        self.flusher.register("hw", self.homework, os.path.join(directory, "hw.csv"))
+
+    @staticmethod
+    def has_journal(directory):
+        """Returns whether a shard directory has changes missing from its snapshot"""
+        path = os.path.join(directory, "journal.jsonl")
+        return any(os.path.exists(p) for p in (path, f"{path}.old"))
+
+    def close(self):
+        self.flusher.stop()
+
+
+class CsvStorage(Storage):
+    """In-memory tables persisted as CSV snapshots plus a change journal
+
+    The default school's homework sits with the other tables. Every other
+    school's homework is a HomeworkShard under shards_dir, loaded on first use
+    and unloaded after shard_idle seconds unused. The earliest deadline of each
+    school is kept in memory and in a manifest, so finding expired homework
+    only loads the schools that have some.
+    """
+
+    def __init__(
+        self,
+        users_csv,
+        hw_csv,
+        pomodoro_csv,
+        timers_csv,
+        journal_path,
+        flush_interval=300,
+        flush_max_changes=10000,
+        pomodoro_history=50,
+        shards_dir="schools",
+        shard_idle=600,
+    ):
+        self.users = UserRegistry()
+        self.homework = HomeworkTable()
+        self.pomodoro_history = PomodoroHistory(pomodoro_history)
+        self.pomodoro_timers = PomodoroTimers()
+
+        # Handlers run on several threads, so every access goes through one
+        # lock, which the flusher's thread takes too while copying the tables
+        self._lock = threading.RLock()
+        self.flusher = Flusher(
+            Journal(journal_path),
+            interval=flush_interval,
+            max_changes=flush_max_changes,
+            lock=self._lock,
+        )
+        self.flusher.register("users", self.users, users_csv)
+        self.flusher.register("hw", self.homework, hw_csv)
+        self.flusher.register("pomodoros", self.pomodoro_history, pomodoro_csv)
+        self.flusher.register("timers", self.pomodoro_timers, timers_csv)
+
+        self.shards_dir = shards_dir
+        self.shards = IdleCache(self._load_shard, shard_idle, self._unload_shard)
+        self._manifest = os.path.join(shards_dir, "deadlines.json")
+        self._deadlines = {}
+        self._max_changes = flush_max_changes
+
+    def open(self):
+        with self._lock:
+            self.flusher.load()
+            self._load_manifest()
+        self.flusher.start()
+
+    def close(self):
+        with self._lock:
+            self._save_manifest()
+            self.shards.clear()
+        self.flusher.stop()
+
+    def evict_idle_shards(self):
+        with self._lock:
+            # The manifest goes first: a crash before the shards are compacted
+            # leaves their journals, whose schools are reloaded on open
+            self._save_manifest()
+            for _, shard in self.shards.items():
+                shard.flusher.flush()
+            return self.shards.evict_idle()
+
+    def _load_shard(self, school):
+        shard = HomeworkShard(os.path.join(self.shards_dir, school), self._max_changes)
+        shard.flusher.load()
+        return shard
+
+    def _unload_shard(self, school, shard):
+        shard.close()
+        logger.debug("Unloaded the homework of school %s", school)
+
+    def _load_manifest(self):
+        """Reads every school's earliest deadline, reloading schools with pending changes"""
+        if os.path.exists(self._manifest):
+            with open(self._manifest, encoding="utf-8") as f:
+                self._deadlines = {
+                    school: date.fromisoformat(deadline)
+                    for school, deadline in json.load(f).items()
+                }
+
+        if os.path.isdir(self.shards_dir):
+            for school in os.listdir(self.shards_dir):
+                directory = os.path.join(self.shards_dir, school)
+                if os.path.isdir(directory) and HomeworkShard.has_journal(directory):
+                    self._update_deadline(school, self.shards.get(school).homework)
+
+    def _save_manifest(self):
+        # Leaving no trace of schools on a single school install
+        if not self._deadlines and not os.path.exists(self._manifest):
+            return
+        os.makedirs(self.shards_dir, exist_ok=True)
+        tmp_path = f"{self._manifest}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {school: deadline.isoformat() for school, deadline in self._deadlines.items()},
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest)
+
+    def _homework(self, school):
+        """Returns a school's homework table and the flusher journalling it"""
+        if school == DEFAULT_SCHOOL:
+            return self.homework, self.flusher
+        shard = self.shards.get(school)
+        return shard.homework, shard.flusher
+
+    def _update_deadline(self, school, homework):
+        """Notes a school's earliest deadline after its homework changed"""
+        if school == DEFAULT_SCHOOL:
+            return
+        deadline = homework.next_deadline()
+        if deadline is None:
+            self._deadlines.pop(school, None)
+        else:
+            self._deadlines[school] = deadline
+
+    def user_type(self, chat_id):
+        with self._lock:
+            return self.users.user_type(chat_id)
+
+    def teacher_subject(self, chat_id):
+        with self._lock:
+            return self.users.teacher_subject(chat_id)
+
+    def add_user(self, chat_id, user_name):
+        with self._lock:
+            if not self.users.add(chat_id, user_name):
+                return False
+            self.flusher.record("users", "insert", chat_id, self.users.get(chat_id))
+            return True
+
+    def register_user(self, chat_id, user_type, teacher_subject=None, school=DEFAULT_SCHOOL):
+        with self._lock:
+            self.users.register(chat_id, user_type, teacher_subject, school)
+            self.flusher.record("users", "update", chat_id, self.users.get(chat_id))
+
+    def school(self, chat_id):
+        with self._lock:
+            return self.users.school(chat_id)
+
+    def students(self, school=DEFAULT_SCHOOL):
+        with self._lock:
+            return self.users.chat_ids("student", school)
+
+    def set_digest(self, chat_id, enabled):
+        with self._lock:
+            self.users.set_digest(chat_id, enabled)
+            self.flusher.record("users", "update", chat_id, self.users.get(chat_id))
+
+    def digest_subscribers(self, school=DEFAULT_SCHOOL):
+        with self._lock:
+            return self.users.digest_subscribers(school)
+
+    def add_homework(self, subj, task, deadline, school=DEFAULT_SCHOOL):
+        with self._lock:
+            homework, flusher = self._homework(school)
+            hw_id = homework.add(subj, task, deadline)
+            flusher.record("hw", "insert", hw_id, homework.get(hw_id))
+            self._update_deadline(school, homework)
+            return hw_id
+
+    def add_homework_many(self, subj, homework, school=DEFAULT_SCHOOL):
+        with self._lock:
+            table, flusher = self._homework(school)
+            hw_ids = table.add_many(subj, homework)
+            flusher.record_many(
+                "hw", "insert", ((hw_id, table.get(hw_id)) for hw_id in hw_ids)
+            )
+            self._update_deadline(school, table)
+            return hw_ids
+
+    def schools(self, until=None):
+        with self._lock:
+            deadlines = dict(self._deadlines)
+            default_deadline = self.homework.next_deadline()
+            if default_deadline is not None:
+                deadlines[DEFAULT_SCHOOL] = default_deadline
+        return [
+            school
+            for school, deadline in deadlines.items()
+            if until is None or deadline < until
+        ]
+
+    def homework_page(self, subj, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL):
+        with self._lock:
+            return self._homework(school)[0].page(subj, cursor, limit, before)
+
+    def subjects_page(self, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL):
+        with self._lock:
+            return self._homework(school)[0].subjects_page(cursor, limit, before)
+
+    def homework_due(self, until, school=DEFAULT_SCHOOL):
+        with self._lock:
+            return self._homework(school)[0].due_before(until)
+
+    def next_deadline(self):
+        with self._lock:
+            deadlines = list(self._deadlines.values())
+            deadline = self.homework.next_deadline()
+            if deadline is not None:
+                deadlines.append(deadline)
+            return min(deadlines, default=None)
+
+    def expire_homework(self, now):
+        with self._lock:
+            today = now.date()
+            due = [school for school, deadline in self._deadlines.items() if deadline < today]
+
+            expired = []
+            for school in [DEFAULT_SCHOOL] + due:
+                homework, flusher = self._homework(school)
+                for hw_id in homework.expired(now):
+                    hw = homework.remove(hw_id)
+                    if hw is None:
+                        continue
+                    flusher.record("hw", "delete", hw_id)
+                    expired.append(
+                        dict(
+                            hw,
+                            id=hw_id,
+                            school=school,
+                            deadline=date.fromisoformat(hw["deadline"]),
+                        )
+                    )
+                self._update_deadline(school, homework)
+            return expired
+
+    def add_pomodoro(self, chat_id, start, duration, task):
+        with self._lock:
+            self.pomodoro_history.add(chat_id, start, duration, task)
+            self.flusher.record("pomodoros", "insert", chat_id, [start, duration, task])
+
+    def pomodoros(self, chat_id):
+        with self._lock:
+            return self.pomodoro_history.get(chat_id)
+
+    def remove_pomodoro(self, chat_id, start):
+        with self._lock:
+            self.pomodoro_history.remove(chat_id, start)
+            self.flusher.record("pomodoros", "remove", chat_id, start)
+
+    def clear_pomodoros(self, chat_id):
+        with self._lock:
+            self.pomodoro_history.clear(chat_id)
+            self.flusher.record("pomodoros", "delete", chat_id)
+
+    def set_timer(self, chat_id, end):
+        with self._lock:
+            self.pomodoro_timers.set(chat_id, end)
+            self.flusher.record("timers", "update", chat_id, end)
+
+    def remove_timer(self, chat_id):
+        with self._lock:
+            if not self.pomodoro_timers.remove(chat_id):
+                return False
+            self.flusher.record("timers", "delete", chat_id)
+            return True
+
+    def timers(self):
+        with self._lock:
+            return self.pomodoro_timers.items()
+
+
+class SqliteStorage(Storage):
+    """SQLite store in WAL mode with indexes on chat_id, subj and deadline
+
+    Schools share the tables, every user and homework row carrying its school,
+    and the indexes lead with the school so each school's rows are contiguous.
+    Each thread gets its own connection. The queries are constant strings with
+    bound parameters, so sqlite3's statement cache prepares each of them once
+    per connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id INTEGER PRIMARY KEY,
+            user_name TEXT,
+            user_type TEXT,
+            teacher_subject TEXT,
+            digest INTEGER NOT NULL DEFAULT 0,
+            school TEXT NOT NULL DEFAULT 'default'
+        );
+        CREATE TABLE IF NOT EXISTS homework (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subj TEXT NOT NULL,
+            task TEXT NOT NULL,
+            deadline TEXT NOT NULL,
+            school TEXT NOT NULL DEFAULT 'default'
+        );
+        CREATE INDEX IF NOT EXISTS homework_deadline ON homework (deadline);
+        CREATE TABLE IF NOT EXISTS pomodoros (
+            chat_id INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            task TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS pomodoros_chat_id ON pomodoros (chat_id);
+        CREATE TABLE IF NOT EXISTS timers (
+            chat_id INTEGER PRIMARY KEY,
+            end_time INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS homework_versions (
+            school TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+    """
+
+    # Bumped in the transaction of every homework change, so processes sharing
+    # the database can tell which schools another one changed
+    BUMP_VERSION = (
+        "INSERT INTO homework_versions (school, version) VALUES (?, 1) "
+        "ON CONFLICT (school) DO UPDATE SET version = version + 1"
+    )
+
+    # Created after the migrations, as they index columns older databases lack
+    INDEXES = """
+        DROP INDEX IF EXISTS homework_subj;
+        CREATE INDEX IF NOT EXISTS homework_school_subj
+            ON homework (school, subj, deadline);
+        CREATE INDEX IF NOT EXISTS users_school ON users (school, user_type);
+    """
+
+    def __init__(self, path, pomodoro_history=50):
+        self.path = path
+        self.pomodoro_history = pomodoro_history
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        """Returns the calling thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def open(self):
+        with self.conn as conn:
+            conn.executescript(self.SCHEMA)
+
+            # Adding columns missing from databases made by older versions
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(users)")]
+            if "digest" not in columns:
+                conn.execute(
+                    "ALTER TABLE users ADD COLUMN digest INTEGER NOT NULL DEFAULT 0"
+                )
+            for table in ("users", "homework"):
+                columns = [
+                    row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+                ]
+                if "school" not in columns:
+                    conn.execute(
+                        f"ALTER TABLE {table} "
+                        "ADD COLUMN school TEXT NOT NULL DEFAULT 'default'"
+                    )
+
+            # Rebuilding homework tables made without AUTOINCREMENT, which reuse
+            # the id of the newest homework once it expires
+            sql = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'homework'"
+            ).fetchone()["sql"]
+            if "AUTOINCREMENT" not in sql:
+                conn.executescript(
+                    """
+                    BEGIN;
+                    ALTER TABLE homework RENAME TO homework_old;
+                    CREATE TABLE homework (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        subj TEXT NOT NULL,
+                        task TEXT NOT NULL,
+                        deadline TEXT NOT NULL,
+                        school TEXT NOT NULL DEFAULT 'default'
+                    );
+                    INSERT INTO homework (id, subj, task, deadline, school)
+                        SELECT id, subj, task, deadline, school FROM homework_old;
+                    DROP TABLE homework_old;
+                    CREATE INDEX IF NOT EXISTS homework_deadline ON homework (deadline);
+                    COMMIT;
+                    """
+                )
+            conn.executescript(self.INDEXES)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def user_type(self, chat_id):
+        row = self.conn.execute(
+            "SELECT user_type FROM users WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row["user_type"] if row else None
+
+    def teacher_subject(self, chat_id):
+        row = self.conn.execute(
+            "SELECT teacher_subject FROM users WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row["teacher_subject"] if row else None
+
+    def add_user(self, chat_id, user_name):
+        with self.conn as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO users (chat_id, user_name) VALUES (?, ?)",
+                (chat_id, user_name),
+            )
+        return cursor.rowcount == 1
+
+    def register_user(
+        self, chat_id, user_type, teacher_subject=None, school=DEFAULT_SCHOOL
+    ):
+        with self.conn as conn:
+            conn.execute(
+                "INSERT INTO users (chat_id, user_type, teacher_subject, school) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET "
+                "user_type = excluded.user_type, teacher_subject = excluded.teacher_subject, "
+                "school = excluded.school",
+                (chat_id, user_type, teacher_subject, school),
+            )
+
+    def school(self, chat_id):
+        row = self.conn.execute(
+            "SELECT school FROM users WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row["school"] if row else None
+
+    def students(self, school=DEFAULT_SCHOOL):
+        rows = self.conn.execute(
+            "SELECT chat_id FROM users WHERE school = ? AND user_type = 'student'",
+            (school,),
+        ).fetchall()
+        return [row["chat_id"] for row in rows]
+
+    def set_digest(self, chat_id, enabled):
+        with self.conn as conn:
+            conn.execute(
+                "UPDATE users SET digest = ? WHERE chat_id = ?", (int(enabled), chat_id)
+            )
+
+    def digest_subscribers(self, school=DEFAULT_SCHOOL):
+        rows = self.conn.execute(
+            "SELECT chat_id FROM users WHERE school = ? AND digest = 1", (school,)
+        ).fetchall()
+        return [row["chat_id"] for row in rows]
+
+    def add_homework(self, subj, task, deadline, school=DEFAULT_SCHOOL):
+        with self.conn as conn:
+            cursor = conn.execute(
+                "INSERT INTO homework (subj, task, deadline, school) VALUES (?, ?, ?, ?)",
+                (subj, task, deadline, school),
+            )
+            conn.execute(self.BUMP_VERSION, (school,))
+        return cursor.lastrowid
+
+    def add_homework_many(self, subj, homework, school=DEFAULT_SCHOOL):
+        with self.conn as conn:
+            # Taking the write lock first so the ids stay ours until the commit,
+            # and continuing from the highest id ever used, as AUTOINCREMENT would
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT MAX("
+                "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'homework'), 0), "
+                "COALESCE((SELECT MAX(id) FROM homework), 0)) + 1 AS id"
+            ).fetchone()
+            hw_ids = list(range(row["id"], row["id"] + len(homework)))
+            conn.executemany(
+                "INSERT INTO homework (id, subj, task, deadline, school) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (hw_id, subj, task, deadline, school)
+                    for hw_id, (task, deadline) in zip(hw_ids, homework)
+                ),
+            )
+            conn.execute(self.BUMP_VERSION, (school,))
+        return hw_ids
+
+    def schools(self, until=None):
+        if until is None:
+            rows = self.conn.execute("SELECT DISTINCT school FROM homework").fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT DISTINCT school FROM homework WHERE deadline < ?",
+                (until.isoformat(),),
+            ).fetchall()
+        return [row["school"] for row in rows]
+
+    def homework_page(
+        self, subj, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL
+    ):
+        # Seeking along the (school, subj, deadline) index, which ends in the id
+        where, params = "school = ? AND subj = ?", [school, subj]
+        if cursor is not None:
+            where += f" AND (deadline, id) {'<' if before else '>'} (?, ?)"
+            params += [cursor[0].isoformat(), cursor[1]]
+        order = "deadline DESC, id DESC" if before else "deadline, id"
+        rows = self.conn.execute(
+            f"SELECT id, subj, task, deadline FROM homework WHERE {where} "
+            f"ORDER BY {order} LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+        homework = [dict(row, deadline=date.fromisoformat(row["deadline"])) for row in rows]
+        return homework, more
+
+    def subjects_page(self, cursor=None, limit=10, before=False, school=DEFAULT_SCHOOL):
+        # One index seek per subject, rather than a DISTINCT walking every row
+        if before:
+            query = (
+                "SELECT subj FROM homework WHERE school = ? AND subj < ? "
+                "ORDER BY subj DESC LIMIT 1"
+            )
+            cursor = "\U0010ffff" if cursor is None else cursor
+        else:
+            query = (
+                "SELECT subj FROM homework WHERE school = ? AND subj > ? "
+                "ORDER BY subj LIMIT 1"
+            )
+            cursor = "" if cursor is None else cursor
+
+        subjects = []
+        while len(subjects) <= limit:
+            row = self.conn.execute(query, (school, cursor)).fetchone()
+            if row is None:
+                break
+            cursor = row["subj"]
+            subjects.append(cursor)
+
+        more = len(subjects) > limit
+        subjects = subjects[:limit]
+        if before:
+            subjects.reverse()
+        return subjects, more
+
+    def homework_due(self, until, school=DEFAULT_SCHOOL):
+        rows = self.conn.execute(
+            "SELECT id, subj, task, deadline FROM homework "
+            "WHERE school = ? AND deadline < ? ORDER BY subj, deadline",
+            (school, until.isoformat()),
+        ).fetchall()
+        return [dict(row, deadline=date.fromisoformat(row["deadline"])) for row in rows]
+
+    def next_deadline(self):
+        row = self.conn.execute("SELECT MIN(deadline) AS deadline FROM homework").fetchone()
+        return date.fromisoformat(row["deadline"]) if row["deadline"] else None
+
+    def expire_homework(self, now):
+        today = now.date().isoformat()
+        with self.conn as conn:
+            rows = conn.execute(
+                "SELECT id, subj, task, deadline, school FROM homework WHERE deadline < ?",
+                (today,),
+            ).fetchall()
+            conn.execute("DELETE FROM homework WHERE deadline < ?", (today,))
+            conn.executemany(
+                self.BUMP_VERSION, ((school,) for school in {row["school"] for row in rows})
+            )
+        return [dict(row, deadline=date.fromisoformat(row["deadline"])) for row in rows]
+
+    def homework_versions(self):
+        rows = self.conn.execute("SELECT school, version FROM homework_versions").fetchall()
+        return {row["school"]: row["version"] for row in rows}
+
+    def add_pomodoro(self, chat_id, start, duration, task):
+        with self.conn as conn:
+            conn.execute(
+                "DELETE FROM pomodoros WHERE chat_id = ? AND start = ?", (chat_id, start)
+            )
+            conn.execute(
+                "INSERT INTO pomodoros (chat_id, start, duration, task) VALUES (?, ?, ?, ?)",
+                (chat_id, start, duration, task),
+            )
+            # Keeping only the user's latest sessions
+            conn.execute(
+                "DELETE FROM pomodoros WHERE chat_id = ? AND rowid NOT IN ("
+                "SELECT rowid FROM pomodoros WHERE chat_id = ? "
+                "ORDER BY start DESC, rowid DESC LIMIT ?)",
+                (chat_id, chat_id, self.pomodoro_history),
+            )
+
+    def pomodoros(self, chat_id):
+        rows = self.conn.execute(
+            "SELECT start, duration, task FROM pomodoros WHERE chat_id = ? "
+            "ORDER BY start, rowid",
+            (chat_id,),
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def remove_pomodoro(self, chat_id, start):
+        with self.conn as conn:
+            conn.execute(
+                "DELETE FROM pomodoros WHERE chat_id = ? AND start = ?", (chat_id, start)
+            )
+
+    def clear_pomodoros(self, chat_id):
+        with self.conn as conn:
+            conn.execute("DELETE FROM pomodoros WHERE chat_id = ?", (chat_id,))
+
+    def set_timer(self, chat_id, end):
+        with self.conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO timers (chat_id, end_time) VALUES (?, ?)", (chat_id, end)
+            )
+
+    def remove_timer(self, chat_id):
+        with self.conn as conn:
+            cursor = conn.execute("DELETE FROM timers WHERE chat_id = ?", (chat_id,))
+        return cursor.rowcount == 1
+
+    def timers(self):
+        rows = self.conn.execute("SELECT chat_id, end_time FROM timers").fetchall()
+        return [tuple(row) for row in rows]
+
+    def import_frames(self, users_df, hw_df, pomodoro_df=None, school=DEFAULT_SCHOOL):
+        """Bulk loads users, homework and pomodoro dataframes in one transaction
+
+        The homework goes into the given school. Other schools' homework gets
+        fresh ids, since CSV storage numbers every school's homework from 1.
+        """
+        users = UserRegistry.from_frame(users_df)
+        homework = HomeworkTable.from_frame(hw_df)
+        pomodoro_history = PomodoroHistory(self.pomodoro_history)
+        if pomodoro_df is not None:
+            pomodoro_history.load_frame(pomodoro_df)
+
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users "
+                "(chat_id, user_name, user_type, teacher_subject, digest, school) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        u["chat_id"],
+                        u["user_name"],
+                        u["user_type"],
+                        u["teacher_subject"],
+                        int(u["digest"]),
+                        u["school"],
+                    )
+                    for u in users
+                ),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO homework (id, subj, task, deadline, school) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        hw_id if school == DEFAULT_SCHOOL else None,
+                        hw["subj"],
+                        hw["task"],
+                        hw["deadline"],
+                        school,
+                    )
+                    for hw_id, hw in sorted(homework.items())
+                ),
+            )
+            conn.execute(self.BUMP_VERSION, (school,))
+            conn.executemany(
+                "INSERT INTO pomodoros (chat_id, start, duration, task) VALUES (?, ?, ?, ?)",
+                pomodoro_history.rows(),
+            )
+        return len(users), len(homework)
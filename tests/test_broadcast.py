@@ -0,0 +1,94 @@
+import time
+
+from broadcast import Broadcaster
+from main import BROADCAST_RATE
+from tools.fakebot import FakeBot
+
+
+def _broadcaster(bot, **kwargs):
+    broadcaster = Broadcaster(bot, rate=BROADCAST_RATE, **kwargs)
+    broadcaster.topic("homework", "\n".join)
+    broadcaster.topic("reminder", "\n".join, window=0.5)
+    broadcaster.start()
+    return broadcaster
+
+
+def _drain(broadcaster, timeout=10):
+    deadline = time.monotonic() + timeout
+    while broadcaster.backlog():
+        assert time.monotonic() < deadline, "broadcast backlog did not drain"
+        time.sleep(0.02)
+
+
+def test_sends_are_paced_to_the_rate():
+    bot = FakeBot()
+    broadcaster = _broadcaster(bot)
+    broadcaster.send(range(1, 2 * BROADCAST_RATE + 1), "Worksheet", "homework")
+    _drain(broadcaster)
+    broadcaster.stop()
+
+    times = sorted(at for _, _, at in bot.sent("sendMessage"))
+    assert len(times) == 2 * BROADCAST_RATE
+    assert times[-1] - times[0] >= (len(times) - 1) / BROADCAST_RATE * 0.9
+    busiest = max(sum(1 for other in times[i:] if other - at < 1) for i, at in enumerate(times))
+    assert busiest <= BROADCAST_RATE + 1
+
+
+def test_items_within_the_window_go_out_as_one_message_per_chat_and_topic():
+    bot = FakeBot()
+    broadcaster = _broadcaster(bot)
+    for task in ("Worksheet 1", "Worksheet 2", "Worksheet 3"):
+        broadcaster.send([1, 2], task, "reminder")
+    broadcaster.send([1], "Essay", "homework")
+    time.sleep(0.6)
+    _drain(broadcaster)
+    broadcaster.stop()
+
+    texts = sorted((data["chat_id"], data["text"]) for _, data, _ in bot.sent("sendMessage"))
+    assert texts == [
+        (1, "Essay"),
+        (1, "Worksheet 1\nWorksheet 2\nWorksheet 3"),
+        (2, "Worksheet 1\nWorksheet 2\nWorksheet 3"),
+    ]
+
+
+def test_a_429_holds_off_sending_for_its_retry_after():
+    bot = FakeBot()
+    broadcaster = _broadcaster(bot)
+    bot.flood(1, retry_after=0.5)
+    started = time.monotonic()
+    broadcaster.send([1, 2], "Worksheet", "homework")
+    _drain(broadcaster)
+    broadcaster.stop()
+
+    sends = bot.sent("sendMessage")
+    assert sorted(data["chat_id"] for _, data, _ in sends) == [1, 2]
+    assert all(at - started >= 0.5 for _, _, at in sends)
+    assert broadcaster.retries == 1
+    assert broadcaster.dropped == 0
+
+
+def test_chats_that_blocked_the_bot_are_dropped_without_retrying():
+    bot = FakeBot()
+    bot.block([2])
+    broadcaster = _broadcaster(bot)
+    broadcaster.send([1, 2, 3], "Worksheet", "homework")
+    _drain(broadcaster)
+    broadcaster.stop()
+
+    assert sorted(data["chat_id"] for _, data, _ in bot.sent("sendMessage")) == [1, 3]
+    assert broadcaster.dropped == 1
+    assert broadcaster.retries == 0
+
+
+def test_stopping_sends_what_is_still_waiting_for_its_window():
+    bot = FakeBot()
+    broadcaster = _broadcaster(bot)
+    broadcaster.topic("digest", "\n".join, window=30)
+    broadcaster.send([1, 2], "Worksheet", "digest")
+    started = time.monotonic()
+    broadcaster.stop()
+
+    assert time.monotonic() - started < 5
+    assert sorted(data["chat_id"] for _, data, _ in bot.sent("sendMessage")) == [1, 2]
+    assert broadcaster.backlog() == 0
@@ -0,0 +1,49 @@
+import socket
+
+from cluster import Cluster, ClusterFront, HashRing, update_chat
+
+
+def test_keys_keep_their_node():
+    ring = HashRing(range(4))
+    assignment = {key: ring.node(key) for key in range(1000)}
+    assert assignment == {key: HashRing(range(4)).node(key) for key in range(1000)}
+    assert set(assignment.values()) == {0, 1, 2, 3}
+
+
+def test_adding_a_node_only_moves_its_share_of_keys():
+    before, after = HashRing(range(4)), HashRing(range(5))
+    moved = [key for key in range(10000) if before.node(key) != after.node(key)]
+
+    # Every moved key goes to the new node, about a fifth of them
+    assert {after.node(key) for key in moved} == {4}
+    assert 0.1 < len(moved) / 10000 < 0.3
+
+
+def test_a_single_worker_owns_every_chat():
+    assert all(Cluster().owns(chat_id) for chat_id in range(100))
+    owners = [[Cluster(3, i).owns(chat_id) for i in range(3)] for chat_id in range(100)]
+    assert all(sum(owned) == 1 for owned in owners)
+
+
+def test_updates_belong_to_their_chat_or_user():
+    user = {"id": 5, "is_bot": False, "first_name": "Ann"}
+    message = {"message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "from": user}
+    assert update_chat({"update_id": 1, "message": message}) == 7
+    assert update_chat({"update_id": 1, "edited_message": message}) == 7
+    query = {"id": "1", "from": user}
+    assert update_chat({"update_id": 1, "callback_query": dict(query, message=message)}) == 7
+    assert update_chat({"update_id": 1, "callback_query": query}) == 5
+    assert update_chat({"update_id": 1, "inline_query": dict(query, query="")}) == 5
+    assert update_chat({"update_id": 1}) == 0
+
+
+def test_a_polling_front_does_not_listen():
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    try:
+        port = taken.getsockname()[1]
+        front = ClusterFront("127.0.0.1", port, "/hook", "", 1, "127.0.0.1", 9, "", 1)
+        front.stop()
+    finally:
+        taken.close()
@@ -0,0 +1,163 @@
+import json, threading
+
+from homework import HomeworkTable
+from storage import Flusher, Journal, write_atomic
+from users import UserRegistry
+
+
+def _tables(directory):
+    users, homework = UserRegistry(), HomeworkTable()
+    flusher = Flusher(Journal(str(directory / "journal.jsonl")))
+    flusher.register("users", users, str(directory / "users.csv"))
+    flusher.register("hw", homework, str(directory / "hw.csv"))
+    return flusher, users, homework
+
+
+def _restart(directory):
+    """Returns tables loaded from what a previous run left on disk"""
+    flusher, users, homework = _tables(directory)
+    flusher.load()
+    return users, homework
+
+
+def _chat_ids(users):
+    return sorted(user["chat_id"] for user in users)
+
+
+def _add_user(flusher, users, chat_id, name):
+    users.add(chat_id, name)
+    flusher.record("users", "insert", chat_id, users.get(chat_id))
+
+
+def _add_homework(flusher, homework, subj, task, deadline):
+    hw_id = homework.add(subj, task, deadline)
+    flusher.record("hw", "insert", hw_id, homework.get(hw_id))
+    return hw_id
+
+
+def test_records_are_replayed_over_the_snapshot(tmp_path):
+    flusher, users, homework = _tables(tmp_path)
+    _add_user(flusher, users, 1, "@ann")
+    _add_user(flusher, users, 2, "@bob")
+    kept = _add_homework(flusher, homework, "Math", "Worksheet", "2030-01-02")
+    dropped = _add_homework(flusher, homework, "Math", "Essay", "2030-01-03")
+    flusher.flush()
+
+    # Changing every table after the snapshot, then crashing
+    users.register(1, "teacher", "Math")
+    flusher.record("users", "update", 1, users.get(1))
+    users.apply("delete", 2, None)
+    flusher.record("users", "delete", 2)
+    homework.remove(dropped)
+    flusher.record("hw", "delete", dropped)
+    added = _add_homework(flusher, homework, "Art", "Sketch", "2030-01-04")
+    flusher.journal.close()
+
+    users, homework = _restart(tmp_path)
+    assert _chat_ids(users) == [1]
+    assert users.user_type(1) == "teacher"
+    assert users.teacher_subject(1) == "Math"
+    assert sorted(hw_id for hw_id, _ in homework.items()) == [kept, added]
+    assert homework.get(added)["task"] == "Sketch"
+
+
+def test_a_torn_last_record_is_skipped(tmp_path):
+    flusher, users, _ = _tables(tmp_path)
+    _add_user(flusher, users, 1, "@ann")
+    flusher.journal.close()
+
+    # A crash in the middle of writing the second record
+    torn = '{"table":"users","op":"insert","key":2,"val'
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write(torn)
+
+    users, _ = _restart(tmp_path)
+    assert _chat_ids(users) == [1]
+
+    # Records appended after a torn line start on a line of their own
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write(torn)
+    journal = Journal(str(tmp_path / "journal.jsonl"))
+    journal.append("users", "insert", 3, {"chat_id": 3, "user_name": "@cat"})
+    journal.close()
+    assert [record["key"] for record in journal.replay()] == [3]
+
+
+def test_a_rotated_journal_left_by_a_crash_is_replayed(tmp_path):
+    flusher, users, homework = _tables(tmp_path)
+    _add_user(flusher, users, 1, "@ann")
+    _add_homework(flusher, homework, "Math", "Worksheet", "2030-01-02")
+
+    # Crashing after the rotation, before any snapshot was written
+    flusher.journal.rotate()
+    _add_user(flusher, users, 2, "@bob")
+    flusher.journal.close()
+    assert (tmp_path / "journal.jsonl.old").exists()
+
+    users, homework = _restart(tmp_path)
+    assert _chat_ids(users) == [1, 2]
+    assert len(homework) == 1
+
+    # Loading compacted both journals into the snapshots
+    assert not (tmp_path / "journal.jsonl.old").exists()
+    users, homework = _restart(tmp_path)
+    assert _chat_ids(users) == [1, 2]
+
+
+def test_records_the_snapshot_already_holds_are_replayed_harmlessly(tmp_path):
+    flusher, users, homework = _tables(tmp_path)
+    _add_user(flusher, users, 1, "@ann")
+    hw_id = _add_homework(flusher, homework, "Math", "Worksheet", "2030-01-02")
+    users.register(1, "student")
+    flusher.record("users", "update", 1, users.get(1))
+
+    # Crashing after the snapshot was written, before the journal was dropped
+    flusher.journal.rotate()
+    write_atomic(users.to_frame(), str(tmp_path / "users.csv"))
+    write_atomic(homework.to_frame(), str(tmp_path / "hw.csv"))
+    flusher.journal.close()
+
+    users, homework = _restart(tmp_path)
+    assert _chat_ids(users) == [1]
+    assert users.user_type(1) == "student"
+    assert [hw_id for hw_id, _ in homework.items()] == [hw_id]
+    assert homework.next_deadline() is not None
+
+    # Replaying every record once more still changes nothing
+    before = (users.to_frame().to_dict(), homework.to_frame().to_dict())
+    for record in Journal(str(tmp_path / "journal.jsonl")).replay():
+        table = users if record["table"] == "users" else homework
+        table.apply(record["op"], record["key"], record["values"])
+    assert (users.to_frame().to_dict(), homework.to_frame().to_dict()) == before
+
+
+def test_write_atomic_leaves_no_partial_file(tmp_path):
+    users = UserRegistry()
+    users.add(1, "@ann")
+    path = tmp_path / "users.csv"
+    write_atomic(users.to_frame(), str(path))
+    assert not (tmp_path / "users.csv.tmp").exists()
+    assert "@ann" in path.read_text()
+
+
+def test_records_are_single_json_lines(tmp_path):
+    journal = Journal(str(tmp_path / "journal.jsonl"))
+    journal.append_many("hw", "insert", [(1, {"task": "a\nb"}), (2, {"task": "c"})])
+    journal.close()
+    lines = (tmp_path / "journal.jsonl").read_text().splitlines()
+    assert [json.loads(line)["key"] for line in lines] == [1, 2]
+
+
+def test_tables_are_copied_holding_the_writers_lock(tmp_path):
+    flusher, users, _ = _tables(tmp_path)
+    _add_user(flusher, users, 1, "@ann")
+
+    # A writer holding the lock keeps the snapshot waiting
+    with flusher.lock:
+        flushing = threading.Thread(target=flusher.flush)
+        flushing.start()
+        flushing.join(0.2)
+        assert flushing.is_alive()
+        assert not (tmp_path / "users.csv").exists()
+    flushing.join(5)
+    assert "@ann" in (tmp_path / "users.csv").read_text()
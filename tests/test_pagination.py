@@ -0,0 +1,123 @@
+import bisect
+from datetime import date
+
+import main
+from homework import HomeworkTable
+from storage import SqliteStorage
+
+
+def _table(count):
+    homework = HomeworkTable()
+    homework.add_many("Math", [(f"Essay {i}", f"2030-01-{i + 1:02d}") for i in range(count)])
+    return homework
+
+
+def _tasks(page):
+    return [hw["task"] for hw in page]
+
+
+def _cursor(hw):
+    return hw["deadline"], hw["id"]
+
+
+def test_homework_pages_forwards():
+    homework = _table(5)
+    page, more = homework.page("Math", None, 2)
+    assert (_tasks(page), more) == (["Essay 0", "Essay 1"], True)
+    page, more = homework.page("Math", _cursor(page[-1]), 2)
+    assert (_tasks(page), more) == (["Essay 2", "Essay 3"], True)
+    page, more = homework.page("Math", _cursor(page[-1]), 2)
+    assert (_tasks(page), more) == (["Essay 4"], False)
+    assert homework.page("Math", _cursor(page[-1]), 2) == ([], False)
+
+
+def test_homework_pages_backwards():
+    homework = _table(5)
+    page, more = homework.page("Math", None, 2, before=True)
+    assert (_tasks(page), more) == (["Essay 3", "Essay 4"], True)
+    page, more = homework.page("Math", _cursor(page[0]), 2, before=True)
+    assert (_tasks(page), more) == (["Essay 1", "Essay 2"], True)
+    page, more = homework.page("Math", _cursor(page[0]), 2, before=True)
+    assert (_tasks(page), more) == (["Essay 0"], False)
+    assert homework.page("Math", _cursor(page[0]), 2, before=True) == ([], False)
+
+
+def test_homework_pages_at_the_edges():
+    assert HomeworkTable().page("Math") == ([], False)
+    assert _table(5).page("Art", None, 2, before=True) == ([], False)
+
+    # A page that exactly fills the last one has nothing beyond it
+    homework = _table(4)
+    page, more = homework.page("Math", (date(2030, 1, 2), 1), 2)
+    assert (_tasks(page), more) == (["Essay 2", "Essay 3"], False)
+    page, more = homework.page("Math", (date(2030, 1, 3), 2), 2, before=True)
+    assert (_tasks(page), more) == (["Essay 0", "Essay 1"], False)
+
+
+def _fetch(items, limit=2):
+    """Returns a fetch over sorted items whose cursors are the items themselves"""
+
+    def fetch(cursor, before):
+        if before:
+            end = bisect.bisect_left(items, cursor) if cursor is not None else len(items)
+            start = max(end - limit, 0)
+            return items[start:end], start > 0
+        start = bisect.bisect_right(items, cursor) if cursor is not None else 0
+        return items[start : start + limit], start + limit < len(items)
+
+    return fetch
+
+
+def test_page_reports_the_pages_on_either_side():
+    fetch = _fetch([1, 2, 3, 4, 5])
+    assert main._page(fetch, None, False) == ([1, 2], False, True)
+    assert main._page(fetch, 2, False) == ([3, 4], True, True)
+    assert main._page(fetch, 4, False) == ([5], True, False)
+    assert main._page(fetch, 5, True) == ([3, 4], True, True)
+    assert main._page(fetch, 3, True) == ([1, 2], False, True)
+
+
+def test_page_falls_back_to_the_first_page_once_emptied():
+    fetch = _fetch([1, 2, 3])
+    assert main._page(fetch, 3, False) == ([1, 2], False, True)
+    assert main._page(fetch, 1, True) == ([1, 2], False, True)
+    assert main._page(_fetch([]), None, False) == ([], False, False)
+    assert main._page(_fetch([]), 1, True) == ([], False, False)
+
+
+def _navigation(keyboard):
+    """Returns the callback data of a keyboard's Previous and Next buttons"""
+    return [
+        button.callback_data
+        for row in keyboard.inline_keyboard
+        for button in row
+        if button.text in ("Previous", "Next")
+    ]
+
+
+def test_subject_pages_fit_in_callback_data(tmp_path, monkeypatch):
+    storage = SqliteStorage(str(tmp_path / "dionysus.db"))
+    storage.open()
+    monkeypatch.setattr(main, "storage", storage)
+    monkeypatch.setattr(main, "render_cache", main.RenderCache())
+    try:
+        # Subjects as long as a callback data's 64 bytes
+        subjects = [f"{i:02d}".ljust(64, "x") for i in range(main.SUBJECT_PAGE_SIZE * 2 + 1)]
+        for subj in subjects:
+            storage.add_homework(subj, "Worksheet", "2030-01-02")
+
+        assert _navigation(main._subject_keyboard("default")) == ["subjects_next:1"]
+        assert _navigation(main._subject_keyboard("default", 1)) == [
+            "subjects_prev:0",
+            "subjects_next:2",
+        ]
+        last = main._subject_keyboard("default", 2)
+        assert _navigation(last) == ["subjects_prev:1"]
+        assert last.inline_keyboard[0][0].text == subjects[-1].capitalize()
+
+        # A page past the last falls back to the first
+        first = main._subject_keyboard("default", 3)
+        assert _navigation(first) == ["subjects_next:1"]
+        assert first.inline_keyboard[0][0].text == subjects[0].capitalize()
+    finally:
+        storage.close()
@@ -0,0 +1,82 @@
+import os
+
+from pomodoro import PomodoroHistory
+from storage import CsvStorage, write_atomic
+
+
+def _storage(directory):
+    path = lambda name: os.path.join(directory, name)
+    return CsvStorage(
+        path("users.csv"),
+        path("hw.csv"),
+        path("pomodoros.csv"),
+        path("timers.csv"),
+        path("journal.jsonl"),
+        shards_dir=path("schools"),
+    )
+
+
+def test_replaying_a_session_again_keeps_one():
+    history = PomodoroHistory()
+    history.apply("insert", 1, [100, 25, "Physics"])
+    history.apply("insert", 1, [100, 25, "Physics"])
+    assert history.get(1) == [(100, 25, "Physics")]
+
+
+def test_replaying_a_session_past_the_limit_keeps_the_latest():
+    history = PomodoroHistory(limit=2)
+    for start in (100, 200, 300):
+        history.add(1, start, 25, "Physics")
+    history.apply("insert", 1, [100, 25, "Physics"])
+    assert history.get(1) == [(200, 25, "Physics"), (300, 25, "Physics")]
+
+
+def test_session_recorded_during_compaction_is_not_duplicated(tmp_path):
+    storage = _storage(tmp_path)
+    storage.open()
+    storage.add_pomodoro(1, 100, 25, "A")
+
+    # Recording B between the journal rotation and the snapshot, which then
+    # holds B while the new journal does too
+    storage.flusher.journal.rotate()
+    storage.add_pomodoro(1, 200, 25, "B")
+    write_atomic(storage.pomodoro_history.to_frame(), tmp_path / "pomodoros.csv")
+    storage.flusher.journal.discard_rotated()
+    storage.flusher.journal.close()
+
+    reopened = _storage(tmp_path)
+    reopened.open()
+    assert reopened.pomodoros(1) == [(100, 25, "A"), (200, 25, "B")]
+    reopened.close()
+
+
+def test_crash_before_dropping_the_rotated_journal_does_not_duplicate(tmp_path):
+    storage = _storage(tmp_path)
+    storage.open()
+    storage.add_pomodoro(1, 100, 25, "A")
+    storage.flusher.flush()
+    storage.add_pomodoro(1, 200, 25, "B")
+
+    # Writing the snapshot, then crashing before the rotated journal is dropped
+    storage.flusher.journal.rotate()
+    write_atomic(storage.pomodoro_history.to_frame(), tmp_path / "pomodoros.csv")
+    storage.flusher.journal.close()
+
+    reopened = _storage(tmp_path)
+    reopened.open()
+    assert reopened.pomodoros(1) == [(100, 25, "A"), (200, 25, "B")]
+    reopened.close()
+
+
+def test_removing_a_session_survives_a_restart(tmp_path):
+    storage = _storage(tmp_path)
+    storage.open()
+    storage.add_pomodoro(1, 100, 25, "A")
+    storage.add_pomodoro(1, 200, 25, "B")
+    storage.remove_pomodoro(1, 200)
+    storage.flusher.journal.close()
+
+    reopened = _storage(tmp_path)
+    reopened.open()
+    assert reopened.pomodoros(1) == [(100, 25, "A")]
+    reopened.close()
@@ -0,0 +1,19 @@
+from datetime import date, datetime, time, timedelta
+
+from reminders import ReminderQueue
+
+
+def test_reminders_count_back_from_the_due_time():
+    reminders = ReminderQueue(due_time=time(8, 0))
+    reminders.add(1, "Physics", "Worksheet", date(2026, 3, 10), datetime(2026, 3, 1))
+    assert reminders.next_time() == datetime(2026, 3, 9, 8, 0)
+    assert [reminder[1] for reminder in reminders.due(datetime(2026, 3, 10, 7, 0))] == [
+        timedelta(hours=24),
+        timedelta(hours=1),
+    ]
+
+
+def test_reminders_already_past_are_not_queued():
+    reminders = ReminderQueue(due_time=time(8, 0))
+    reminders.add(1, "Physics", "Worksheet", date(2026, 3, 10), datetime(2026, 3, 9, 12))
+    assert reminders.next_time() == datetime(2026, 3, 10, 7, 0)
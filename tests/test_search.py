@@ -0,0 +1,69 @@
+from datetime import date
+
+from search import HomeworkIndex, tokenize
+
+
+def _index():
+    index = HomeworkIndex()
+    index.add(1, "Math", "Algebra worksheet", date(2030, 1, 5))
+    index.add(2, "Math", "Geometry worksheet", date(2030, 1, 3))
+    index.add(3, "Physics", "Work and energy", date(2030, 1, 4))
+    index.add(4, "Chemistry", "Worked examples", date(2030, 1, 2))
+    return index
+
+
+def _ids(results):
+    return [result[0] for result in results]
+
+
+def test_tasks_are_split_into_lowercase_words():
+    assert tokenize("Read Ch. 3-4, then e-mail!") == ["read", "ch", "3", "4", "then", "e", "mail"]
+
+
+def test_query_words_match_word_prefixes():
+    index = _index()
+    assert _ids(index.search("alg")) == [1]
+    assert _ids(index.search("GEO")) == [2]
+    assert _ids(index.search("phys")) == [3]
+    assert index.search("gebra") == []
+    assert index.search("   ") == []
+
+
+def test_every_query_word_has_to_match():
+    index = _index()
+    assert _ids(index.search("math work")) == [2, 1]
+    assert _ids(index.search("work energy")) == [3]
+    assert index.search("math energy") == []
+
+
+def test_whole_words_rank_first_then_soonest_deadlines():
+    index = _index()
+    results = index.search("work")
+    assert _ids(results) == [3, 4, 2, 1]
+    assert results[0] == (3, "Physics", "Work and energy", date(2030, 1, 4))
+    assert _ids(index.search("work", limit=2)) == [3, 4]
+
+
+def test_the_soonest_of_many_matches_are_picked():
+    index = HomeworkIndex()
+    for hw_id in range(200):
+        index.add(hw_id, "Math", f"Exercise {hw_id}", date(2030, 1, 1 + (199 - hw_id) % 28))
+    index.add(200, "Art", "Sketch", date(2029, 1, 1))
+
+    # Many matches are picked off the deadline order, few out of the matches
+    soonest = index.search("exercise", limit=3)
+    assert [result[3] for result in soonest] == [date(2030, 1, 1)] * 3
+    assert _ids(index.search("math 19", limit=2)) == [19, 199]
+
+
+def test_removed_and_replaced_homework_is_dropped():
+    index = _index()
+    index.remove(2)
+    index.remove(2)
+    assert _ids(index.search("worksheet")) == [1]
+    assert index.search("geometry") == []
+
+    index.add(1, "Math", "Trigonometry", date(2030, 1, 1))
+    assert index.search("algebra") == []
+    assert _ids(index.search("trig")) == [1]
+    assert len(index) == 3
@@ -0,0 +1,188 @@
+import queue
+from datetime import date, datetime
+
+from telegram import Update
+from telegram.ext import CommandHandler, ConversationHandler, Dispatcher, Filters, MessageHandler
+
+from sessions import LazyConversations, SessionPersistence, SessionStore, dumps, loads
+from tools.fakebot import FakeBot
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _store(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"), interval=60)
+    store.open()
+    return store
+
+
+def test_dates_and_datetimes_round_trip():
+    value = {
+        "deadline": date(2030, 1, 2),
+        "started": datetime(2030, 1, 2, 8, 30, 15),
+        "tasks": [date(2030, 1, 3), {"$date": "not a date", "note": "kept as is"}],
+    }
+    assert loads(dumps(value)) == value
+
+
+def test_user_data_is_loaded_on_first_access(tmp_path):
+    store = _store(tmp_path)
+    store.save_user_data(1, {"deadline": date(2030, 1, 2)})
+    store.close()
+
+    loaded = []
+    store = _store(tmp_path)
+    persistence = SessionPersistence(store)
+    store_user_data = store.user_data
+    store.user_data = lambda user_id: loaded.append(user_id) or store_user_data(user_id)
+    try:
+        user_data = persistence.get_user_data()
+        assert loaded == [] and len(user_data) == 0
+        assert user_data[1] == {"deadline": date(2030, 1, 2)}
+        assert user_data[2] == {}
+        assert user_data[1] is user_data[1]
+        assert loaded == [1, 2]
+    finally:
+        store.close()
+
+
+def test_only_the_updated_users_data_is_saved(tmp_path):
+    store = _store(tmp_path)
+    persistence = SessionPersistence(store)
+    user_data = persistence.get_user_data()
+    user_data[1]["step"] = 1
+    user_data[2]["step"] = 2
+    try:
+        # PTB saving every loaded user after a job is skipped
+        persistence.update_user_data(1, user_data[1])
+        persistence.update_user_data(2, user_data[2])
+        assert store.user_data(1) is None and store.user_data(2) is None
+
+        # Saving after the thread's own update, once
+        persistence.refresh_user_data(1, user_data[1])
+        persistence.update_user_data(2, user_data[2])
+        persistence.update_user_data(1, user_data[1])
+        assert store.user_data(1) == {"step": 1}
+        assert store.user_data(2) is None
+
+        # Until the user's next update
+        persistence.update_user_data(1, {"step": 3})
+        store.flush()
+        assert store.user_data(1) == {"step": 1}
+    finally:
+        store.close()
+
+
+def test_idle_sessions_are_evicted_and_reloaded(tmp_path):
+    clock = _Clock()
+    store = _store(tmp_path)
+    persistence = SessionPersistence(store, idle=60, clock=clock)
+    conversations = persistence.get_conversations("menu")
+    try:
+        user_data = persistence.get_user_data()
+        persistence.refresh_user_data(1, user_data[1])
+        user_data[1]["step"] = 1
+        persistence.update_user_data(1, user_data[1])
+        conversations[(1, 1)] = 2
+        persistence.update_conversation("menu", (1, 1), 2)
+        store.flush()
+
+        clock.now = 30
+        persistence.refresh_user_data(2, user_data[2])
+        assert persistence.evict_idle() == 0
+
+        clock.now = 61
+        assert persistence.evict_idle() == 1
+        assert 1 not in user_data and 2 in user_data
+        assert dict(conversations) == {}
+
+        # Loaded back from the store on the next update
+        assert user_data[1] == {"step": 1}
+        assert conversations.get((1, 1)) == 2
+    finally:
+        store.close()
+
+
+def test_conversations_not_saved_are_looked_up_once():
+    looked_up = []
+    saved = {(1, 1): "asking"}
+    conversations = LazyConversations(
+        lambda key: looked_up.append(key) or saved.get(key), lambda user_id: None
+    )
+
+    assert conversations.get((2, 2)) is None
+    assert (2, 2) not in conversations
+    assert conversations.get((1, 1)) == "asking"
+    assert (1, 1) in conversations
+    assert looked_up == [(2, 2), (1, 1)]
+
+    # Starting, ending and forgetting conversations keep the absent ones right
+    conversations[(2, 2)] = "started"
+    assert conversations[(2, 2)] == "started"
+    del conversations[(2, 2)]
+    assert (2, 2) not in conversations
+    conversations.forget({2})
+    assert (2, 2) not in conversations
+    assert looked_up == [(2, 2), (1, 1), (2, 2)]
+
+
+def _update(bot, update_id, text):
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "Ann"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def _dispatcher(tmp_path, bot, seen):
+    """Returns a dispatcher with a persistent conversation asking for a deadline"""
+
+    def start(update, context):
+        context.user_data["started"] = date(2030, 1, 2)
+        return 1
+
+    def deadline(update, context):
+        seen.append((update.message.text, dict(context.user_data)))
+        return ConversationHandler.END
+
+    store = _store(tmp_path)
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=0, persistence=SessionPersistence(store))
+    dispatcher.add_handler(
+        ConversationHandler(
+            entry_points=[CommandHandler("start", start)],
+            states={1: [MessageHandler(Filters.text, deadline)]},
+            fallbacks=[],
+            name="deadline",
+            persistent=True,
+        )
+    )
+    return dispatcher, store
+
+
+def test_conversations_survive_a_restart(tmp_path):
+    bot, seen = FakeBot(), []
+    dispatcher, store = _dispatcher(tmp_path, bot, seen)
+    dispatcher.process_update(_update(bot, 1, "/start"))
+    store.close()
+
+    dispatcher, store = _dispatcher(tmp_path, bot, seen)
+    try:
+        dispatcher.process_update(_update(bot, 2, "2030-01-05"))
+        assert seen == [("2030-01-05", {"started": date(2030, 1, 2)})]
+
+        # The conversation ended, so the next message starts nothing
+        dispatcher.process_update(_update(bot, 3, "2030-01-06"))
+        assert len(seen) == 1
+    finally:
+        store.close()
@@ -0,0 +1,193 @@
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+from storage import CsvStorage, SqliteStorage
+from tools import migrate_csv
+
+
+def _csv_storage(directory):
+    path = lambda name: os.path.join(directory, name)
+    return CsvStorage(
+        path("users.csv"),
+        path("hw.csv"),
+        path("pomodoros.csv"),
+        path("timers.csv"),
+        path("journal.jsonl"),
+        shards_dir=path("schools"),
+    )
+
+
+def _sqlite_storage(directory):
+    return SqliteStorage(os.path.join(directory, "dionysus.db"))
+
+
+def _homework(records):
+    """Returns homework records without their ids, which the backends number differently"""
+    return [(hw["subj"], hw["task"], hw["deadline"], hw.get("school")) for hw in records]
+
+
+def _pages(storage, subj, limit, school="default"):
+    """Returns a subject's homework page by page, forwards then backwards"""
+    forwards, cursor, more = [], None, True
+    while more:
+        page, more = storage.homework_page(subj, cursor, limit, school=school)
+        forwards.append(_homework(page))
+        cursor = (page[-1]["deadline"], page[-1]["id"]) if page else None
+
+    backwards, cursor, more = [], None, True
+    while more:
+        page, more = storage.homework_page(subj, cursor, limit, before=True, school=school)
+        backwards.append(_homework(page))
+        cursor = (page[0]["deadline"], page[0]["id"]) if page else None
+    return forwards, backwards
+
+
+def _subject_pages(storage, limit, school="default"):
+    pages, cursor, more = [], None, True
+    while more:
+        subjects, more = storage.subjects_page(cursor, limit, school=school)
+        pages.append(subjects)
+        cursor = subjects[-1] if subjects else None
+    page, more = storage.subjects_page(pages[-1][-1], limit, before=True, school=school)
+    return pages, (page, more)
+
+
+def _scenario(storage):
+    """Runs the handlers' and jobs' calls through the Storage interface, returns what they saw"""
+    seen = {}
+    assert storage.add_user(1, "@ann")
+    assert storage.add_user(2, "@bob")
+    assert storage.add_user(3, "@cat")
+    seen["added twice"] = storage.add_user(1, "@ann")
+    storage.register_user(1, "teacher", "Math")
+    storage.register_user(2, "student")
+    storage.register_user(3, "student", school="riverside")
+    storage.register_user(4, "student")
+    storage.set_digest(2, True)
+    seen["users"] = [
+        (storage.user_type(chat_id), storage.teacher_subject(chat_id), storage.school(chat_id))
+        for chat_id in range(1, 6)
+    ]
+    seen["students"] = sorted(storage.students()), sorted(storage.students("riverside"))
+    seen["digest"] = storage.digest_subscribers(), storage.digest_subscribers("riverside")
+
+    storage.add_homework("Math", "Worksheet", "2030-01-02")
+    ids = storage.add_homework_many(
+        "Math", [(f"Essay {i}", f"2030-01-{i + 3:02d}") for i in range(5)]
+    )
+    seen["ids"] = len(set(ids))
+    storage.add_homework_many("Art", [("Sketch", "2030-01-05"), ("Collage", "2030-01-03")])
+    storage.add_homework_many("Music", [])
+    storage.add_homework("Art", "Paint", "2030-01-04", school="riverside")
+
+    seen["math pages"] = _pages(storage, "Math", 2)
+    seen["riverside pages"] = _pages(storage, "Art", 2, school="riverside")
+    seen["missing subject"] = storage.homework_page("Drama", None, 2)
+    seen["subject pages"] = _subject_pages(storage, 1)
+    seen["due"] = _homework(storage.homework_due(date(2030, 1, 5)))
+    seen["next deadline"] = storage.next_deadline()
+    seen["schools"] = sorted(storage.schools()), sorted(storage.schools(date(2030, 1, 3)))
+
+    expired = storage.expire_homework(datetime(2030, 1, 4, 12))
+    seen["expired"] = sorted(_homework(expired))
+    seen["after expiry"] = _pages(storage, "Math", 10), _pages(storage, "Art", 10)
+    seen["next deadline after expiry"] = storage.next_deadline()
+
+    storage.set_timer(1, 100)
+    storage.set_timer(2, 200)
+    storage.set_timer(2, 250)
+    seen["timer removed"] = storage.remove_timer(1), storage.remove_timer(1)
+    seen["timers"] = sorted(storage.timers())
+
+    storage.add_pomodoro(1, 100, 25, "Physics")
+    storage.add_pomodoro(1, 300, 25, "Chemistry")
+    storage.add_pomodoro(1, 200, 25, "Biology")
+    storage.add_pomodoro(1, 300, 40, "Chemistry")
+    storage.add_pomodoro(2, 100, 10, "Art")
+    storage.remove_pomodoro(1, 100)
+    seen["pomodoros"] = storage.pomodoros(1), storage.pomodoros(2)
+    storage.clear_pomodoros(2)
+    seen["cleared"] = storage.pomodoros(2)
+    return seen
+
+
+@pytest.fixture
+def backends(tmp_path):
+    opened = []
+    for name, make in (("csv", _csv_storage), ("sqlite", _sqlite_storage)):
+        directory = tmp_path / name
+        directory.mkdir()
+        storage = make(str(directory))
+        storage.open()
+        opened.append(storage)
+    yield opened
+    for storage in opened:
+        storage.close()
+
+
+def test_both_backends_answer_alike(backends):
+    csv, sqlite = (_scenario(storage) for storage in backends)
+    for key in csv:
+        assert csv[key] == sqlite[key], key
+
+    # Spot checks, so that agreeing on something wrong fails too
+    assert csv["added twice"] is False
+    assert csv["users"][3] == ("student", None, "default")
+    assert csv["users"][4] == (None, None, None)
+    assert [len(page) for page in csv["math pages"][0]] == [2, 2, 2]
+    assert csv["math pages"][1][0][-1][1] == "Essay 4"
+    assert csv["subject pages"][0] == [["Art"], ["Math"]]
+    assert csv["expired"] == [
+        ("Art", "Collage", date(2030, 1, 3), "default"),
+        ("Math", "Essay 0", date(2030, 1, 3), "default"),
+        ("Math", "Worksheet", date(2030, 1, 2), "default"),
+    ]
+    assert csv["timers"] == [(2, 250)]
+    assert csv["pomodoros"] == (
+        [(200, 25, "Biology"), (300, 40, "Chemistry")],
+        [(100, 10, "Art")],
+    )
+
+
+def _saved(storage):
+    """Returns what the scenario left in a store"""
+    return {
+        "users": [
+            (storage.user_type(chat_id), storage.teacher_subject(chat_id), storage.school(chat_id))
+            for chat_id in range(1, 5)
+        ],
+        "digest": storage.digest_subscribers(),
+        "homework": [
+            _pages(storage, subj, 10, school)
+            for school in ("default", "riverside")
+            for subj in ("Art", "Drama", "Math")
+        ],
+        "pomodoros": storage.pomodoros(1),
+    }
+
+
+def test_migrate_csv_round_trips(tmp_path, monkeypatch):
+    csv = _csv_storage(str(tmp_path))
+    csv.open()
+    _scenario(csv)
+    csv.add_homework("Drama", "Script", "2030-02-01", school="riverside")
+    csv.close()
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["migrate_csv", "--db", "dionysus.db"])
+    migrate_csv.main()
+
+    csv = _csv_storage(str(tmp_path))
+    csv.open()
+    sqlite = _sqlite_storage(str(tmp_path))
+    sqlite.open()
+    try:
+        saved = _saved(csv)
+        assert saved == _saved(sqlite)
+        assert saved["homework"][4][0] == [[("Drama", "Script", date(2030, 2, 1), None)]]
+    finally:
+        csv.close()
+        sqlite.close()
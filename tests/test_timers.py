@@ -0,0 +1,88 @@
+import threading
+
+from timers import TimerWheel
+
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _wheel(slots=8, now=1000.0):
+    clock = _Clock(now)
+    return TimerWheel(lambda keys: None, tick=1.0, slots=slots, clock=clock), clock
+
+
+def test_timers_are_scheduled_and_cancelled():
+    wheel, clock = _wheel()
+    wheel.schedule("ann", 1003.5)
+    wheel.schedule("bob", 1005)
+    assert len(wheel) == 2 and "ann" in wheel
+
+    clock.now = 1001
+    assert wheel.cancel("ann") == 2.5
+    assert wheel.cancel("ann") is None
+    assert "ann" not in wheel
+    assert wheel.advance(1010) == [["bob"]]
+    assert len(wheel) == 0
+
+
+def test_rescheduling_replaces_the_timer():
+    wheel, _ = _wheel()
+    wheel.schedule("ann", 1002)
+    wheel.schedule("ann", 1004)
+    assert wheel.advance(1003) == []
+    assert wheel.advance(1004) == [["ann"]]
+
+
+def test_timers_fire_after_the_wheel_rolls_over():
+    wheel, _ = _wheel(slots=8)
+
+    # Both hash into the same slot, a lap of the wheel apart
+    wheel.schedule("soon", 1003)
+    wheel.schedule("later", 1011)
+    assert wheel.advance(1003) == [["soon"]]
+    assert wheel.advance(1010) == []
+    assert "later" in wheel
+    assert wheel.advance(1011) == [["later"]]
+
+    # A timer many laps away is left alone until its lap comes round
+    wheel.schedule("far", 1011 + 8 * 5)
+    assert wheel.advance(1011 + 8 * 5 - 1) == []
+    assert wheel.advance(1011 + 8 * 5) == [["far"]]
+
+
+def test_timers_due_in_the_same_tick_fire_as_one_batch():
+    wheel, _ = _wheel()
+    wheel.schedule("ann", 1002.1)
+    wheel.schedule("bob", 1002.9)
+    wheel.schedule("cat", 1003)
+    assert wheel.advance(1005) == [["ann", "bob"], ["cat"]]
+
+
+def test_overdue_timers_fire_on_the_next_tick():
+    wheel, _ = _wheel()
+    wheel.schedule("ann", 900)
+    wheel.schedule("bob", 1000.5)
+    assert wheel.advance(1000.9) == []
+    assert wheel.advance(1001) == [["ann", "bob"]]
+
+
+def test_the_thread_hands_batches_to_the_callback():
+    fired, done = [], threading.Event()
+
+    def callback(keys):
+        fired.append(keys)
+        done.set()
+
+    wheel = TimerWheel(callback, tick=0.01)
+    wheel.schedule("ann", wheel.clock())
+    wheel.start()
+    try:
+        assert done.wait(5)
+    finally:
+        wheel.stop()
+    assert fired == [["ann"]]
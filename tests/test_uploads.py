@@ -0,0 +1,65 @@
+import io
+from datetime import date
+
+from deadlines import DeadlineParser
+from uploads import read_homework_csv
+
+
+def _read(text, max_rows=10_000, encoding="utf-8"):
+    return read_homework_csv(io.BytesIO(text.encode(encoding)), DeadlineParser(), max_rows)
+
+
+def test_valid_rows_are_read_after_the_header():
+    homework, errors = _read(
+        "\ufeffTask,Deadline\r\n"
+        "Worksheet 1, 2030-01-05\r\n"
+        "\r\n"
+        '"Essay, part 2",5 Jan 2031\r\n'
+    )
+    assert errors == []
+    assert homework == [("Worksheet 1", "2030-01-05"), ("Essay  part 2", "2031-01-05")]
+
+
+def test_bad_rows_are_reported_by_line():
+    homework, errors = _read(
+        "Worksheet 1,2030-01-05\n"
+        "No deadline\n"
+        "Essay,,extra\n"
+        ",2030-01-06\n"
+        "Quiz,whenever\n"
+        "Project,1 Jan 2001\n"
+    )
+    assert homework == [("Worksheet 1", "2030-01-05")]
+    assert errors == [
+        (2, "expected a task and a deadline"),
+        (3, "expected a task and a deadline"),
+        (4, "expected a task and a deadline"),
+        (5, '"whenever" is not a date'),
+        (6, "01 Jan 01 is in the past"),
+    ]
+
+
+def test_rows_past_the_limit_are_refused():
+    rows = "".join(f"Task {i},2030-01-05\n" for i in range(5))
+    homework, errors = _read("task,deadline\n" + rows, max_rows=3)
+    assert len(homework) == 3
+    assert errors == [(5, "only 3 rows can be uploaded at once")]
+
+    homework, errors = _read(rows, max_rows=5)
+    assert (len(homework), errors) == (5, [])
+
+
+def test_files_that_are_not_utf8_are_refused():
+    homework, errors = _read("Worksheet,2030-01-05\nCafé,2030-01-06\n", encoding="latin-1")
+    assert homework == []
+    assert len(errors) == 1 and "not a UTF-8 CSV file" in errors[0][1]
+
+
+def test_a_header_missing_a_column_is_a_bad_row():
+    homework, errors = _read("task\nWorksheet,2030-01-05\n")
+    assert homework == [("Worksheet", "2030-01-05")]
+    assert errors == [(1, "expected a task and a deadline")]
+
+    homework, errors = _read("task,due\nWorksheet,2030-01-05\n")
+    assert errors == [(1, '"due" is not a date')]
+    assert date.fromisoformat(homework[0][1]) == date(2030, 1, 5)
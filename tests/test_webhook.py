@@ -0,0 +1,81 @@
+import http.client, json, queue
+
+import pytest
+
+from dispatch import build_updater
+from tools.fakebot import FakeBot
+from webhook import MAX_BODY_BYTES, SECRET_HEADER, WebhookServer, run_webhook
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 7, "type": "private"},
+        "text": "hi",
+    },
+}
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer(FakeBot(), queue.Queue(), "127.0.0.1", 0, "/hook", "s3cret", 2)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _post(server, headers, body=None, path="/hook"):
+    """Sends a POST with exactly the given headers, returns the status"""
+    conn = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        conn.putrequest("POST", path)
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def _headers(body, secret="s3cret"):
+    headers = {"Content-Length": str(len(body))}
+    if secret is not None:
+        headers[SECRET_HEADER] = secret
+    return headers
+
+
+def test_updates_carrying_the_secret_are_queued(server):
+    body = json.dumps(UPDATE).encode()
+    assert _post(server, _headers(body), body) == 200
+    assert server.update_queue.get(timeout=5).update_id == 1
+    assert _post(server, _headers(body), body, path="/other") == 404
+
+
+def test_a_wrong_or_missing_secret_is_forbidden(server):
+    body = json.dumps(UPDATE).encode()
+    assert _post(server, _headers(body, secret="guess"), body) == 403
+    assert _post(server, _headers(body, secret=None), body) == 403
+    assert server.update_queue.empty()
+
+
+def test_bodies_of_unknown_or_excessive_size_are_refused(server):
+    assert _post(server, {SECRET_HEADER: "s3cret"}) == 413
+    assert _post(server, {SECRET_HEADER: "s3cret", "Content-Length": "-1"}) == 413
+    headers = {SECRET_HEADER: "s3cret", "Content-Length": str(MAX_BODY_BYTES + 1)}
+    assert _post(server, headers) == 413
+    assert _post(server, _headers(b"{"), b"{") == 400
+    assert server.update_queue.empty()
+
+
+def test_the_server_stops_before_the_dispatcher():
+    bot, stopped = FakeBot(), []
+    updater = build_updater(bot, lanes=1, workers=1)
+    server = WebhookServer(bot, updater.dispatcher.update_queue, "127.0.0.1", 0, "/hook", "", 1)
+    for name, stoppable in (("server", server), ("dispatcher", updater.dispatcher)):
+        stop = stoppable.stop
+        stoppable.stop = lambda stop=stop, name=name: stopped.append(name) or stop()
+
+    run_webhook(updater, server, None, "", 1)
+    updater.stop()
+    assert stopped == ["server", "dispatcher"]
@@ -0,0 +1,96 @@
+import logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timing wheel of keyed timers driven by a single thread
+
+    Timers hash into one of `slots` buckets by the tick they are due in, so
+    scheduling and cancelling are O(1). Every tick the thread visits one bucket
+    and hands all keys due in it to callback(keys) as one batch.
+    """
+
+    def __init__(self, callback, tick=1.0, slots=4096, clock=time.time):
+        self.callback = callback
+        self.tick = tick
+        self.clock = clock
+
+        self._slots = [{} for _ in range(slots)]
+        self._timers = {}
+        self._current = int(clock() // tick)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def schedule(self, key, when):
+        """Fires key at the POSIX timestamp when, replacing any timer it has"""
+        with self._lock:
+            self._cancel(key)
+
+            # Timers already due fire on the next tick
+            due_tick = max(int(when // self.tick), self._current + 1)
+            self._slots[due_tick % len(self._slots)][key] = (due_tick, when)
+            self._timers[key] = due_tick
+
+    def cancel(self, key):
+        """Cancels key's timer, returns the seconds it had left or None"""
+        with self._lock:
+            return self._cancel(key)
+
+    def advance(self, now):
+        """Processes every tick up to now, returns the batches of keys that fired"""
+        batches = []
+        while True:
+            with self._lock:
+                if self._current >= int(now // self.tick):
+                    break
+                self._current += 1
+                keys = self._expire(self._current)
+            if keys:
+                batches.append(keys)
+        return batches
+
+    def start(self):
+        """Starts the thread firing timers"""
+        self._thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the thread, leaving pending timers unfired"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+
+    def _cancel(self, key):
+        due_tick = self._timers.pop(key, None)
+        if due_tick is None:
+            return None
+        _, when = self._slots[due_tick % len(self._slots)].pop(key)
+        return max(when - self.clock(), 0)
+
+    def _expire(self, tick):
+        """Pops the keys due at tick, leaving timers due on later laps of the wheel"""
+        slot = self._slots[tick % len(self._slots)]
+        keys = [key for key, (due_tick, _) in slot.items() if due_tick <= tick]
+        for key in keys:
+            del slot[key]
+            del self._timers[key]
+        return keys
+
+    def _run(self):
+        while not self._stopping.is_set():
+            for keys in self.advance(self.clock()):
+                try:
+                    self.callback(keys)
+                except Exception:
+                    logger.exception("Timer callback failed for %d keys", len(keys))
+
+            next_tick = (self._current + 1) * self.tick
+            self._stopping.wait(max(next_tick - self.clock(), 0))
@@ -0,0 +1,765 @@
+"""Micro-benchmarks for the bot's data structures.
+
+Run from the repository root, e.g. `python -m tools.benchmark users`.
+"""
+import argparse, io, itertools, json, os, platform, random, shutil, subprocess, tempfile
+import threading, time, timeit, tracemalloc
+import pandas as pd, parsedatetime as pdt
+from datetime import date, datetime, time as time_of_day, timedelta
+from telegram import Update
+from collections import defaultdict
+from telegram.ext import PicklePersistence, TypeHandler, Updater
+
+from broadcast import Broadcaster
+from deadlines import DeadlineParser
+from dispatch import build_updater
+from homework import HomeworkTable
+from pomodoro import PomodoroHistory
+from search import HomeworkIndex, tokenize
+from sessions import SessionPersistence, SessionStore
+from storage import CsvStorage, SqliteStorage
+from timers import TimerWheel
+from tools.fakebot import FakeBot
+from tools.replay_webhook import synthetic_updates
+from uploads import read_homework_csv
+from users import UserRegistry
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def _per_call(stmt, number):
+    """Returns the best per-call latency of stmt in microseconds"""
+    best = min(timeit.repeat(stmt, number=number, repeat=3))
+    return best / number * 1e6
+
+
+def _fake_users(n):
+    """Generates a users dataframe with n registered users"""
+    chat_ids = random.sample(range(10**9), n)
+    return pd.DataFrame(
+        {
+            "chat_id": chat_ids,
+            "user_name": [f"@user{i}" for i in range(n)],
+            "user_type": ["teacher" if i % 20 == 0 else "student" for i in range(n)],
+            "teacher_subject": ["Physics" if i % 20 == 0 else None for i in range(n)],
+        }
+    )
+
+
+def bench_users(args):
+    """Compares registry lookups against the old users_df boolean mask scan"""
+    print(f"{'users':>10} {'registry (us)':>14} {'mask scan (us)':>15}")
+    for n in args.sizes:
+        df = _fake_users(n)
+        registry = UserRegistry.from_frame(df)
+        chat_ids = df["chat_id"].sample(1000, replace=True).tolist()
+        lookups = iter(chat_ids * 1000)
+
+        registry_us = _per_call(lambda: registry.user_type(next(lookups)), 1000)
+
+        mask_us = float("nan")
+        if not args.skip_scan:
+            chat_id = chat_ids[0]
+            mask_us = _per_call(
+                lambda: df.loc[df[df["chat_id"] == chat_id].index, "user_type"],
+                max(1, 100_000 // n),
+            )
+
+        print(f"{n:>10} {registry_us:>14.3f} {mask_us:>15.1f}")
+
+
+def _allocated(build):
+    """Returns the bytes still allocated by the object build() returns"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+
+def bench_pomodoro(args):
+    """Measures pomodoro history memory per user against the old user_data dicts"""
+    start = int(time.time())
+    tasks = [f"Physics homework {i}" for i in range(100)]
+
+    def history(users):
+        pomodoros = PomodoroHistory(args.limit)
+        for chat_id in range(users):
+            for i in range(args.sessions):
+                pomodoros.add(chat_id, start + i * 1800, 25, tasks[i % 100])
+        return pomodoros
+
+    def user_data(users):
+        return {
+            chat_id: [
+                {
+                    "task": tasks[i % 100],
+                    "start_time": time.strftime("%d/%m %I:%M %p"),
+                    "end_time": time.strftime("%d/%m %I:%M %p"),
+                    "duration": 25,
+                }
+                for i in range(args.sessions)
+            ]
+            for chat_id in range(users)
+        }
+
+    print(f"{args.sessions} sessions recorded per user, history keeps {args.limit}")
+    print(f"{'users':>10} {'history (B/user)':>17} {'user_data (B/user)':>19}")
+    for users in args.users:
+        history_bytes = _allocated(lambda: history(users)) / users
+        user_data_bytes = _allocated(lambda: user_data(users)) / users
+        print(f"{users:>10} {history_bytes:>17.0f} {user_data_bytes:>19.0f}")
+
+
+def bench_timers(args):
+    """Times scheduling, cancelling and firing pomodoro timers on the timer wheel"""
+    print(
+        f"{'timers':>10} {'schedule (us)':>14} {'cancel (us)':>12} "
+        f"{'tick (us)':>10} {'fired':>8} {'B/timer':>8}"
+    )
+    for n in args.timers:
+        now = 1_000_000.0
+        fired = []
+        wheel = TimerWheel(fired.extend, clock=lambda: now)
+        ends = [now + random.uniform(60, 180 * 60) for _ in range(n)]
+
+        started = time.perf_counter()
+        for chat_id, end in enumerate(ends):
+            wheel.schedule(chat_id, end)
+        schedule_us = (time.perf_counter() - started) / n * 1e6
+
+        def filled_wheel():
+            other = TimerWheel(None, clock=lambda: now)
+            for chat_id, end in enumerate(ends):
+                other.schedule(chat_id, end)
+            return other
+
+        memory = _allocated(filled_wheel) / n
+
+        cancelled = range(0, n, 10)
+        started = time.perf_counter()
+        for chat_id in cancelled:
+            wheel.cancel(chat_id)
+        cancel_us = (time.perf_counter() - started) / len(cancelled) * 1e6
+
+        # Firing every remaining timer tick by tick, as the wheel's thread would
+        ticks = 180 * 60 + 1
+        started = time.perf_counter()
+        for _ in range(ticks):
+            now += 1
+            for keys in wheel.advance(now):
+                fired.extend(keys)
+        tick_us = (time.perf_counter() - started) / ticks * 1e6
+
+        print(
+            f"{n:>10} {schedule_us:>14.2f} {cancel_us:>12.2f} "
+            f"{tick_us:>10.1f} {len(fired):>8} {memory:>8.0f}"
+        )
+
+
+def _dispatch(updater, updates):
+    """Returns the seconds taken to handle updates and whether chats kept their order"""
+    handled = []
+    done = threading.Event()
+
+    def reply(update, context):
+        context.bot.send_message(update.effective_chat.id, "Homework")
+        handled.append((update.effective_chat.id, update.update_id))
+        if len(handled) == len(updates):
+            done.set()
+
+    updater.dispatcher.add_handler(TypeHandler(Update, reply))
+    threading.Thread(target=updater.dispatcher.start, daemon=True).start()
+
+    started = time.perf_counter()
+    for update in updates:
+        updater.update_queue.put(update)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    updater.dispatcher.stop()
+
+    last_seen = {}
+    in_order = True
+    for chat_id, update_id in handled:
+        in_order &= last_seen.get(chat_id, 0) < update_id
+        last_seen[chat_id] = update_id
+    return elapsed, in_order
+
+
+def bench_dispatch(args):
+    """Compares update throughput of the plain dispatcher and the chat lanes"""
+    print(
+        f"{args.updates} updates over {args.chats} chats, "
+        f"{args.latency * 1000:.0f} ms per Bot API call"
+    )
+    print(f"{'dispatcher':>12} {'updates/s':>10} {'in order':>9}")
+
+    bot = FakeBot(latency=args.latency)
+    updates = [
+        Update.de_json(update, bot)
+        for update in synthetic_updates(args.updates, args.chats)
+    ]
+    runs = [("plain", Updater(bot=bot, use_context=True))] + [
+        (f"{lanes} lanes", build_updater(bot, lanes)) for lanes in args.lanes
+    ]
+    for name, updater in runs:
+        elapsed, in_order = _dispatch(updater, updates)
+        print(f"{name:>12} {len(updates) / elapsed:>10.0f} {str(in_order):>9}")
+
+
+def bench_broadcast(args):
+    """Broadcasts to students through 429s, checking rate limits and coalescing"""
+    bot = FakeBot(latency=args.latency)
+    broadcaster = Broadcaster(bot, rate=args.rate, backoff=0.1)
+    broadcaster.topic("homework", lambda items: "\n".join(items), args.window)
+    broadcaster.start()
+
+    students = list(range(1, args.students + 1))
+    started = time.monotonic()
+    for i in range(args.adds):
+        broadcaster.send(students, f"Homework {i}", "homework")
+        if i == 0:
+            bot.flood(args.floods)
+    while broadcaster.backlog():
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+    broadcaster.stop()
+
+    sends = bot.sent("sendMessage")
+    times = sorted(at for _, _, at in sends)
+    busiest = max(
+        sum(1 for other in times[i:] if other - at < 1) for i, at in enumerate(times)
+    )
+    per_chat = {}
+    for _, data, _ in sends:
+        per_chat.setdefault(data["chat_id"], []).append(data["text"])
+    merged = all(
+        len(texts) == 1 and texts[0].count("Homework") == args.adds
+        for texts in per_chat.values()
+    )
+
+    print(f"{len(sends)} messages to {args.students} students in {elapsed:.1f}s")
+    print(f"busiest second: {busiest} sends (limit {args.rate})")
+    print(f"429s retried: {broadcaster.retries}, dropped: {broadcaster.dropped}")
+    print(f"one merged message per student: {merged and len(per_chat) == args.students}")
+
+
+FIXTURE_START = date(2030, 1, 1)
+FIXTURE_SUBJECTS = [f"Subject {i}" for i in range(50)]
+
+
+def _fixtures(directory, n):
+    """Writes users and hw CSVs with n rows each unless they exist, returns their paths"""
+    users_csv = os.path.join(directory, f"users_{n}.csv")
+    hw_csv = os.path.join(directory, f"hw_{n}.csv")
+    if not os.path.exists(users_csv):
+        _fake_users(n).to_csv(users_csv)
+    if not os.path.exists(hw_csv):
+        days = [random.randrange(365) for _ in range(n)]
+        pd.DataFrame(
+            {
+                "subj": [random.choice(FIXTURE_SUBJECTS) for _ in range(n)],
+                "task": [f"Worksheet {i}" for i in range(n)],
+                "deadline": [(FIXTURE_START + timedelta(d)).isoformat() for d in days],
+            }
+        ).to_csv(hw_csv)
+    return users_csv, hw_csv
+
+
+def _open_csv(workdir, users_csv, hw_csv):
+    """Returns an opened CsvStorage on copies of the fixtures"""
+    shutil.copy(users_csv, os.path.join(workdir, "users.csv"))
+    shutil.copy(hw_csv, os.path.join(workdir, "hw.csv"))
+    storage = CsvStorage(
+        *(
+            os.path.join(workdir, name)
+            for name in (
+                "users.csv",
+                "hw.csv",
+                "pomodoros.csv",
+                "timers.csv",
+                "journal.jsonl",
+            )
+        )
+    )
+    storage.open()
+    return storage
+
+
+def _time_storage_ops(storage, chat_ids):
+    """Times each storage call the handlers and jobs make, in microseconds per call"""
+    lookups = iter(random.choices(chat_ids, k=200_000))
+    subjects = iter(random.choices(FIXTURE_SUBJECTS, k=200_000))
+    new_ids = iter(range(10**10, 10**11))
+    deadline = (FIXTURE_START + timedelta(200)).isoformat()
+    digest_until = FIXTURE_START + timedelta(4)
+
+    # A page from the middle of each subject's homework
+    page_cursor = (FIXTURE_START + timedelta(180), 0)
+
+    def add_and_register():
+        chat_id = next(new_ids)
+        storage.add_user(chat_id, "@new")
+        storage.register_user(chat_id, "student")
+
+    results = {
+        "user_type": _per_call(lambda: storage.user_type(next(lookups)), 10_000),
+        "add_user+register_user": _per_call(add_and_register, 1000),
+        "add_homework": _per_call(
+            lambda: storage.add_homework(next(subjects), "New task", deadline), 1000
+        ),
+        "homework_page": _per_call(
+            lambda: storage.homework_page(next(subjects), page_cursor), 10_000
+        ),
+        "subjects_page": _per_call(storage.subjects_page, 10_000),
+        "homework_due": _per_call(lambda: storage.homework_due(digest_until), 20),
+        "next_deadline": _per_call(storage.next_deadline, 10_000),
+        "students": _per_call(storage.students, 3),
+    }
+
+    # Expiring the first three days of homework, about 1% of it, in one call
+    started = time.perf_counter()
+    now = datetime.combine(FIXTURE_START + timedelta(2), time_of_day.min)
+    storage.expire_homework(now)
+    results["expire_homework"] = (time.perf_counter() - started) * 1e6
+    return results
+
+
+def bench_storage(args):
+    """Times storage operations on both backends at growing table sizes"""
+    fixtures = args.fixtures or tempfile.mkdtemp(prefix="fixtures-")
+    os.makedirs(fixtures, exist_ok=True)
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    report = {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "results": [],
+    }
+
+    # Results of an earlier run to compare against
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            for r in json.load(f)["results"]:
+                baseline[(r["backend"], r["rows"], r["op"])] = r["value"]
+
+    def result(backend, n, op, value, unit):
+        report["results"].append(
+            {
+                "backend": backend,
+                "rows": n,
+                "op": op,
+                "value": round(value, 3),
+                "unit": unit,
+            }
+        )
+        line = f"{backend:>7} {n:>9} {op:>24} {value:>12.2f} {unit:<3}"
+        before = baseline.get((backend, n, op))
+        if before:
+            line += f" {value / before:>6.2f}x baseline"
+        print(line)
+
+    for n in args.sizes:
+        users_csv, hw_csv = _fixtures(fixtures, n)
+        chat_ids = pd.read_csv(users_csv, usecols=["chat_id"])["chat_id"].tolist()
+
+        with tempfile.TemporaryDirectory() as workdir:
+            started = time.perf_counter()
+            storage = _open_csv(workdir, users_csv, hw_csv)
+            result("csv", n, "open", time.perf_counter() - started, "s")
+            memory = _allocated(
+                lambda: (
+                    UserRegistry.from_frame(pd.read_csv(users_csv, index_col=0)),
+                    HomeworkTable.from_frame(pd.read_csv(hw_csv, index_col=0)),
+                )
+            )
+            result("csv", n, "memory", memory / 2**20, "MiB")
+            for op, us in _time_storage_ops(storage, chat_ids).items():
+                result("csv", n, op, us, "us")
+
+            started = time.perf_counter()
+            storage.flusher.flush()
+            result("csv", n, "flush", time.perf_counter() - started, "s")
+            storage.close()
+
+            db = os.path.join(workdir, "bench.db")
+            storage = SqliteStorage(db)
+            storage.open()
+            started = time.perf_counter()
+            storage.import_frames(
+                pd.read_csv(users_csv, index_col=0), pd.read_csv(hw_csv, index_col=0)
+            )
+            result("sqlite", n, "import", time.perf_counter() - started, "s")
+
+            # Most of a fresh database still sits in its write-ahead log
+            size = sum(
+                os.path.getsize(path)
+                for path in (db, db + "-wal")
+                if os.path.exists(path)
+            )
+            result("sqlite", n, "file size", size / 2**20, "MiB")
+            for op, us in _time_storage_ops(storage, chat_ids).items():
+                result("sqlite", n, op, us, "us")
+            storage.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.fixtures:
+        shutil.rmtree(fixtures)
+
+
+# Deadlines as teachers type them, a few phrases making up most of them
+PHRASES = (
+    "tomorrow",
+    "next friday",
+    "next monday",
+    "in 3 days",
+    "in a week",
+    "25 July",
+    "1st of june",
+    "Friday",
+    "end of month",
+    "12/20/2030",
+)
+
+
+def bench_deadlines(args):
+    """Compares a Calendar per message against the shared, memoized parser"""
+    weights = [1 / (rank + 1) for rank in range(len(PHRASES))]
+    texts = random.choices(PHRASES, weights, k=args.phrases)
+
+    def fresh():
+        for text in texts:
+            time_struct, status = pdt.Calendar().parse(text)
+            if status:
+                date(*time_struct[:3])
+
+    calendar = pdt.Calendar()
+
+    def shared():
+        for text in texts:
+            calendar.parse(text)
+
+    parser = DeadlineParser()
+
+    def cold():
+        for text in texts:
+            parser._cache.clear()
+            parser.parse(text)
+
+    def warm():
+        for text in texts:
+            parser.parse(text)
+
+    def batch():
+        parser.parse_many(texts)
+
+    print(f"{'parser':>18} {'us/phrase':>10}")
+    for name, run in (
+        ("calendar per call", fresh),
+        ("shared calendar", shared),
+        ("parser, uncached", cold),
+        ("parser, warm", warm),
+        ("parse_many", batch),
+    ):
+        best = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{name:>18} {best / len(texts) * 1e6:>10.1f}")
+    print(f"cache hits {parser.hits}, misses {parser.misses}")
+
+
+def _empty_storage(backend, directory):
+    """Returns an opened, empty storage of a backend in a directory"""
+    if backend == "sqlite":
+        storage = SqliteStorage(os.path.join(directory, "bench.db"))
+    else:
+        storage = CsvStorage(
+            *(
+                os.path.join(directory, name)
+                for name in (
+                    "users.csv",
+                    "hw.csv",
+                    "pomodoros.csv",
+                    "timers.csv",
+                    "journal.jsonl",
+                )
+            )
+        )
+    storage.open()
+    return storage
+
+
+def bench_upload(args):
+    """Times a homework CSV upload against adding its rows one at a time"""
+    print(f"{'backend':>7} {'rows':>6} {'one at a time':>14} {'parse':>8} {'bulk add':>9}")
+    for n in args.rows:
+        days = [random.randrange(1, 365) for _ in range(n)]
+        lines = [f"Worksheet {i},{day} days from now" for i, day in enumerate(days)]
+        data = ("task,deadline\n" + "\n".join(lines)).encode()
+        homework = [
+            (f"Worksheet {i}", (date.today() + timedelta(day)).isoformat())
+            for i, day in enumerate(days)
+        ]
+
+        for backend in ("csv", "sqlite"):
+            with tempfile.TemporaryDirectory() as workdir:
+                os.mkdir(os.path.join(workdir, "one"))
+                os.mkdir(os.path.join(workdir, "bulk"))
+
+                storage = _empty_storage(backend, os.path.join(workdir, "one"))
+                started = time.perf_counter()
+                for task, deadline in homework:
+                    storage.add_homework("Physics", task, deadline)
+                one_at_a_time = time.perf_counter() - started
+                storage.close()
+
+                storage = _empty_storage(backend, os.path.join(workdir, "bulk"))
+                started = time.perf_counter()
+                parsed, errors = read_homework_csv(io.BytesIO(data), DeadlineParser(), n)
+                parse = time.perf_counter() - started
+                started = time.perf_counter()
+                storage.add_homework_many("Physics", parsed)
+                bulk = time.perf_counter() - started
+                storage.close()
+                assert not errors and len(parsed) == n
+
+            print(
+                f"{backend:>7} {n:>6} {one_at_a_time * 1000:>11.1f} ms"
+                f" {parse * 1000:>5.1f} ms {bulk * 1000:>6.1f} ms"
+            )
+
+
+SEARCH_WORDS = (
+    "lab report worksheet essay chapter quiz revision exercise project reading "
+    "practice paper notes summary questions test draft presentation review problem "
+    "set pendulum cells fractions algebra poem war reaction graph map vectors"
+).split()
+SEARCH_SUBJECTS = ("Physics", "Chemistry", "Biology", "Math", "History", "English")
+SEARCH_QUERIES = ("lab", "physics lab", "wor", "chapter 12", "e", "pendulum review 7")
+
+
+def _fake_task(i):
+    """Returns a task name of a few words and a number"""
+    words = random.sample(SEARCH_WORDS, random.randint(1, 4))
+    return " ".join(words).capitalize() + f" {i % 50}"
+
+
+def bench_search(args):
+    """Times inline search queries on the homework index against a linear scan"""
+    for n in args.rows:
+        homework = [
+            (
+                hw_id,
+                random.choice(SEARCH_SUBJECTS),
+                _fake_task(hw_id),
+                FIXTURE_START + timedelta(random.randrange(365)),
+            )
+            for hw_id in range(n)
+        ]
+
+        index = HomeworkIndex()
+        started = time.perf_counter()
+        for hw in homework:
+            index.add(*hw)
+        build = time.perf_counter() - started
+
+        def build_index():
+            index = HomeworkIndex()
+            for hw in homework:
+                index.add(*hw)
+            return index
+
+        memory = _allocated(build_index)
+        print(f"\n{n} homework: built in {build:.2f} s, {memory / 2**20:.1f} MiB")
+
+        def scan(query):
+            terms = tokenize(query)
+            matches = [
+                hw
+                for hw in homework
+                if all(term in f"{hw[1]} {hw[2]}".lower() for term in terms)
+            ]
+            return sorted(matches, key=lambda hw: hw[3])[:50]
+
+        print(f"{'query':>20} {'matches':>8} {'index us':>9} {'scan us':>9}")
+        for query in SEARCH_QUERIES:
+            matches = len(index.search(query, limit=n))
+            searched = _per_call(lambda: index.search(query), 20)
+            scanned = _per_call(lambda: scan(query), 1)
+            print(f"{query:>20} {matches:>8} {searched:>9.0f} {scanned:>9.0f}")
+
+        new_ids = itertools.count(n)
+
+        def add_and_remove():
+            hw_id = next(new_ids)
+            index.add(hw_id, "Physics", "Lab report 3", FIXTURE_START)
+            index.remove(hw_id)
+
+        print(f"add+remove: {_per_call(add_and_remove, 10_000):.1f} us")
+
+
+def _fake_session(user_id):
+    """Returns the user_data of a teacher halfway through adding homework"""
+    return {
+        "school": "default",
+        "teacher_subject": "Physics",
+        "chat_id": user_id,
+        "task": f"Worksheet {user_id}",
+        "deadline": FIXTURE_START + timedelta(user_id % 365),
+    }
+
+
+def _boot_sessions(path):
+    persistence = SessionPersistence(SessionStore(path))
+    persistence.store.open()
+    persistence.get_user_data()
+    persistence.get_conversations("teacher")
+    return persistence
+
+
+def _boot_pickle(path):
+    persistence = PicklePersistence(path)
+    persistence.get_user_data()
+    persistence.get_conversations("teacher")
+    return persistence
+
+
+def bench_sessions(args):
+    """Times booting with past users' sessions saved, lazily loaded against PicklePersistence"""
+    print(
+        f"{'users':>8} {'lazy boot ms':>13} {'lazy MiB':>9} {'first use us':>13}"
+        f" {'pickle boot ms':>15} {'pickle MiB':>11}"
+    )
+    for n in args.users:
+        directory = tempfile.mkdtemp(prefix="bench-sessions-")
+        db = os.path.join(directory, "sessions.db")
+        pickle = os.path.join(directory, "sessions.pickle")
+        user_ids = range(1, n + 1)
+
+        store = SessionStore(db, max_changes=2 * n + 1)
+        store.open()
+        for user_id in user_ids:
+            store.save_user_data(user_id, _fake_session(user_id))
+            store.save_conversation("teacher", (user_id, user_id), 5)
+        store.close()
+
+        persistence = PicklePersistence(pickle, on_flush=True)
+        persistence.chat_data = defaultdict(dict)
+        persistence.bot_data = {}
+        persistence.user_data = defaultdict(
+            dict, {user_id: _fake_session(user_id) for user_id in user_ids}
+        )
+        persistence.conversations = {
+            "teacher": {(user_id, user_id): 5 for user_id in user_ids}
+        }
+        persistence.flush()
+
+        started = time.perf_counter()
+        lazy = _boot_sessions(db)
+        lazy_boot = time.perf_counter() - started
+        lazy.store.close()
+
+        lazy = None
+        tracemalloc.start()
+        lazy = _boot_sessions(db)
+        lazy_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # Resuming the conversations of a sample of the users
+        sample = iter(random.sample(user_ids, min(n, 1000)))
+        conversations = lazy.get_conversations("teacher")
+
+        def resume():
+            user_id = next(sample)
+            conversations.get((user_id, user_id))
+            lazy.user_data[user_id]
+
+        first_use = _per_call(resume, min(n, 1000) // 3)
+        lazy.store.close()
+
+        started = time.perf_counter()
+        _boot_pickle(pickle)
+        pickle_boot = time.perf_counter() - started
+        pickle_memory = _allocated(lambda: _boot_pickle(pickle))
+
+        print(
+            f"{n:>8} {lazy_boot * 1000:>13.1f} {lazy_memory / 2**20:>9.2f} {first_use:>13.0f}"
+            f" {pickle_boot * 1000:>15.0f} {pickle_memory / 2**20:>11.1f}"
+        )
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    users_parser = subparsers.add_parser("users", help=bench_users.__doc__)
+    users_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    users_parser.add_argument("--skip-scan", action="store_true")
+    users_parser.set_defaults(func=bench_users)
+
+    pomodoro_parser = subparsers.add_parser("pomodoro", help=bench_pomodoro.__doc__)
+    pomodoro_parser.add_argument("--users", type=int, nargs="+", default=(1_000, 10_000))
+    pomodoro_parser.add_argument("--sessions", type=int, default=200)
+    pomodoro_parser.add_argument("--limit", type=int, default=50)
+    pomodoro_parser.set_defaults(func=bench_pomodoro)
+
+    timers_parser = subparsers.add_parser("timers", help=bench_timers.__doc__)
+    timers_parser.add_argument("--timers", type=int, nargs="+", default=(10_000, 100_000))
+    timers_parser.set_defaults(func=bench_timers)
+
+    dispatch_parser = subparsers.add_parser("dispatch", help=bench_dispatch.__doc__)
+    dispatch_parser.add_argument("--updates", type=int, default=2000)
+    dispatch_parser.add_argument("--chats", type=int, default=200)
+    dispatch_parser.add_argument("--latency", type=float, default=0.02)
+    dispatch_parser.add_argument("--lanes", type=int, nargs="+", default=(4, 8, 16))
+    dispatch_parser.set_defaults(func=bench_dispatch)
+
+    broadcast_parser = subparsers.add_parser("broadcast", help=bench_broadcast.__doc__)
+    broadcast_parser.add_argument("--students", type=int, default=300)
+    broadcast_parser.add_argument("--adds", type=int, default=3)
+    broadcast_parser.add_argument("--floods", type=int, default=5)
+    broadcast_parser.add_argument("--rate", type=int, default=25)
+    broadcast_parser.add_argument("--window", type=float, default=1.0)
+    broadcast_parser.add_argument("--latency", type=float, default=0.03)
+    broadcast_parser.set_defaults(func=bench_broadcast)
+
+    storage_parser = subparsers.add_parser("storage", help=bench_storage.__doc__)
+    storage_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=(10_000, 100_000, 1_000_000)
+    )
+    storage_parser.add_argument("--fixtures", help="directory to keep the CSVs in")
+    storage_parser.add_argument("--json", help="file to write the results to")
+    storage_parser.add_argument("--baseline", help="results of an earlier run to compare")
+    storage_parser.set_defaults(func=bench_storage)
+
+    deadlines_parser = subparsers.add_parser("deadlines", help=bench_deadlines.__doc__)
+    deadlines_parser.add_argument("--phrases", type=int, default=10_000)
+    deadlines_parser.set_defaults(func=bench_deadlines)
+
+    upload_parser = subparsers.add_parser("upload", help=bench_upload.__doc__)
+    upload_parser.add_argument("--rows", type=int, nargs="+", default=(1_000, 10_000))
+    upload_parser.set_defaults(func=bench_upload)
+
+    search_parser = subparsers.add_parser("search", help=bench_search.__doc__)
+    search_parser.add_argument("--rows", type=int, nargs="+", default=(10_000, 100_000))
+    search_parser.set_defaults(func=bench_search)
+
+    sessions_parser = subparsers.add_parser("sessions", help=bench_sessions.__doc__)
+    sessions_parser.add_argument("--users", type=int, nargs="+", default=(10_000, 100_000))
+    sessions_parser.set_defaults(func=bench_sessions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""A local stand-in for the Bot API used by the load and replay tools."""
+import itertools, queue, threading, time
+from telegram import Bot
+from telegram.error import RetryAfter, Unauthorized
+from telegram.utils.request import Request
+
+FAKE_TOKEN = "123456:fake-token-for-local-runs"
+
+
+class FakeBot(Bot):
+    """Bot that answers Bot API calls locally and records them instead of sending
+
+    Updates put on `updates` (as dicts) are handed out by getUpdates, so the
+    real polling loop can be driven. `latency` seconds are slept per call,
+    flood() makes the next sends fail with 429s and block() makes sends to
+    some chats fail as if their users blocked the bot.
+    """
+
+    def __init__(self, token=FAKE_TOKEN, latency=0.0):
+        # Sized for any number of dispatcher threads, no connections are made
+        super().__init__(token, request=Request(con_pool_size=64))
+        self.latency = latency
+        self.calls = []
+        self.updates = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._floods = 0
+        self._retry_after = 1
+        self._blocked = set()
+
+    def _post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        data = dict(data or {}, **(api_kwargs or {}))
+        if endpoint == "getUpdates":
+            return self._get_updates(data)
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if endpoint == "sendMessage" and self._floods:
+                self._floods -= 1
+                raise RetryAfter(self._retry_after)
+            if endpoint == "sendMessage" and int(data["chat_id"]) in self._blocked:
+                raise Unauthorized("Forbidden: bot was blocked by the user")
+            self.calls.append((endpoint, data, time.monotonic()))
+
+        if endpoint == "getMe":
+            return {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Dionysus",
+                "username": "dionysus_hw_bot",
+            }
+        if endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._reply(data)
+        return True
+
+    def flood(self, count, retry_after=1):
+        """Fails the next count sendMessage calls with 429 Too Many Requests"""
+        with self._lock:
+            self._floods = count
+            self._retry_after = retry_after
+
+    def block(self, chat_ids):
+        """Fails every later sendMessage to the chats with 403 Forbidden"""
+        with self._lock:
+            self._blocked.update(chat_ids)
+
+    def sent(self, endpoint=None):
+        """Returns the recorded (endpoint, data, time) calls, optionally of one endpoint"""
+        with self._lock:
+            return [call for call in self.calls if endpoint in (None, call[0])]
+
+    def _reply(self, data):
+        chat_id = int(data.get("chat_id") or 1)
+        return {
+            "message_id": data.get("message_id") or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+
+    def _get_updates(self, data):
+        """Waits up to the long poll timeout for updates, then drains the queue"""
+        try:
+            updates = [self.updates.get(timeout=float(data.get("timeout") or 0) or 0.1)]
+        except queue.Empty:
+            return []
+
+        limit = int(data.get("limit") or 100)
+        while len(updates) < limit:
+            try:
+                updates.append(self.updates.get_nowait())
+            except queue.Empty:
+                break
+        return updates
@@ -0,0 +1,221 @@
+"""Load test driving the bot's conversations through the real dispatcher.
+
+Virtual teachers and students register, then keep walking through the menus
+set up by main.add_handlers against a FakeBot, with storage in a temporary
+directory. Each user sends its next update as soon as the previous one has
+been handled. Reports throughput and per-handler latency, e.g.
+
+    python -m tools.loadtest --users 50 200 --duration 10
+"""
+import argparse, collections, itertools, logging, os, shutil, tempfile, threading, time
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import main as bot_main
+from cache import RenderCache
+from dispatch import build_updater, iter_handlers
+from sessions import SessionPersistence, SessionStore
+from storage import CsvStorage
+from tools.fakebot import FakeBot
+from tools.replay_webhook import percentile
+
+SUBJECTS = ["Physics", "Math", "Chemistry", "Biology", "History"]
+
+
+def _teacher_steps(i):
+    """Returns a teacher's registration steps and the steps they then repeat"""
+    register = [
+        ("text", "/start"),
+        ("data", "reg_teacher"),
+        ("text", SUBJECTS[i % len(SUBJECTS)]),
+        ("data", "teacher_confirm"),
+    ]
+    loop = [
+        ("text", "/teacher"),
+        ("data", "add_hw"),
+        ("text", f"Worksheet {i}"),
+        ("text", "next friday"),
+        ("data", "confirm_add_hw"),
+        ("data", "view_hw"),
+        ("data", "back_teacher_menu"),
+        ("data", "cancel"),
+    ]
+    return register, loop
+
+
+def _student_steps(i):
+    """Returns a student's registration steps and the steps they then repeat"""
+    register = [
+        ("text", "/start"),
+        ("data", "reg_student"),
+        ("data", "student_confirm"),
+    ]
+    loop = [
+        ("text", "/student"),
+        ("data", "homework"),
+        ("data", SUBJECTS[i % len(SUBJECTS)].lower()),
+        ("data", "back_subjects"),
+        ("data", "back_student_menu"),
+        ("data", "completed_tasks"),
+        ("data", "back_student_menu"),
+        ("data", "pomodoro"),
+        ("text", "Revision"),
+        ("text", "25"),
+        ("data", "pomodoro_cancel"),
+        ("data", "cancel"),
+    ]
+    return register, loop
+
+
+def _update(update_id, chat_id, kind, value):
+    """Builds the JSON of a message or button press from a private chat"""
+    chat = {"id": chat_id, "type": "private"}
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": chat}
+    if kind == "text":
+        entities = []
+        if value.startswith("/"):
+            entities = [{"type": "bot_command", "offset": 0, "length": len(value)}]
+        message.update({"from": user, "text": value, "entities": entities})
+        return {"update_id": update_id, "message": message}
+
+    query = {
+        "id": str(update_id),
+        "from": user,
+        "chat_instance": str(chat_id),
+        "message": dict(message, text="menu"),
+        "data": value,
+    }
+    return {"update_id": update_id, "callback_query": query}
+
+
+def _time_handlers(dispatcher, latencies):
+    """Wraps every handler callback to record its latency under its name"""
+    for handler in iter_handlers(dispatcher):
+        callback = handler.callback
+        if not callable(callback) or hasattr(callback, "__wrapped__"):
+            continue
+
+        def timed(update, context, callback=callback):
+            started = time.perf_counter()
+            try:
+                return callback(update, context)
+            finally:
+                latencies[callback.__name__].append(time.perf_counter() - started)
+
+        timed.__wrapped__ = callback
+        handler.callback = timed
+
+
+def run(users, args):
+    """Runs the load with a number of concurrent users, returns updates/s and latencies"""
+    directory = tempfile.mkdtemp(prefix="loadtest-")
+    path = lambda name: os.path.join(directory, name)
+    bot_main.storage = CsvStorage(
+        path("users.csv"),
+        path("hw.csv"),
+        path("pomodoros.csv"),
+        path("timers.csv"),
+        path("journal.jsonl"),
+        shards_dir=path("schools"),
+    )
+    bot_main.render_cache = RenderCache()
+    bot_main.storage.open()
+
+    # Persisting the conversations as run_worker() does, unless asked not to
+    sessions = None
+    if not args.no_sessions:
+        sessions = SessionPersistence(
+            SessionStore(path("sessions.db"), bot_main.SESSION_FLUSH_INTERVAL)
+        )
+        sessions.store.open()
+
+    bot = FakeBot(latency=args.latency)
+    bot_main.broadcaster.bot = bot
+    updater = build_updater(bot, args.lanes, persistence=sessions)
+    dispatcher = updater.dispatcher
+    bot_main.add_handlers(dispatcher)
+
+    latencies = collections.defaultdict(list)
+    _time_handlers(dispatcher, latencies)
+
+    scripts = {}
+    for i in range(users):
+        chat_id = 1000 + i
+        steps = _teacher_steps(i) if i < users * args.teachers else _student_steps(i)
+        register, loop = steps
+        scripts[chat_id] = itertools.chain(register, itertools.cycle(loop))
+
+    update_ids = itertools.count(1)
+    handled = 0
+    lock = threading.Lock()
+    finished = threading.Event()
+    running = set(scripts)
+    deadline = None
+
+    def send(chat_id):
+        kind, value = next(scripts[chat_id])
+        update = _update(next(update_ids), chat_id, kind, value)
+        updater.update_queue.put(Update.de_json(update, bot))
+
+    def next_step(update, context):
+        """Sends the user's next update once their last one was handled"""
+        nonlocal handled
+        chat_id = update.effective_chat.id
+        with lock:
+            handled += 1
+            if time.perf_counter() > deadline:
+                running.discard(chat_id)
+                if not running:
+                    finished.set()
+                return
+        send(chat_id)
+
+    dispatcher.add_handler(TypeHandler(Update, next_step), group=1)
+    updater.job_queue.start()
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    for chat_id in scripts:
+        send(chat_id)
+    finished.wait()
+    elapsed = time.perf_counter() - started
+
+    dispatcher.stop()
+    updater.job_queue.stop()
+    bot_main.storage.close()
+    if sessions is not None:
+        sessions.store.close()
+    shutil.rmtree(directory)
+    return handled / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, nargs="+", default=(50, 200))
+    parser.add_argument("--teachers", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--lanes", type=int, default=bot_main.HANDLER_LANES)
+    parser.add_argument("--no-sessions", action="store_true")
+    args = parser.parse_args()
+
+    # Keeping the bot's own INFO logs out of the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot_main.broadcaster.start()
+    for users in args.users:
+        throughput, latencies = run(users, args)
+        print(f"\n{users} users: {throughput:.0f} updates/s")
+        print(f"{'handler':>28} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, values in sorted(latencies.items()):
+            p50, p95, p99 = (percentile(values, pct) * 1000 for pct in (50, 95, 99))
+            print(f"{name:>28} {len(values):>7} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}")
+    bot_main.broadcaster.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Copies users.csv, hw.csv and pomodoros.csv into an SQLite database for the sqlite storage backend.
+
+The homework of other schools, in the directories of --schools, is copied too.
+
+Run from the repository root, e.g. `python -m tools.migrate_csv --db dionysus.db`.
+Replay any pending journal first by starting and stopping the bot on the csv backend.
+"""
+import argparse, os
+import pandas as pd
+
+from storage import HomeworkShard, SqliteStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", default="users.csv")
+    parser.add_argument("--hw", default="hw.csv")
+    parser.add_argument("--pomodoros", default="pomodoros.csv")
+    parser.add_argument("--schools", default="schools")
+    parser.add_argument("--db", default="dionysus.db")
+    args = parser.parse_args()
+
+    if os.path.exists("journal.jsonl") and os.path.getsize("journal.jsonl"):
+        parser.error("journal.jsonl has changes that are not in the CSV snapshots yet")
+
+    schools = []
+    if os.path.isdir(args.schools):
+        schools = sorted(
+            school
+            for school in os.listdir(args.schools)
+            if os.path.isdir(os.path.join(args.schools, school))
+        )
+    for school in schools:
+        if HomeworkShard.has_journal(os.path.join(args.schools, school)):
+            parser.error(f"school {school} has changes that are not in its snapshot yet")
+
+    pomodoro_df = None
+    if os.path.exists(args.pomodoros):
+        pomodoro_df = pd.read_csv(args.pomodoros, index_col=0)
+
+    storage = SqliteStorage(args.db)
+    storage.open()
+    user_count, hw_count = storage.import_frames(
+        pd.read_csv(args.users, index_col=0),
+        pd.read_csv(args.hw, index_col=0),
+        pomodoro_df,
+    )
+    for school in schools:
+        hw_path = os.path.join(args.schools, school, "hw.csv")
+        if os.path.exists(hw_path):
+            _, count = storage.import_frames(
+                pd.DataFrame(), pd.read_csv(hw_path, index_col=0), school=school
+            )
+            hw_count += count
+    storage.close()
+
+    print(
+        f"Migrated {user_count} users and {hw_count} homework tasks "
+        f"of {len(schools) + 1} schools into {args.db}"
+    )
+
+
+if __name__ == "__main__":
+    main()
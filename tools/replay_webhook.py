@@ -0,0 +1,172 @@
+"""Replays Update JSON at the bot's webhook and reports latency.
+
+Run from the repository root. With --url the updates are POSTed at a running
+bot and the acknowledgement latency is measured. With --local webhook or
+--local polling the updates go through an in-process dispatcher on a FakeBot,
+either via WebhookServer or via Updater.start_polling, and the time from
+sending each update to its handler running is measured, e.g.
+
+    python -m tools.replay_webhook --local webhook --count 5000
+    python -m tools.replay_webhook --local polling --count 5000
+"""
+import argparse, http.client, json, threading, time
+from urllib.parse import urlsplit
+from telegram import Update
+from telegram.ext import TypeHandler, Updater
+
+from tools.fakebot import FakeBot
+from webhook import SECRET_HEADER, WebhookServer, run_webhook
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of a list of numbers"""
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def synthetic_updates(count, chats):
+    """Generates /help message updates spread over a number of chats"""
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = update_id % chats + 1
+        updates.append(
+            {
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "Student"},
+                    "text": "/help",
+                },
+            }
+        )
+    return updates
+
+
+def load_updates(path):
+    """Reads recorded updates, one JSON object per line"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def post_updates(url, secret, updates, connections):
+    """POSTs updates over keep-alive connections, returns send times and ack latencies"""
+    parts = urlsplit(url)
+    sent = {}
+    acks = []
+    lock = threading.Lock()
+
+    def worker(share):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+        for update in share:
+            body = json.dumps(update).encode()
+            started = time.perf_counter()
+            with lock:
+                sent[update["update_id"]] = started
+            conn.request(
+                "POST",
+                parts.path or "/",
+                body,
+                {"Content-Type": "application/json", SECRET_HEADER: secret},
+            )
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"Webhook answered {response.status}")
+            with lock:
+                acks.append(time.perf_counter() - started)
+        conn.close()
+
+    threads = [
+        threading.Thread(target=worker, args=(updates[i::connections],))
+        for i in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sent, acks
+
+
+def run_local(args, updates):
+    """Sends updates through an in-process dispatcher, returns send and handle times"""
+    bot = FakeBot()
+    updater = Updater(bot=bot, use_context=True)
+
+    handled = {}
+    done = threading.Event()
+
+    def record(update, context):
+        handled[update.update_id] = time.perf_counter()
+        if len(handled) == len(updates):
+            done.set()
+
+    updater.dispatcher.add_handler(TypeHandler(Update, record))
+
+    if args.local == "webhook":
+        server = WebhookServer(
+            bot, updater.update_queue, "127.0.0.1", 0, "/hook", args.secret, args.workers
+        )
+        url = "http://127.0.0.1:%d/hook" % server.server_address[1]
+        run_webhook(updater, server, url, args.secret, args.workers)
+        sent, acks = post_updates(url, args.secret, updates, args.connections)
+    else:
+        updater.start_polling(poll_interval=0, timeout=1)
+        sent, acks = {}, []
+        for update in updates:
+            sent[update["update_id"]] = time.perf_counter()
+            bot.updates.put(update)
+
+    done.wait(timeout=60)
+    updater.stop()
+    if args.local == "webhook":
+        server.stop()
+
+    latencies = [handled[i] - sent[i] for i in handled]
+    return sent, acks, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="webhook URL of a running bot")
+    target.add_argument("--local", choices=("webhook", "polling"))
+    parser.add_argument("--updates", help="JSON lines file of recorded updates")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--secret", default="replay-secret")
+    args = parser.parse_args()
+
+    updates = (
+        load_updates(args.updates)
+        if args.updates
+        else synthetic_updates(args.count, args.chats)
+    )
+
+    started = time.perf_counter()
+    if args.url:
+        _, acks = post_updates(args.url, args.secret, updates, args.connections)
+        latencies = []
+    else:
+        _, acks, latencies = run_local(args, updates)
+    elapsed = time.perf_counter() - started
+
+    print(f"{len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s)")
+    for name, values in (("acknowledged", acks), ("handled", latencies)):
+        if values:
+            print(
+                f"{name:>12}: p50 {percentile(values, 50) * 1000:.2f} ms, "
+                f"p95 {percentile(values, 95) * 1000:.2f} ms, "
+                f"p99 {percentile(values, 99) * 1000:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Measures how throughput scales with the number of cluster worker processes.
+
+Starts a ClusterFront and a number of worker processes sharing an SQLite
+database in a temporary directory, each a dispatcher behind a WebhookServer
+with a FakeBot. The virtual teachers and students of tools/loadtest.py then
+walk through the menus, each sending its next update as soon as its worker
+has handled the last one. Reports the throughput per worker count, e.g.
+
+    python -m tools.scaletest --workers 1 2 4 --users 400 --duration 10
+"""
+import argparse, itertools, logging, multiprocessing, os, queue, secrets, shutil, tempfile, time
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import main as bot_main
+from cache import RenderCache
+from cluster import Cluster, ClusterFront
+from dispatch import build_updater
+from storage import SqliteStorage
+from tools.fakebot import FakeBot
+from tools.loadtest import _student_steps, _teacher_steps, _update
+from webhook import WebhookServer, run_webhook
+
+URL_PATH = "/scaletest"
+
+
+def _worker(index, workers, db, secret, args, handled, stop):
+    """Runs worker index of a cluster until stop is set"""
+    logging.getLogger().setLevel(logging.WARNING)
+    bot_main.cluster = Cluster(workers, index)
+    bot_main.storage = SqliteStorage(db)
+    bot_main.render_cache = RenderCache()
+    bot_main.storage.open()
+    bot_main.homework_versions.update(bot_main.storage.homework_versions())
+
+    bot = FakeBot(latency=args.latency)
+    bot_main.broadcaster.bot = bot
+    bot_main.broadcaster.rate = bot_main.BROADCAST_RATE / workers
+    bot_main.broadcaster.start()
+
+    updater = build_updater(bot, args.lanes)
+    bot_main.add_handlers(updater.dispatcher)
+    updater.dispatcher.add_handler(
+        TypeHandler(Update, lambda update, context: handled.put(update.effective_chat.id)),
+        group=1,
+    )
+    if workers > 1:
+        updater.job_queue.run_repeating(bot_main.sync_homework, bot_main.CLUSTER_SYNC)
+
+    server = WebhookServer(
+        bot,
+        updater.update_queue,
+        "127.0.0.1",
+        args.port + index,
+        URL_PATH,
+        secret,
+        args.connections,
+    )
+    run_webhook(updater, server, None, secret, args.connections)
+    handled.put(("ready", index))
+
+    stop.wait()
+    server.stop()
+    updater.dispatcher.stop()
+    updater.job_queue.stop()
+    bot_main.broadcaster.stop()
+    bot_main.storage.close()
+
+
+def run(workers, args):
+    """Runs the load on a number of workers, returns updates/s and how many were handled"""
+    directory = tempfile.mkdtemp(prefix="scaletest-")
+    db = os.path.join(directory, "dionysus.db")
+    SqliteStorage(db).open()
+
+    secret = secrets.token_urlsafe(16)
+    context = multiprocessing.get_context("spawn")
+    handled = context.Queue()
+    stop = context.Event()
+    processes = [
+        context.Process(
+            target=_worker, args=(i, workers, db, secret, args, handled, stop)
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in range(workers):
+        handled.get(timeout=60)
+
+    front = ClusterFront(
+        "127.0.0.1",
+        0,
+        URL_PATH,
+        "",
+        workers,
+        "127.0.0.1",
+        args.port,
+        secret,
+        args.connections,
+    )
+
+    scripts = {}
+    for i in range(args.users):
+        chat_id = 1000 + i
+        steps = _teacher_steps(i) if i < args.users * args.teachers else _student_steps(i)
+        register, loop = steps
+        scripts[chat_id] = itertools.chain(register, itertools.cycle(loop))
+    update_ids = itertools.count(1)
+
+    def send(chat_id):
+        kind, value = next(scripts[chat_id])
+        front.forward(_update(next(update_ids), chat_id, kind, value))
+
+    # Sending each user's next update as soon as the last one was handled
+    started = time.perf_counter()
+    deadline = started + args.duration
+    for chat_id in scripts:
+        send(chat_id)
+    count = 0
+    running = len(scripts)
+    while running:
+        try:
+            chat_id = handled.get(timeout=30)
+        except queue.Empty:
+            print(f"  gave up waiting on {running} users")
+            break
+        count += 1
+        if time.perf_counter() < deadline:
+            send(chat_id)
+        else:
+            running -= 1
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    front.stop()
+    for process in processes:
+        process.join()
+    shutil.rmtree(directory)
+    return count / elapsed, count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=(1, 2, 4))
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--teachers", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--lanes", type=int, default=bot_main.HANDLER_LANES)
+    parser.add_argument("--connections", type=int, default=bot_main.CLUSTER_CONNECTIONS)
+    parser.add_argument("--port", type=int, default=8300)
+    args = parser.parse_args()
+
+    # Keeping the bot's own INFO logs out of the report
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{os.cpu_count()} CPUs, {args.users} users, {args.latency * 1000:.0f} ms Bot API latency")
+    print(f"{'workers':>8} {'updates/s':>10} {'speedup':>8} {'handled':>8}")
+    baseline = None
+    for workers in args.workers:
+        throughput, count = run(workers, args)
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>10.0f} {throughput / baseline:>7.2f}x {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
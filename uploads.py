@@ -0,0 +1,48 @@
+import csv, io
+
+HEADER = ["task", "deadline"]
+
+
+def read_homework_csv(f, deadline_parser, max_rows=10_000):
+    """Reads (task, deadline) rows from a binary CSV file of tasks and deadlines
+
+    Rows are parsed as they are read and their deadlines in one parse_many
+    batch. Returns the valid (task, YYYY-MM-DD) pairs and (line, error) pairs
+    for the rows that could not be used. An optional task,deadline header and
+    blank lines are skipped.
+    """
+    rows = []
+    errors = []
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    try:
+        for row in reader:
+            line = reader.line_num
+            cells = [cell.strip() for cell in row]
+            if not any(cells) or (line == 1 and [c.lower() for c in cells] == HEADER):
+                continue
+            if len(rows) + len(errors) >= max_rows:
+                errors.append((line, f"only {max_rows} rows can be uploaded at once"))
+                break
+            if len(cells) != 2 or not all(cells):
+                errors.append((line, "expected a task and a deadline"))
+                continue
+            rows.append((line, cells[0], cells[1]))
+    except (UnicodeDecodeError, csv.Error) as e:
+        errors.append((reader.line_num + 1, f"not a UTF-8 CSV file ({e})"))
+    finally:
+        text.detach()
+
+    deadlines = deadline_parser.parse_many([deadline for _, _, deadline in rows])
+    today = deadline_parser.today()
+    homework = []
+    for (line, task, text_deadline), deadline in zip(rows, deadlines):
+        if deadline is None:
+            errors.append((line, f'"{text_deadline}" is not a date'))
+        elif deadline < today:
+            errors.append((line, f"{deadline.strftime('%d %b %y')} is in the past"))
+        else:
+            homework.append((task.replace(",", " "), deadline.isoformat()))
+
+    errors.sort()
+    return homework, errors
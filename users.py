@@ -0,0 +1,152 @@
+import pandas as pd
+
+COLUMNS = ["chat_id", "user_name", "user_type", "teacher_subject", "digest", "school"]
+
+# School of users who registered without a school's link, and of everyone
+# who registered before there were schools
+DEFAULT_SCHOOL = "default"
+
+
+def _clean(value):
+    """Turns pandas' missing values into None"""
+    return None if pd.isna(value) else value
+
+
+class UserRegistry:
+    """Registered users keyed by chat_id for constant time lookups
+
+    The chat_ids of each school's users are indexed by user type too, in
+    dicts used as ordered sets, so listing a school's students only goes
+    through those students.
+    """
+
+    def __init__(self, records=()):
+        self._users = {}
+        self._schools = {}
+        for record in records:
+            self._put(dict(record, chat_id=int(record["chat_id"])))
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds a registry from a users dataframe"""
+        registry = cls()
+        registry.load_frame(df)
+        return registry
+
+    def load_frame(self, df):
+        """Replaces the registry's contents with a users dataframe"""
+        self._users = {}
+        self._schools = {}
+        for row in df.itertuples(index=False):
+            # Older users.csv files have no digest or school column
+            record = {column: _clean(getattr(row, column, None)) for column in COLUMNS}
+            record["chat_id"] = int(record["chat_id"])
+            record["digest"] = bool(record["digest"])
+            record["school"] = record["school"] or DEFAULT_SCHOOL
+            self._put(record)
+
+    def to_frame(self):
+        """Returns the registry as a users dataframe"""
+        return pd.DataFrame(list(self._users.values()), columns=COLUMNS)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __iter__(self):
+        return iter(self._users.values())
+
+    def get(self, chat_id):
+        """Returns the user's record or None for unknown users"""
+        return self._users.get(chat_id)
+
+    def user_type(self, chat_id):
+        """Returns 'teacher', 'student' or None if the user has not registered"""
+        user = self._users.get(chat_id)
+        return user["user_type"] if user else None
+
+    def teacher_subject(self, chat_id):
+        """Returns the subject taught by a teacher or None"""
+        user = self._users.get(chat_id)
+        return user["teacher_subject"] if user else None
+
+    def school(self, chat_id):
+        """Returns the school of a user or None for unknown users"""
+        user = self._users.get(chat_id)
+        return user["school"] if user else None
+
+    def chat_ids(self, user_type, school=DEFAULT_SCHOOL):
+        """Returns the chat_ids of every user of a type in a school"""
+        return list(self._schools.get(school, {}).get(user_type, ()))
+
+    def digest_subscribers(self, school=DEFAULT_SCHOOL):
+        """Returns the chat_ids of a school's users who asked for the daily digest"""
+        users = self._users
+        return [
+            chat_id
+            for members in self._schools.get(school, {}).values()
+            for chat_id in members
+            if users[chat_id].get("digest")
+        ]
+
+    def set_digest(self, chat_id, enabled):
+        """Subscribes or unsubscribes a registered user from the daily digest"""
+        self._users[chat_id]["digest"] = enabled
+
+    def add(self, chat_id, user_name):
+        """Adds a new unregistered user, returns False if they already exist"""
+        if chat_id in self._users:
+            return False
+
+        self._put(
+            {
+                "chat_id": chat_id,
+                "user_name": user_name,
+                "user_type": None,
+                "teacher_subject": None,
+                "digest": False,
+                "school": DEFAULT_SCHOOL,
+            }
+        )
+        return True
+
+    def register(self, chat_id, user_type, teacher_subject=None, school=DEFAULT_SCHOOL):
+        """Sets the user type (and subject for teachers) and school of a user"""
+        self.add(chat_id, None)
+        self._put(
+            dict(
+                self._users[chat_id],
+                user_type=user_type,
+                teacher_subject=teacher_subject,
+                school=school,
+            )
+        )
+
+    def apply(self, op, chat_id, values):
+        """Replays a journalled change"""
+        if op == "delete":
+            self._drop(chat_id)
+        elif op == "insert":
+            self._put(dict(values, school=values.get("school") or DEFAULT_SCHOOL))
+        else:
+            user = self._users.get(chat_id, {"chat_id": chat_id, "school": DEFAULT_SCHOOL})
+            self._put(dict(user, **values))
+
+    def _put(self, record):
+        """Stores a user's record, moving them to their school's index"""
+        self._drop(record["chat_id"])
+        self._users[record["chat_id"]] = record
+        types = self._schools.setdefault(record["school"], {})
+        types.setdefault(record["user_type"], {})[record["chat_id"]] = None
+
+    def _drop(self, chat_id):
+        user = self._users.pop(chat_id, None)
+        if user is not None:
+            types = self._schools[user["school"]]
+            del types[user["user_type"]][chat_id]
+            if not types[user["user_type"]]:
+                del types[user["user_type"]]
+            if not types:
+                del self._schools[user["school"]]
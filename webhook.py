@@ -0,0 +1,136 @@
+import hmac, json, logging, socketserver, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Largest request body read, well above any update Telegram sends
+MAX_BODY_BYTES = 1 << 20
+
+
+class UpdateRequestHandler(BaseHTTPRequestHandler):
+    """Accepts Telegram's update POSTs on keep-alive connections
+
+    Requests to the server's url_path carrying its secret_token are passed to
+    accept(body), which raises ValueError on a malformed update.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # Each connection holds a thread, so idle or stalled connections are
+    # dropped after this many seconds instead of starving everyone else
+    timeout = 10
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.url_path:
+            self._reply(404)
+            return
+
+        # Rejecting requests that do not carry the secret set with set_webhook
+        token = self.headers.get(SECRET_HEADER, "")
+        if server.secret_token and not hmac.compare_digest(token, server.secret_token):
+            self._reply(403)
+            return
+
+        # Refusing bodies of unknown or unreasonable size rather than reading them
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            self._reply(413)
+            return
+
+        try:
+            self.accept(self.rfile.read(length))
+        except ValueError:
+            self._reply(400)
+            return
+        self._reply(200)
+
+    def accept(self, body):
+        raise NotImplementedError
+
+    def _reply(self, status):
+        # Closing after a rejection, as the body may be left unread on the socket
+        if status != 200:
+            self.close_connection = True
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        """Skipping the default per-request access log"""
+
+
+class _UpdateHandler(UpdateRequestHandler):
+    """Puts each update on the server's update queue"""
+
+    def accept(self, body):
+        server = self.server
+        server.update_queue.put(Update.de_json(json.loads(body), server.bot))
+
+
+class WebhookServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP listener that puts Telegram updates on a dispatcher's update queue
+
+    Connections are served by a fixed pool of worker threads rather than a new
+    thread per request, and closed once idle for UpdateRequestHandler.timeout
+    seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bot, update_queue, listen, port, url_path, secret_token, workers):
+        super().__init__((listen, port), _UpdateHandler)
+        self.bot = bot
+        self.update_queue = update_queue
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="webhook")
+        self._thread = None
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def start(self):
+        """Serves requests from a background thread"""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="webhook", daemon=True
+        )
+        self._thread.start()
+        logger.info("Listening for webhook updates on %s:%d", *self.server_address[:2])
+
+    def stop(self):
+        """Stops accepting requests and waits for those in flight"""
+        self.shutdown()
+        self._pool.shutdown()
+        self.server_close()
+
+
+def run_webhook(updater, server, webhook_url, secret_token, max_connections):
+    """Starts the dispatcher and job queue behind a WebhookServer instead of polling
+
+    Without a webhook_url the server is fed by something else than Telegram,
+    such as a cluster front. updater.idle() stops everything on SIGINT/SIGTERM;
+    the updater must come from dispatch.build_updater, whose ChatUpdater stops
+    the server before the dispatcher.
+    """
+    updater.job_queue.start()
+    threading.Thread(
+        target=updater.dispatcher.start, name="dispatcher", daemon=True
+    ).start()
+
+    server.start()
+    if webhook_url is not None:
+        updater.bot.set_webhook(
+            url=webhook_url, secret_token=secret_token, max_connections=max_connections
+        )
+
+    # Letting Updater.idle() and Updater.stop() treat the webhook as running
+    updater.running = True
+    updater.server = server